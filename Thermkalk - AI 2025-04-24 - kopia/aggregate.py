@@ -0,0 +1,278 @@
+# aggregate.py
+#
+# En gemensam genomgång av kalkylraderna för materialspecifikationen,
+# detaljerade beräkningar och sammanställningen. Tidigare räknade varje vy,
+# och mallen för detaljerade beräkningar en gång till, fram tejp, spoltråd,
+# band, folie och arbetstider på egen hand. Här räknas varje rad fram en gång
+# till en RowCosts och raderna summeras per materialgrupp (GroupCosts).
+#
+# Resultatet cachas per utkast och gäller så länge utkastets revision och
+# materialregistrets version är oförändrade (AggregateCache).
+
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+
+# Tillbehör som ingår i radernas materialkostnad
+TAPE_LAMELL = "9556523"   # tejp för lamellmatta
+TAPE = "PTBCR07550"       # tejp (Conlit Fire Mat och sammanställningen)
+SPOOL = "4023313"         # spoltråd
+BAND = "9556892"          # band
+FOIL = "4025571"          # folie
+POPNIT = "85329500"       # popnit till aluminiumplåt
+PRICE_KEYS = (TAPE_LAMELL, TAPE, SPOOL, BAND, FOIL)
+
+# Arbetstid för folie: grundtid per meter och tilläggstid per m²
+FOIL_TIME_PER_M = 0.03
+FOIL_TIME_PER_M2 = 0.049
+
+
+def _number(value):
+    """Tal ur ett radfält; tomma eller ogiltiga värden (t.ex. dimension "") blir 0."""
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+class RowCosts(NamedTuple):
+    """Härledda kostnader och tider för en kalkylrad."""
+    tape_key: str             # tejpens artikelnr (efter materialnamnet), eller None
+    tape_price: float         # á-pris för tejpen (0 utan tejp)
+    tape_cost: float
+    spool_cost: float
+    band_cost: float
+    foil_cost: float
+    material_cost: float      # radens materialkostnad med full precision
+    shown_material_cost: float  # som material_cost men med avrundad foliekostnad (som tabellen visar)
+    foil_work: float
+    work_time: float          # isolering + ytbeklädnad + band + folie
+    small_pipe: bool          # dimension under 150 mm (rörstödens grundtid)
+    rorstod_work: float
+    total_work: float         # work_time + rörstöd
+    bend_foil_work: float     # motsvarande för böjraden (boj_length i stället för length)
+    bend_total_work: float
+
+
+class GroupCosts(NamedTuple):
+    """En rad i materialspecifikationen: summerad mängd och kostnad per material."""
+    group_key: str
+    artikelnamn: str
+    artikelnr: str
+    senast_uppdaterad: str
+    mängd: float
+    enhet: str
+    apris: float
+    total_cost: float
+
+
+class DraftAggregate(NamedTuple):
+    rows: list                # [(rad, RowCosts)] i kalkylens ordning
+    groups: list              # [GroupCosts] i materialspecifikationens ordning
+    group_total: float        # summan av gruppernas kostnader
+    material_cost_rounded: float  # summan av radvis avrundad materialkostnad
+    work_time: float          # summan av radernas work_time (utan rörstöd)
+
+
+def tape_key(row):
+    """Tejp för raden efter materialnamnet: lamellmatta eller Conlit Fire Mat."""
+    material = (row.get("material") or "").lower()
+    if "lamellmatta" in material:
+        return TAPE_LAMELL
+    if "conlit fire mat" in material:
+        return TAPE
+    return None
+
+
+def foil_work_time(row, length=None):
+    """Arbetstid för folie (om folie är vald)."""
+    if not row.get("folie"):
+        return 0
+    length = row.get("length", 0) if length is None else length
+    return FOIL_TIME_PER_M * length + FOIL_TIME_PER_M2 * row.get("area", 0)
+
+
+def _rorstod_work(row, cladding_name, base_insulation):
+    # Rörstöd ger arbetstid bara under aluminium- eller stålplåt
+    cladding = cladding_name.lower()
+    if "aluminium" not in cladding and "stålplåt" not in cladding:
+        return 0
+    dimension = _number(row.get("dimension"))
+    rorstod = row.get("rorstod", 0)
+    steel = "stålplåt" in cladding
+    if dimension < 150:
+        return round(rorstod * (0.19 if steel else 0.144), 3)
+    omkrets = (dimension + 2 * base_insulation) / 1000 * 3.14
+    return round(rorstod * omkrets * (0.484 if steel else 0.36), 3)
+
+
+def row_costs(row, prices, cladding_name="", base_insulation=0):
+    """
+    RowCosts för en rad. prices är {artikelnr: kostnad} för PRICE_KEYS;
+    cladding_name och base_insulation behövs bara för rörstödens arbetstid.
+    """
+    key = tape_key(row)
+    tape_price = prices[key] if key else 0
+    tape_cost = row.get("tejp_quantity", 0) * tape_price if row.get("tejp_quantity") else 0
+    spool_cost = row.get("spoltrad_kg", 0) * prices[SPOOL]
+    band_cost = row.get("band_length", 0) * prices[BAND] if row.get("band") else 0
+    foil_cost = row.get("foil_area", 0) * prices[FOIL]
+    base_cost = row.get("price", 0) + row.get("ytbekladnad_cost", 0) + tape_cost + spool_cost + band_cost
+
+    work_time = row.get("work_time_isolering", 0) + row.get("work_time_ytbekladnad", 0) + row.get("band_arbetstid", 0)
+    foil_work = foil_work_time(row)
+    rorstod_work = _rorstod_work(row, cladding_name, base_insulation)
+    bend_foil_work = foil_work_time(row, row.get("boj_length", 0)) if row.get("boj") else 0
+    return RowCosts(
+        tape_key=key,
+        tape_price=tape_price,
+        tape_cost=tape_cost,
+        spool_cost=spool_cost,
+        band_cost=band_cost,
+        foil_cost=foil_cost,
+        material_cost=base_cost + foil_cost,
+        shown_material_cost=base_cost + round(foil_cost, 0),
+        foil_work=foil_work,
+        work_time=work_time + foil_work,
+        small_pipe=_number(row.get("dimension")) < 150,
+        rorstod_work=rorstod_work,
+        total_work=work_time + foil_work + rorstod_work,
+        bend_foil_work=bend_foil_work,
+        bend_total_work=work_time + bend_foil_work + rorstod_work,
+    )
+
+
+def material_groups(rows, materialer):
+    """
+    Summerar raderna per materialgrupp för materialspecifikationen: basmaterial,
+    ytbeklädnad, popnit, extra lager, spoltråd, tejp, folie och band.
+    Justerade á-priser (adjusted_price) på rader och lager används för basmaterial och lager.
+    """
+    summary = {}
+
+    def add(group_key, quantity, cost, **info):
+        group = summary.get(group_key)
+        if group is None:
+            summary[group_key] = dict(info, group_key=group_key, mängd=quantity, total_cost=cost)
+        else:
+            group["mängd"] += quantity
+            group["total_cost"] += cost
+
+    def info(key, default_name="Okänt material", default_artikelnr="Okänt", default_senast="Okänt"):
+        data = materialer.get(key) if key else None
+        if not data:
+            return default_name, default_artikelnr, default_senast, 0
+        return (data.get("artikelnamn", default_name), data.get("artikelnr", default_artikelnr),
+                data.get("senast_uppdaterad", default_senast), data.get("kostnad", 0))
+
+    for pipe in rows:
+        # Basmaterial: area för rör, längd för övriga
+        mat_key = pipe.get("material_key")
+        if pipe.get("pipe_type", "Rör") == "Rör":
+            quantity, unit = pipe.get("area", 0), "m²"
+        else:
+            quantity, unit = pipe.get("length", 0), "m"
+        _, artikelnr, senast, price = info(mat_key)
+        add("base_" + (mat_key if mat_key else "unknown"), quantity,
+            quantity * pipe.get("adjusted_price", price),
+            artikelnamn=pipe.get("material", "Okänt material"), artikelnr=artikelnr,
+            senast_uppdaterad=senast, enhet=unit, apris=price)
+
+        # Ytbeklädnad (och popnit för aluminiumplåt: 1 ask per 100 m²)
+        yt_key = pipe.get("ytbekladnad_key")
+        if yt_key:
+            name, artikelnr, senast, price = info(yt_key)
+            yt_area = pipe.get("ytbekladnad_area", 0)
+            add("yt_" + yt_key, yt_area, pipe.get("ytbekladnad_cost", 0),
+                artikelnamn=name, artikelnr=artikelnr, senast_uppdaterad=senast, enhet="m²", apris=price)
+            if yt_key in materialer and "aluminium" in name.lower():
+                popnit = materialer.get(POPNIT, {})
+                popnit_price = popnit.get("kostnad", 0)
+                add("popnit", yt_area / 100, yt_area / 100 * popnit_price,
+                    artikelnamn="Popnit", artikelnr=popnit.get("artikelnr", POPNIT),
+                    senast_uppdaterad="", enhet="ask", apris=popnit_price)
+
+        # Extra lager: mängden är isolering plus tillbehör
+        for layer in pipe.get("layers", []):
+            layer_key = layer.get("material_key")
+            name, artikelnr, senast, price = info(layer_key)
+            quantity = layer.get("insulation", 0) + layer.get("tillbehor", 0)
+            add("layer_" + (layer_key if layer_key else "unknown"), quantity,
+                quantity * layer.get("adjusted_price", price),
+                artikelnamn=name, artikelnr=artikelnr, senast_uppdaterad=senast, enhet="mm", apris=price)
+
+        if pipe.get("spoltrad_kg", 0) > 0:
+            name, artikelnr, senast, price = info(SPOOL, default_name="Spoltråd 0,70")
+            add("spool", pipe["spoltrad_kg"], pipe["spoltrad_kg"] * price,
+                artikelnamn=name, artikelnr=artikelnr, senast_uppdaterad=senast, enhet="kg", apris=price)
+
+        if pipe.get("tejp_quantity", 0) > 0:
+            name, artikelnr, senast, price = info(TAPE, default_name="Tejp")
+            add("tejp", pipe["tejp_quantity"], pipe["tejp_quantity"] * price,
+                artikelnamn=name, artikelnr=artikelnr, senast_uppdaterad=senast, enhet="rle", apris=price)
+
+        if pipe.get("foil_area", 0) > 0:
+            if materialer.get(FOIL):
+                name, artikelnr, senast, price = info(FOIL, default_name="Folie")
+            else:
+                name, artikelnr, senast, price = "Folie", FOIL, "2025-03-05", 50.0
+            add("folie", pipe["foil_area"], pipe["foil_area"] * price,
+                artikelnamn=name, artikelnr=artikelnr, senast_uppdaterad=senast, enhet="m²", apris=price)
+
+        if pipe.get("band") and pipe.get("band_length", 0) > 0:
+            name, artikelnr, senast, price = info(BAND, default_name="Band", default_artikelnr=BAND)
+            add("band", pipe["band_length"], pipe["band_length"] * price,
+                artikelnamn=name, artikelnr=artikelnr, senast_uppdaterad=senast, enhet="m", apris=price)
+
+    return [GroupCosts(**group) for group in summary.values()]
+
+
+def costed_rows(rows, materialer, prices):
+    """[(rad, RowCosts)] för raderna (t.ex. en sida av kalkylen)."""
+    result = []
+    for row in rows:
+        cladding = materialer.get(row.get("ytbekladnad_key") or "")
+        base = materialer.get(row.get("material_key") or "")
+        result.append((row, row_costs(row, prices,
+                                      cladding_name=cladding.get("artikelnamn", "") if cladding else "",
+                                      base_insulation=base.get("isoleringstjocklek", 0) if base else 0)))
+    return result
+
+
+def aggregate(rows, materialer, prices):
+    """Räknar fram RowCosts för alla rader och materialgrupperna i en genomgång av utkastet."""
+    costs = costed_rows(rows, materialer, prices)
+    material_cost_rounded = sum((round(row_cost.material_cost, 0) for _, row_cost in costs), 0.0)
+    work_time = sum((row_cost.work_time for _, row_cost in costs), 0.0)
+    groups = material_groups(rows, materialer)
+    return DraftAggregate(rows=costs, groups=groups, group_total=sum(group.total_cost for group in groups),
+                          material_cost_rounded=material_cost_rounded, work_time=work_time)
+
+
+class AggregateCache:
+    """
+    Senaste DraftAggregate per utkast. key är det som resultatet beror på
+    (utkastets revision och materialregistrets version); en annan nyckel
+    räknar om. De size senast använda utkasten behålls.
+    """
+
+    def __init__(self, size=32):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, draft_id, key, build):
+        with self._lock:
+            entry = self._entries.get(draft_id)
+            if entry is not None and entry[0] == key:
+                self._entries.move_to_end(draft_id)
+                return entry[1]
+        result = build()
+        with self._lock:
+            self._entries[draft_id] = (key, result)
+            self._entries.move_to_end(draft_id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return result
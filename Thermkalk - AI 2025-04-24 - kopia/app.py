@@ -1,29 +1,163 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
-import sqlite3, json, datetime, math
-from materials import materialer  # Importerar materialdata från materials.py
+from flask import (Flask, render_template, stream_template, request, redirect, url_for, session, flash,
+                   get_flashed_messages, g, jsonify, send_file, stream_with_context)
+import datetime, gzip, math, tempfile
+from markupsafe import Markup, escape
+from werkzeug.datastructures import MultiDict
+try:
+    import brotli  # valfritt; utan det komprimeras materialregistret med gzip
+except ImportError:
+    brotli = None
+from materials_snapshot import get_materialer  # Materialdata från materials.py (via förkompilerad ögonblicksbild)
+from catalog import MaterialCatalog
+from drafts import create_draft_store
+from totals import RunningTotals, bid_summary
+from aggregate import aggregate, costed_rows, AggregateCache, PRICE_KEYS
+from detail_rows import detail_rows, thousands
+from customers import CustomerRegistry
+from recipe_import import import_recipes
+from export import bid_sections, write_xlsx, csv_chunks
+from db import (ConnectionPool, init_db, load_bid, count_rows, save_bid_record, list_bids, delete_bid_record,
+                list_revisions, load_revision, search_bids, HIT_START, HIT_END, FILTER_COLUMNS, encode_cursor,
+                decode_cursor)
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_here'  # Ändra till ett riktigt hemligt värde
 
 # --- Databashantering ---
-def get_db_connection():
-    conn = sqlite3.connect('anbud.db')
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def init_db():
-    conn = get_db_connection()
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS anbud (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            datum TEXT,
-            data TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-init_db()
+# Anbuden lagras normaliserat (bids + bid_rows), se db.py
+app.config.setdefault("DB_PATH", "anbud.db")
+app.config.setdefault("DB_POOL_SIZE", 5)                 # anslutningar per arbetsprocess
+app.config.setdefault("DB_CACHE_SIZE_KB", 16384)         # sidcache per anslutning
+app.config.setdefault("DB_MMAP_SIZE", 64 * 1024 * 1024)  # minnesmappad del av databasfilen
+app.config.setdefault("DB_CACHED_STATEMENTS", 256)       # förberedda satser som återanvänds
+init_db(app.config["DB_PATH"])
+db_pool = ConnectionPool(app.config["DB_PATH"],
+                         size=app.config["DB_POOL_SIZE"],
+                         cache_size_kb=app.config["DB_CACHE_SIZE_KB"],
+                         mmap_size=app.config["DB_MMAP_SIZE"],
+                         cached_statements=app.config["DB_CACHED_STATEMENTS"])
+
+def get_db():
+    """Anslutning från poolen för den aktuella förfrågan; lämnas tillbaka vid teardown."""
+    if "db" not in g:
+        g.db = db_pool.acquire()
+    return g.db
+
+@app.teardown_appcontext
+def release_db(exception):
+    conn = g.pop("db", None)
+    if conn is not None:
+        db_pool.release(conn)
+
+# Materialregistret läses från ögonblicksbilden (byggs om om materials.py har ändrats)
+materialer = get_materialer()
+# Index över materialregistret; invalideras när materialdata ändras
+catalog = MaterialCatalog(materialer)
+
+# --- Utkast (pågående kalkyl) ---
+# Kalkylraderna lagras på servern; sessionen innehåller bara utkastets id.
+# Lagringen håller även utkastets löpande summor (totals.py). Standard är
+# operationsloggen, där ändringar också kan ångras (/undo, /redo).
+app.config.setdefault("DRAFT_STORE", "oplog")         # "oplog", "sqlite" eller "files"
+app.config.setdefault("DRAFT_STORE_PATH", "drafts.db")
+
+def accessory_prices():
+    """Tillbehörspriserna som radernas materialkostnad räknas med."""
+    return {key: materialer.get(key, {}).get("kostnad", 0) for key in PRICE_KEYS}
+
+drafts = create_draft_store(app.config["DRAFT_STORE"], app.config["DRAFT_STORE_PATH"],
+                            totals=RunningTotals(accessory_prices))
+
+# Radkostnader och materialgrupper (aggregate.py), cachade per utkastrevision
+# och materialregisterversion så att vyerna delar en genomgång av raderna
+draft_aggregates = AggregateCache()
+# Färdigformaterade rader för Detaljerade beräkningar (detail_rows.py), per sida
+draft_detail_rows_cache = AggregateCache()
+
+def draft_aggregate(draft_id):
+    key = (drafts.revision(draft_id), catalog.version)
+    return draft_aggregates.get(draft_id, key,
+                                lambda: aggregate(drafts.rows(draft_id), materialer, accessory_prices()))
+
+def draft_detail_rows(draft_id, offset, limit):
+    """Formaterade rader för en sida av Detaljerade beräkningar."""
+    key = (drafts.revision(draft_id), catalog.version, offset, limit)
+    return draft_detail_rows_cache.get(draft_id, key, lambda: detail_rows(
+        costed_rows(drafts.rows(draft_id, offset, limit), materialer, accessory_prices()),
+        materialer, start=offset + 1))
+
+# --- Strömmad rendering och sidindelning ---
+# Långa tabeller (kalkylrader) visas en sida i taget, och sidan skickas i
+# bitar medan mallen renderas. Minnet per förfrågan beror då på sidstorleken,
+# inte på hur många rader kalkylen eller anbudet har.
+app.config.setdefault("ROWS_PER_PAGE", 500)
+app.config.setdefault("STREAM_CHUNK_SIZE", 16 * 1024)  # tecken per skickad bit
+
+def _buffered(chunks, size):
+    """Slår ihop mallens små bitar till bitar om minst size tecken."""
+    buffer, length = [], 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield "".join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+def stream_page(template_name, **context):
+    """Som render_template, men svaret skickas medan mallen renderas."""
+    # Sessionen sparas innan första biten skickas. Flashmeddelandena tas
+    # därför ur sessionen nu, inte först när layouten renderas.
+    get_flashed_messages()
+    return app.response_class(_buffered(stream_template(template_name, **context),
+                                        app.config["STREAM_CHUNK_SIZE"]))
+
+def page_window(total, endpoint, **values):
+    """
+    Sidan som ?page= pekar på, för total rader. Returnerar (offset, limit, pager)
+    där pager har page, pages och länkarna till föregående och nästa sida.
+    """
+    per_page = app.config["ROWS_PER_PAGE"]
+    pages = max(math.ceil(total / per_page), 1)
+    try:
+        page = min(max(int(request.args.get("page", 1)), 1), pages)
+    except ValueError:
+        page = 1
+    pager = {"page": page, "pages": pages,
+             "prev_url": url_for(endpoint, page=page - 1, **values) if page > 1 else None,
+             "next_url": url_for(endpoint, page=page + 1, **values) if page < pages else None}
+    return (page - 1) * per_page, per_page, pager
+
+def current_draft_id():
+    """Id för sessionens utkast; skapar ett nytt om det saknas."""
+    draft_id = session.get("draft_id")
+    if not draft_id or not drafts.exists(draft_id):
+        draft_id = drafts.create()
+        session["draft_id"] = draft_id
+    # Flytta över rader från äldre sessioner där pipe_list låg i cookien
+    legacy_rows = session.pop("pipe_list", None)
+    if legacy_rows:
+        drafts.replace(draft_id, legacy_rows)
+    return draft_id
+
+def start_new_draft(rows=None):
+    """Ersätter sessionens utkast med ett nytt (tomt eller med givna rader)."""
+    close_draft()
+    draft_id = drafts.create()
+    if rows:
+        drafts.replace(draft_id, rows)
+    session["draft_id"] = draft_id
+    return draft_id
+
+def close_draft():
+    draft_id = session.pop("draft_id", None)
+    session.pop("pipe_list", None)
+    if draft_id:
+        drafts.drop(draft_id)
+
+def get_pipe_list():
+    return drafts.rows(current_draft_id())
 
 # --- Beräkningsfunktion ---
 def calculate_pipe(form):
@@ -32,9 +166,9 @@ def calculate_pipe(form):
     if not material_key:
         return None, "Välj ett basmaterial."
     
-    # Hämta materialdata från materialregistret
-    data = materialer.get(material_key)
-    if not data:
+    # Materialets förberäknade profil (värden och flaggor) från katalogen
+    profile = catalog.profile(material_key)
+    if not profile:
         return None, "Valt material finns inte."
     
     # Hämta rörtyp (standard "Rör")
@@ -53,7 +187,7 @@ def calculate_pipe(form):
         dimension_mm = 0
 
     # Basisolering (i mm) från basmaterialet
-    base_insulation = data.get("isoleringstjocklek", 0)
+    base_insulation = profile.isoleringstjocklek
     
     # --- Extra lager (t.ex. extra isolering eller tillbehör) ---
     material_layers = form.getlist("material_layer")
@@ -62,9 +196,9 @@ def calculate_pipe(form):
     layers_info = []
     for i, mat_key in enumerate(material_layers):
         if mat_key:
-            mat = materialer.get(mat_key)
+            mat = catalog.profile(mat_key)
             if mat:
-                insulation = mat.get("isoleringstjocklek", 0)
+                insulation = mat.isoleringstjocklek
                 extra_insulation += insulation
                 try:
                     tillbehor = float(layer_tillbehor_list[i]) if i < len(layer_tillbehor_list) and layer_tillbehor_list[i].strip() != "" else 0.0
@@ -73,7 +207,7 @@ def calculate_pipe(form):
                 layers_info.append({
                     "material_key": mat_key,
                     "insulation": insulation,
-                    "artikelnamn": mat.get("artikelnamn"),
+                    "artikelnamn": mat.artikelnamn,
                     "tillbehor": tillbehor
                 })
     
@@ -93,7 +227,7 @@ def calculate_pipe(form):
         dimension_display = ""
     
     # --- Prisberäkning ---
-    price_per_unit = data.get("kostnad", 0)
+    price_per_unit = profile.kostnad
     price = computed_amount * price_per_unit
     
     # --- Hantering av höjdtillägg ---
@@ -102,15 +236,15 @@ def calculate_pipe(form):
     except ValueError:
         hojdtillagg = 0.0
     # --- Arbetstid för isolering (grundtider) ---
-    lop = data.get("lopmeter", 0)
-    kvm_val = data.get("kvm", 0)
+    lop = profile.lopmeter
+    kvm_val = profile.kvm
     work_time_isolering = (lop * length_m) + (kvm_val * computed_amount)
     if hojdtillagg > 0:
         work_time_isolering *= (1 + hojdtillagg / 100.0)
 
     # Hämta "grundtiden" direkt från materialet (ej multiplicerat med längd/area)
-    isolering_grund_montering = data.get("lopmeter", 0)
-    isolering_grund_tillverkning = data.get("kvm", 0)
+    isolering_grund_montering = lop
+    isolering_grund_tillverkning = kvm_val
 
     # Beräkna endast tilläggstid för montering
     isolering_tillagg_montering = isolering_grund_montering * (hojdtillagg / 100.0)
@@ -165,10 +299,12 @@ def calculate_pipe(form):
 
     # --- Hantera ytbeklädnad ---
     ytbekladnad_key = form.get("ytbekladnad")
+    yt_profile = catalog.profile(ytbekladnad_key)
+    if ytbekladnad_key and not yt_profile and pipe_type == "Rör":
+        return None, "Vald ytbeklädnad finns inte."
     if ytbekladnad_key:
-        yt_data = materialer.get(ytbekladnad_key)
-        if yt_data:
-            yt_cost_per_unit = yt_data.get("kostnad", 0)
+        if yt_profile:
+            yt_cost_per_unit = yt_profile.kostnad
             if pipe_type == "Rör":
                 yt_area = math.pi * outer_diameter * length_m
             else:
@@ -182,7 +318,6 @@ def calculate_pipe(form):
         yt_area = 0
 
     # --- Automatisk tejpberäkning (för lamellmatta eller Conlit Fire Mat) ---
-    base_name_lower = data["artikelnamn"].lower()
     roll_length = 50
     if pipe_type == "Rör":
         circumference = math.pi * outer_diameter
@@ -194,19 +329,10 @@ def calculate_pipe(form):
     # --- Arbetstid för ytbekladnad ---
     if pipe_type == "Rör" and ytbekladnad_key:
         outer_diameter_mm = outer_diameter * 1000
-        if "aluminium" in materialer[ytbekladnad_key]["artikelnamn"].lower():
-            if outer_diameter_mm <= 250:
-                grundtid_montering = 0.110
-                grundtid_tillverkning = 0.04
-                tillaggstid_montering = 0.068
-            elif outer_diameter_mm <= 640:
-                grundtid_montering = 0.07
-                grundtid_tillverkning = 0.02
-                tillaggstid_montering = 0.068
-            else:
-                grundtid_montering = 0.144
-                grundtid_tillverkning = 0.08
-                tillaggstid_montering = 0.068
+        # Aluminiumplåt har egna tider per ytterdiameter (ALUMINIUM_CLADDING_BANDS)
+        cladding_times = yt_profile.cladding_times(outer_diameter_mm)
+        if cladding_times:
+            grundtid_montering, grundtid_tillverkning, tillaggstid_montering = cladding_times
         else:
             grundtid_montering = lop
             grundtid_tillverkning = kvm_val
@@ -225,7 +351,7 @@ def calculate_pipe(form):
     distansring = form.get("distansring")
 
     # --- Spoltråd (för rör med lamellmatta eller Conlit Fire Mat) ---
-    if pipe_type == "Rör" and ("lamellmatta" in base_name_lower or "conlit fire mat" in base_name_lower):
+    if pipe_type == "Rör" and profile.uses_spool:
         spooltråd_m = 5 * math.pi * outer_diameter * length_m
         spooltråd_kg = spooltråd_m / 350
     else:
@@ -235,9 +361,9 @@ def calculate_pipe(form):
     # Sätt ihop materialnamnet (inklusive extra lager om sådana finns)
     if layers_info:
         extra_names = ", ".join([layer["artikelnamn"] for layer in layers_info])
-        display_material = f"{data['artikelnamn']} (+ {extra_names})"
+        display_material = f"{profile.artikelnamn} (+ {extra_names})"
     else:
-        display_material = data["artikelnamn"]
+        display_material = profile.artikelnamn
 
     # Sammanställ alla beräknade värden i en result-dictionary
     result = {
@@ -290,8 +416,6 @@ def index():
 
 @app.route('/new_bid', methods=['GET', 'POST'])
 def new_bid():
-    customers = load_customers_from_excel()  # Ladda kunder från filen/databasen
-
     if request.method == 'POST':
         bid_info = {
             "Anbudsnamn": request.form.get("bid_name"),
@@ -303,18 +427,80 @@ def new_bid():
             "projekt_typ": request.form.get("projekt_typ")  # Save selected project type
         }
         session["bid_info"] = bid_info
-        session["pipe_list"] = []
+        start_new_draft()
         return redirect(url_for("calculate"))
 
-    return render_template("new_bid.html", customers=customers, departments=session.get("departments", []), project_managers=session.get("project_managers", []))
+    # Kunderna hämtas vid behov från /api/customers/search
+    return render_template("new_bid.html", departments=session.get("departments", []), project_managers=session.get("project_managers", []))
 
     
     # Hämta listor från session (om de inte finns, sätt några standardvärden)
     departments = session.get("departments", ["Stockholm", "Göteborg", "Malmö", "Uppsala"])
     project_managers = session.get("project_managers", [])
     
-    return render_template("new_bid.html", customers=customers, departments=departments, project_managers=project_managers)
+    return render_template("new_bid.html", departments=departments, project_managers=project_managers)
+
+
+
+# --- Materialregister som JSON ---
+# calculate.html hämtar registret från /api/materials?v=<versionshash>.
+# Adressen byts när registret ändras, så svaret kan cachas i webbläsaren i ett
+# år; utan (eller med inaktuell) v måste webbläsaren fråga om med ETag.
+# Med typ/diameter/thickness svarar samma adress med en kort, sorterad lista
+# ur katalogens index i stället för hela registret.
+_material_payloads = {}
+
+def encoded_materials(encoding):
+    """Materialregistret kodat för given Content-Encoding, cachat per versionshash."""
+    version, body = catalog.export()
+    if _material_payloads.get("version") != version:
+        _material_payloads.clear()
+        _material_payloads["version"] = version
+    if encoding not in _material_payloads:
+        if encoding == "br":
+            _material_payloads[encoding] = brotli.compress(body)
+        elif encoding == "gzip":
+            _material_payloads[encoding] = gzip.compress(body, mtime=0)
+        else:
+            _material_payloads[encoding] = body
+    return _material_payloads[encoding]
 
+def material_cache_headers(response, version):
+    if request.args.get("v") == version:
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    else:
+        response.headers["Cache-Control"] = "no-cache"
+    response.last_modified = catalog.modified
+    return response.make_conditional(request)
+
+@app.route('/api/materials')
+def api_materials():
+    version = catalog.version_hash
+    if any(name in request.args for name in ("typ", "diameter", "thickness")):
+        return filtered_materials(version)
+    encodings = ["br", "gzip", "identity"] if brotli else ["gzip", "identity"]
+    encoding = request.accept_encodings.best_match(encodings, default="identity")
+    response = app.response_class(encoded_materials(encoding), mimetype="application/json")
+    if encoding != "identity":
+        response.headers["Content-Encoding"] = encoding
+    response.headers["Vary"] = "Accept-Encoding"
+    # Stark ETag per kodning, eftersom bytesen skiljer sig mellan dem
+    response.set_etag(f"{version}-{encoding}")
+    return material_cache_headers(response, version)
+
+def filtered_materials(version):
+    """Material som matchar typ/diameter/thickness, som [{key, artikelnamn, kostnad}]."""
+    try:
+        diameter, thickness = (float(request.args[name]) if request.args.get(name) else None
+                               for name in ("diameter", "thickness"))
+    except ValueError:
+        return jsonify({"error": "diameter och thickness måste vara tal"}), 400
+    keys = catalog.filter(request.args.get("typ") or None, diameter, thickness)
+    response = jsonify([{"key": key,
+                         "artikelnamn": materialer[key].get("artikelnamn", ""),
+                         "kostnad": materialer[key].get("kostnad")} for key in keys])
+    response.add_etag()
+    return material_cache_headers(response, version)
 
 
 @app.route('/calculate', methods=['GET', 'POST'])
@@ -324,379 +510,336 @@ def calculate():
         if error:
             flash(error, "danger")
         else:
-            pipe_list = session.get("pipe_list", [])
-            pipe_list.append(pipe_data)
-            session["pipe_list"] = pipe_list
+            drafts.append(current_draft_id(), pipe_data)
             flash("Rörposten har lagts till i kalkylen.", "success")
         return redirect(url_for("calculate"))
     
-    pipe_list = session.get("pipe_list", [])
-    # Lista med basmaterialalternativ (visar artikelnummer och materialnamn)
-    material_options = [
-        (key, f'{data["artikelnr"]} - {data["artikelnamn"]}')
-        for key, data in materialer.items()
-    ]
-    # Lista med ytbeklädnadsalternativ – visar endast materialnamnet
-    ytbekladnad_materials = [
-        (key, data["artikelnamn"])
-        for key, data in materialer.items()
-        if "aluminium" in data["artikelnamn"].lower()
-    ]
-    # Extract unique material types, excluding specific ones
-    material_types = list({data["material typ"] for data in materialer.values() if data["material typ"] not in ["Tillbehör", "Aluminiumplåt", "Stålplåt"]})
-
-    return render_template("calculate.html", 
-                           pipe_list=pipe_list,
-                           materials=material_options,
-                           ytbekladnad_materials=ytbekladnad_materials,
-                           materialer=materialer,
-                           material_types=material_types)
-
+    draft_id = current_draft_id()
+    offset, limit, pager = page_window(drafts.count(draft_id), "calculate")
+    # Alternativen hämtas från katalogens förbyggda index
+    return stream_page("calculate.html",
+                       pipe_list=drafts.rows(draft_id, offset, limit),
+                       offset=offset,
+                       pager=pager,
+                       materials=catalog.material_options,
+                       ytbekladnad_materials=catalog.ytbekladnad_options,
+                       materialer=materialer,
+                       materials_version=catalog.version_hash,
+                       material_types=catalog.material_types)
+
+
+# Import av receptrader från Excel/CSV (recipe_import.py). Alla giltiga rader
+# räknas ut i en omgång och läggs till i utkastet i en transaktion.
+app.config.setdefault("IMPORT_MAX_ROWS", 100000)
+
+@app.route('/import_recipes', methods=['POST'])
+def import_recipe_file():
+    file = request.files.get("file")
+    if file is None or file.filename == "":
+        return jsonify({"error": "Ingen fil vald."}), 400
+    try:
+        rows, report = import_recipes(file.stream, file.filename, materialer,
+                                      max_rows=app.config["IMPORT_MAX_ROWS"])
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    except Exception:
+        return jsonify({"error": "Filen kunde inte läsas. Ladda upp en Excel-fil (.xlsx) eller en CSV-fil."}), 400
+    if rows:
+        drafts.extend(current_draft_id(), rows)
+    return jsonify(report)
+
+
+# --- JSON-API för utkastets rader ---
+# Lägg till, ändra, ta bort och flytta en rad utan att hela /calculate
+# renderas om. Svaret innehåller bara raden och utkastets löpande summor,
+# så en ändring kostar lika mycket oavsett hur många rader kalkylen har.
+# Raderna adresseras med sitt stabila row_id (id i svaren), inte radindex.
+
+# Fält som användaren anger på raden i översikten, inte i receptet
+ROW_ANNOTATIONS = ("objekt", "sektion", "adjusted_price")
+
+def _row_fields():
+    """Receptfälten som formulärdata eller som ett JSON-objekt med formulärets fältnamn."""
+    data = request.get_json(silent=True)
+    if data is None:
+        return request.form
+    if not isinstance(data, dict):
+        return None
+    fields = MultiDict()
+    for name, value in data.items():
+        for item in value if isinstance(value, list) else [value]:
+            if item is True:
+                fields.add(name, "yes")  # som en ikryssad kryssruta
+            elif item is not None and item is not False:
+                fields.add(name, str(item))
+    return fields
+
+def _row_response(draft_id, row_id, row, status=200):
+    return jsonify({"id": row_id, "row": row, "totals": drafts.totals(draft_id)}), status
+
+@app.route('/api/draft/rows')
+def api_draft_rows():
+    """En sida av utkastets rader (?offset=&limit=) med id, och summorna."""
+    draft_id = current_draft_id()
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    limit = min(max(request.args.get("limit", app.config["ROWS_PER_PAGE"], type=int), 0),
+                app.config["ROWS_PER_PAGE"])
+    return jsonify({"rows": [{"id": row_id, "row": row} for row_id, row in drafts.items(draft_id, offset, limit)],
+                    "offset": offset,
+                    "totals": drafts.totals(draft_id)})
+
+@app.route('/api/draft/rows', methods=['POST'])
+def api_create_row():
+    fields = _row_fields()
+    if fields is None:
+        return jsonify({"error": "Ogiltig förfrågan."}), 400
+    row, error = calculate_pipe(fields)
+    if error:
+        return jsonify({"error": error}), 400
+    for name in ("objekt", "sektion"):
+        if name in fields:
+            row[name] = fields[name]
+    draft_id = current_draft_id()
+    return _row_response(draft_id, drafts.append(draft_id, row), row, 201)
+
+@app.route('/api/draft/rows/<int:row_id>', methods=['PUT'])
+def api_update_row(row_id):
+    """Räknar om raden från receptfälten; objekt, sektion och justerat pris behålls om de inte skickas."""
+    draft_id = current_draft_id()
+    old = drafts.get(draft_id, row_id)
+    if old is None:
+        return jsonify({"error": "Raden finns inte."}), 404
+    fields = _row_fields()
+    if fields is None:
+        return jsonify({"error": "Ogiltig förfrågan."}), 400
+    row, error = calculate_pipe(fields)
+    if error:
+        return jsonify({"error": error}), 400
+    for name in ROW_ANNOTATIONS:
+        if name in fields:
+            row[name] = fields[name]
+        elif name in old:
+            row[name] = old[name]
+    drafts.update(draft_id, row_id, row)
+    return _row_response(draft_id, row_id, row)
+
+@app.route('/api/draft/rows/<int:row_id>', methods=['DELETE'])
+def api_delete_row(row_id):
+    draft_id = current_draft_id()
+    if drafts.get(draft_id, row_id) is None:
+        return jsonify({"error": "Raden finns inte."}), 404
+    drafts.delete(draft_id, row_id)
+    return jsonify({"id": row_id, "totals": drafts.totals(draft_id)})
+
+@app.route('/api/draft/rows/<int:row_id>/move', methods=['POST'])
+def api_move_row(row_id):
+    """Flyttar raden till plats index (0 = först), given som JSON {"index": n} eller formulärfält."""
+    data = request.get_json(silent=True)
+    index = data.get("index") if isinstance(data, dict) else request.form.get("index")
+    try:
+        index = int(index)
+    except (TypeError, ValueError):
+        return jsonify({"error": "Ogiltig plats."}), 400
+    draft_id = current_draft_id()
+    if not drafts.move(draft_id, row_id, index):
+        return jsonify({"error": "Raden finns inte."}), 404
+    # Platser utanför listan hamnar först eller sist; svara med radens faktiska plats
+    index = min(max(index, 0), drafts.count(draft_id) - 1)
+    return jsonify({"id": row_id, "index": index, "totals": drafts.totals(draft_id)})
 
 
 @app.route('/materialspecifikation')
 def materialspecifikation():
-    from materials import materialer
-    pipe_list = session.get("pipe_list", [])
-    
-    summary = {}
-    
-    # Processera basmaterial för varje recept
-    for pipe in pipe_list:
-        mat_key = pipe.get("material_key")
-        group_key = "base_" + (mat_key if mat_key else "unknown")
-        if pipe.get("pipe_type", "Rör") == "Rör":
-            mängd_val = pipe.get("area", 0)
-            enhet_val = "m²"
-        else:
-            mängd_val = pipe.get("length", 0)
-            enhet_val = "m"
-        if mat_key and mat_key in materialer:
-            default_price = materialer[mat_key].get("kostnad", 0)
-            artikelnr = materialer[mat_key].get("artikelnr", "Okänt")
-            senast = materialer[mat_key].get("senast_uppdaterad", "Okänt")
-        else:
-            default_price = 0
-            artikelnr = "Okänt"
-            senast = "Okänt"
-        used_price = pipe.get("adjusted_price", default_price)
-        cost = mängd_val * used_price
-        if group_key in summary:
-            summary[group_key]["mängd"] += mängd_val
-            summary[group_key]["total_cost"] += cost
-        else:
-            summary[group_key] = {
-                "group_key": group_key,
-                "artikelnamn": pipe.get("material", "Okänt material"),
-                "artikelnr": artikelnr,
-                "senast_uppdaterad": senast,
-                "mängd": mängd_val,
-                "enhet": enhet_val,
-                "apris": default_price,
-                "total_cost": cost
-            }
-
-        # Processera ytbeklädnad (om valt)
-        if pipe.get("ytbekladnad_key"):
-            yt_key = pipe.get("ytbekladnad_key")
-            group_key_yt = "yt_" + (yt_key if yt_key else "unknown")
-            # Använd den beräknade ytbeklädnadsarean som kvantitet
-            yt_quantity = pipe.get("ytbekladnad_area", 0)
-            if yt_key and yt_key in materialer:
-                yt_default_price = materialer[yt_key].get("kostnad", 0)
-                yt_artikelnr = materialer[yt_key].get("artikelnr", "Okänt")
-                yt_senast = materialer[yt_key].get("senast_uppdaterad", "Okänt")
-            else:
-                yt_default_price = 0
-                yt_artikelnr = "Okänt"
-                yt_senast = "Okänt"
-            yt_cost = pipe.get("ytbekladnad_cost", 0)
-            if group_key_yt in summary:
-                summary[group_key_yt]["mängd"] += yt_quantity
-                summary[group_key_yt]["total_cost"] += yt_cost
-            else:
-                summary[group_key_yt] = {
-                    "group_key": group_key_yt,
-                    "artikelnamn": materialer[yt_key].get("artikelnamn", "Okänt material") if yt_key in materialer else "Okänt material",
-                    "artikelnr": yt_artikelnr,
-                    "senast_uppdaterad": yt_senast,
-                    "mängd": yt_quantity,
-                    "enhet": "m²",
-                    "apris": yt_default_price,
-                    "total_cost": yt_cost
- }
-            # --- NYTT: Popnit-uppgifter ---
-            # Endast om ytbeklädnads-materialet innehåller "aluminium"
-            if "aluminium" in materialer[yt_key]["artikelnamn"].lower():
-                group_key_popnit = "popnit"
-                # Beräkna popnit: 10 ask per m² (popnit_ask = yt_area / 100)
-                popnit_ask = (pipe.get("ytbekladnad_area", 0)) / 100
-                popnit_default_price = materialer.get("85329500", {}).get("kostnad", 0)
-                popnit_artnr = materialer.get("85329500", {}).get("artikelnr", "85329500")
-                popnit_total = popnit_ask * popnit_default_price
-                if group_key_popnit in summary:
-                    summary[group_key_popnit]["mängd"] += popnit_ask
-                    summary[group_key_popnit]["total_cost"] += popnit_total
-                else:
-                    summary[group_key_popnit] = {
-                        "group_key": group_key_popnit,
-                        "artikelnamn": "Popnit",
-                        "artikelnr": popnit_artnr,
-                        "senast_uppdaterad": "",  # Ange datum vid behov
-                        "mängd": popnit_ask,
-                        "enhet": "ask",
-                        "apris": popnit_default_price,
-                        "total_cost": popnit_total
-                    }
-        
-        # Processera extra lager i receptet
-        for layer in pipe.get("layers", []):
-            layer_key = layer.get("material_key")
-            group_key_layer = "layer_" + (layer_key if layer_key else "unknown")
-            if layer_key and layer_key in materialer:
-                layer_default_price = materialer[layer_key].get("kostnad", 0)
-                layer_artikelnr = materialer[layer_key].get("artikelnr", "Okänt")
-                layer_senast = materialer[layer_key].get("senast_uppdaterad", "Okänt")
-            else:
-                layer_default_price = 0
-                layer_artikelnr = "Okänt"
-                layer_senast = "Okänt"
-            # Anta att kvantiteten för extra lager är summan av "insulation" och "tillbehor"
-            extra_mängd = layer.get("insulation", 0) + layer.get("tillbehor", 0)
-            used_price_layer = layer.get("adjusted_price", layer_default_price)
-            layer_cost = extra_mängd * used_price_layer
-            if group_key_layer in summary:
-                summary[group_key_layer]["mängd"] += extra_mängd
-                summary[group_key_layer]["total_cost"] += layer_cost
-            else:
-                summary[group_key_layer] = {
-                    "group_key": group_key_layer,
-                    "artikelnamn": materialer[layer_key]["artikelnamn"],
-                    "artikelnr": layer_artikelnr,
-                    "senast_uppdaterad": layer_senast,
-                    "mängd": extra_mängd,
-                    "enhet": "mm",
-                    "apris": layer_default_price,
-                    "total_cost": layer_cost
-                }
-        
-        # Processera spoltråd om det finns (baserat på calculate_pipe)
-        if pipe.get("spoltrad_kg", 0) > 0:
-            group_key_spool = "spool"
-            spool_quantity = pipe.get("spoltrad_kg", 0)
-            spool_data = materialer.get("4023313", {})
-            spool_default_price = spool_data.get("kostnad", 0)
-            spool_artikelnr = spool_data.get("artikelnr", "Okänt")
-            spool_senast = spool_data.get("senast_uppdaterad", "Okänt")
-            spool_cost = spool_quantity * spool_default_price
-            if group_key_spool in summary:
-                summary[group_key_spool]["mängd"] += spool_quantity
-                summary[group_key_spool]["total_cost"] += spool_cost
-            else:
-                summary[group_key_spool] = {
-                    "group_key": group_key_spool,
-                    "artikelnamn": spool_data.get("artikelnamn", "Spoltråd 0,70"),
-                    "artikelnr": spool_artikelnr,
-                    "senast_uppdaterad": spool_senast,
-                    "mängd": spool_quantity,
-                    "enhet": "kg",
-                    "apris": spool_default_price,
-                    "total_cost": spool_cost
-                }
-        
-        # Processera tejp om det finns (exempel, om tejp används som extra lager)
-        if pipe.get("tejp_quantity", 0) > 0:
-            group_key_tejp = "tejp"
-            tejp_quantity = pipe.get("tejp_quantity", 0)
-            tejp_data = materialer.get("PTBCR07550", {})
-            tejp_default_price = tejp_data.get("kostnad", 0)
-            tejp_artikelnr = tejp_data.get("artikelnr", "Okänt")
-            tejp_senast = tejp_data.get("senast_uppdaterad", "Okänt")
-            tejp_cost = tejp_quantity * tejp_default_price
-            if group_key_tejp in summary:
-                summary[group_key_tejp]["mängd"] += tejp_quantity
-                summary[group_key_tejp]["total_cost"] += tejp_cost
-            else:
-                summary[group_key_tejp] = {
-                    "group_key": group_key_tejp,
-                    "artikelnamn": tejp_data.get("artikelnamn", "Tejp"),
-                    "artikelnr": tejp_artikelnr,
-                    "senast_uppdaterad": tejp_senast,
-                    "mängd": tejp_quantity,
-                    "enhet": "rle",
-                    "apris": tejp_default_price,
-                    "total_cost": tejp_cost
-                }
-        
-        # Processera folie om det finns (baserat på calculate_pipe)
-        if pipe.get("foil_area", 0) > 0:
-            group_key_folie = "folie"
-            foil_quantity = pipe.get("foil_area", 0)
-            # Hämta foliedatan med artikelnummer 4025571
-            foil_data = materialer.get("4025571")
-            if foil_data:
-                foil_price = foil_data.get("kostnad", 0)
-                foil_artikelnr = foil_data.get("artikelnr", "Okänt")
-                foil_senast = foil_data.get("senast_uppdaterad", "Okänt")
-                foil_name = foil_data.get("artikelnamn", "Folie")
-            else:
-                foil_price = 50.0
-                foil_artikelnr = "4025571"
-                foil_senast = "2025-03-05"
-                foil_name = "Folie"
-            foil_cost = foil_quantity * foil_price
-            if group_key_folie in summary:
-                summary[group_key_folie]["mängd"] += foil_quantity
-                summary[group_key_folie]["total_cost"] += foil_cost
-            else:
-                summary[group_key_folie] = {
-                    "group_key": group_key_folie,
-                    "artikelnamn": foil_name,
-                    "artikelnr": foil_artikelnr,
-                    "senast_uppdaterad": foil_senast,
-                    "mängd": foil_quantity,
-                    "enhet": "m²",
-                    "apris": foil_price,
-                    "total_cost": foil_cost
-                }
-      # --- NYTT: Processera band (om det finns) ---
-        if pipe.get("band") and pipe.get("band_length", 0) > 0:
-            group_key_band = "band"
-            band_length = pipe.get("band_length", 0)
-            # Hämta banddata från materialer med artikelnummer 9556892
-            band_data = materialer.get("9556892", {})
-            band_price = band_data.get("kostnad", 0)
-            band_artikelnr = band_data.get("artikelnr", "9556892")
-            band_senast = band_data.get("senast_uppdaterad", "Okänt")
-            if group_key_band in summary:
-                summary[group_key_band]["mängd"] += band_length
-                summary[group_key_band]["total_cost"] += band_length * band_price
-            else:
-                summary[group_key_band] = {
-                    "group_key": group_key_band,
-                    "artikelnamn": band_data.get("artikelnamn", "Band"),
-                    "artikelnr": band_artikelnr,
-                    "senast_uppdaterad": band_senast,
-                    "mängd": band_length,
-                    "enhet": "m",
-                    "apris": band_price,
-                    "total_cost": band_length * band_price
-                }
-    
-    summary_list = []
-    total_material_cost = 0
-    for key, data in summary.items():
-        total_material_cost += data["total_cost"]
-        summary_list.append(data)
-    
-    return render_template("materialspecifikation.html", summary=summary_list, total_material_cost=total_material_cost)
+    # Materialgrupperna (basmaterial, ytbeklädnad, popnit, lager, spoltråd,
+    # tejp, folie och band) summeras i aggregate.material_groups
+    summary = draft_aggregate(current_draft_id())
+    return render_template("materialspecifikation.html", summary=summary.groups,
+                           total_material_cost=summary.group_total)
 
 
 @app.route('/save_bid', methods=['POST'])
 def save_bid():
     bid_info = session.get("bid_info")
-    pipe_list = session.get("pipe_list", [])
+    pipe_list = get_pipe_list()
     if not bid_info or not pipe_list:
         flash("Anbudsinfo eller kalkyl saknas.", "danger")
         return redirect(url_for("calculate"))
     
-    bid_data = {
-        "bid_info": bid_info,
-        "kalkyl": pipe_list
-    }
-    conn = get_db_connection()
+    conn = get_db()
     datum = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    if "id" in bid_info and bid_info["id"]:
-        # Uppdatera befintligt anbud
-        conn.execute("UPDATE anbud SET datum = ?, data = ? WHERE id = ?",
-                     (datum, json.dumps(bid_data), bid_info["id"]))
-    else:
-        # Skapa nytt anbud
-        conn.execute("INSERT INTO anbud (datum, data) VALUES (?, ?)",
-                     (datum, json.dumps(bid_data)))
-        new_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
-        bid_info["id"] = new_id
-    conn.commit()
-    conn.close()
+    # Uppdatera befintligt anbud eller skapa ett nytt
+    bid_info["id"] = save_bid_record(conn, bid_info, pipe_list, datum, bid_info.get("id"))
     flash("Anbudet har sparats.", "success")
     session.pop("bid_info", None)
-    session.pop("pipe_list", None)
+    close_draft()
     session.pop("default_material", None)
     return redirect(url_for("index"))
 
 
 @app.route('/old_bids')
 def old_bids():
-    conn = get_db_connection()
-    bids = conn.execute("SELECT id, datum, data FROM anbud ORDER BY id DESC").fetchall()
-    conn.close()
-
-    bids_list = []
-    for bid in bids:
-        bid_dict = dict(bid)
-        data_dict = json.loads(bid_dict["data"])
-        bid_info = data_dict.get("bid_info", {})
-
-        bid_dict["anbudsnummer"] = bid_info.get("Anbudsnummer", bid_dict["id"])
-        bid_dict["anbudsnamn"] = bid_info.get("Anbudsnamn", "Okänt")
-        bid_dict["avdelning"] = bid_info.get("Avdelning", "")
-        bid_dict["projektledare"] = bid_info.get("Projektledare", "")
-        bid_dict["kalkylansvarig"] = bid_info.get("Kalkylansvarig", "")
-        bid_dict["kund"] = bid_info.get("Kund", "")
-        bid_dict["projekt_typ"] = bid_info.get("projekt_typ", "")
+    filters = {column: request.args.get(column, "").strip() for column in FILTER_COLUMNS}
+    date_from = request.args.get("date_from", "").strip()
+    date_to = request.args.get("date_to", "").strip()
+    try:
+        per_page = min(max(int(request.args.get("per_page", 50)), 1), 500)
+    except ValueError:
+        per_page = 50
+
+    conn = get_db()
+    # Anbudsinfon ligger i egna, indexerade kolumner; en sida hämtas åt gången
+    bids, has_newer, has_older = list_bids(conn, filters, date_from, date_to,
+                                           after=decode_cursor(request.args.get("after")),
+                                           before=decode_cursor(request.args.get("before")),
+                                           limit=per_page)
+
+    # Sidlänkarna behåller filtren
+    query = {k: v for k, v in filters.items() if v}
+    query.update({k: v for k, v in (("date_from", date_from), ("date_to", date_to)) if v})
+    if per_page != 50:
+        query["per_page"] = per_page
+    newer_url = url_for("old_bids", before=encode_cursor(bids[0]), **query) if bids and has_newer else None
+    older_url = url_for("old_bids", after=encode_cursor(bids[-1]), **query) if bids and has_older else None
+
+    return render_template("old_bids.html", bids=bids, filters=filters, date_from=date_from, date_to=date_to,
+                           newer_url=newer_url, older_url=older_url, first_url=url_for("old_bids", **query),
+                           departments=session.get("departments", []),
+                           project_managers=session.get("project_managers", []))
+
+
+# --- Fulltextsökning bland sparade anbud ---
+# Söker i anbudsinfo, radernas objekt/sektion och materialnamn (bids_fts,
+# som uppdateras när anbud sparas och raderas), bästa träff först.
+def _search_hits():
+    query = request.args.get("q", "").strip()
+    try:
+        limit = min(max(int(request.args.get("limit", 20)), 1), 200)
+    except ValueError:
+        limit = 20
+    hits = []
+    for bid in search_bids(get_db(), query, limit):
+        hit = dict(bid)
+        # Utdraget är användardata: escapa det och markera sökträffarna
+        hit["snippet"] = escape(bid["snippet"]).replace(HIT_START, Markup("<mark>")).replace(HIT_END, Markup("</mark>"))
+        hits.append(hit)
+    return query, hits
 
-        bids_list.append(bid_dict)
+@app.route('/search')
+def search():
+    query, hits = _search_hits()
+    return render_template("search.html", query=query, hits=hits)
 
-    return render_template("old_bids.html", bids=bids_list)
+@app.route('/api/bids/search')
+def api_search_bids():
+    """Träffarna som JSON; snippet är HTML med sökträffarna inom <mark>."""
+    _, hits = _search_hits()
+    return jsonify([dict(hit, snippet=str(hit["snippet"])) for hit in hits])
 
 
 
 
 @app.route('/bid/<int:bid_id>')
 def bid_detail(bid_id):
-    conn = get_db_connection()
-    bid = conn.execute("SELECT id, datum, data FROM anbud WHERE id = ?", (bid_id,)).fetchone()
-    conn.close()
+    conn = get_db()
+    # Kalkylraderna visas en sida i taget
+    offset, limit, pager = page_window(count_rows(conn, bid_id), "bid_detail", bid_id=bid_id)
+    try:
+        bid, bid_data = load_bid(conn, bid_id, offset, limit)
+    except ValueError:
+        bid = conn.execute("SELECT id, datum FROM bids WHERE id = ?", (bid_id,)).fetchone()
+        bid_data = {"error": "Kunde inte läsa anbudsdata."}
     if bid:
-        try:
-            bid_data = json.loads(bid["data"])
-        except Exception:
-            bid_data = {"error": "Kunde inte läsa anbudsdata."}
-        return render_template("bid_detail.html", bid=bid, bid_data=bid_data)
+        return stream_page("bid_detail.html", bid=bid, bid_data=bid_data, pager=pager,
+                           revisions=list_revisions(conn, bid_id))
     else:
         flash("Anbudet hittades inte.", "danger")
         return redirect(url_for("old_bids"))
 
 
+@app.route('/export/<int:bid_id>.<any(xlsx, csv):fmt>')
+def export_bid(bid_id, fmt):
+    """Materialspecifikation, beräkningar och sammanställning för ett sparat anbud som Excel- eller CSV-fil."""
+    conn = get_db()
+    try:
+        bid, bid_data = load_bid(conn, bid_id, limit=0)
+    except ValueError:
+        flash("Kunde inte läsa anbudsdata.", "danger")
+        return redirect(url_for("old_bids"))
+    if not bid:
+        flash("Anbudet hittades inte.", "danger")
+        return redirect(url_for("old_bids"))
+
+    # Raderna läses ur databasen först när filen skrivs
+    sections = bid_sections(conn, bid_id, bid_data["bid_info"], materialer, accessory_prices(), dict(session))
+    filename = f"anbud-{bid_id}.{fmt}"
+    if fmt == "csv":
+        return app.response_class(stream_with_context(csv_chunks(sections)), mimetype="text/csv",
+                                  headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+    # openpyxl packar arbetsboken först när den sparas; bladen ligger i temporära filer till dess
+    out = tempfile.TemporaryFile()
+    write_xlsx(sections, out)
+    out.seek(0)
+    return send_file(out, as_attachment=True, download_name=filename,
+                     mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+
+
 @app.route('/edit_bid/<int:bid_id>')
 def edit_bid(bid_id):
-    conn = get_db_connection()
-    bid = conn.execute("SELECT id, datum, data FROM anbud WHERE id = ?", (bid_id,)).fetchone()
-    conn.close()
+    conn = get_db()
+    revision = request.args.get("revision", type=int)
+    if revision is not None:
+        # En tidigare version laddas; sparas den blir den anbudets nyaste version
+        bid_data = load_revision(conn, bid_id, revision)
+        if bid_data is None:
+            flash("Versionen hittades inte.", "danger")
+            return redirect(url_for("bid_detail", bid_id=bid_id))
+        session["bid_info"] = dict(bid_data["bid_info"], id=bid_id)
+        start_new_draft(bid_data["kalkyl"])
+        flash(f"Version {revision} har laddats och du kan nu arbeta med den.", "success")
+        return redirect(url_for("calculate"))
+    try:
+        bid, bid_data = load_bid(conn, bid_id)
+    except ValueError:
+        flash("Kunde inte läsa anbudsdata.", "danger")
+        return redirect(url_for("old_bids"))
     if bid:
-        try:
-            bid_data = json.loads(bid["data"])
-        except Exception as e:
-            flash("Kunde inte läsa anbudsdata.", "danger")
-            return redirect(url_for("old_bids"))
         session["bid_info"] = bid_data.get("bid_info")
-        session["pipe_list"] = bid_data.get("kalkyl")
+        start_new_draft(bid_data.get("kalkyl"))
         flash("Kalkylen har laddats och du kan nu arbeta med den.", "success")
         return redirect(url_for("calculate"))
     else:
         flash("Anbudet hittades inte.", "danger")
         return redirect(url_for("old_bids"))
+
+
+# --- Versionshistorik för sparade anbud ---
+@app.route('/api/bid/<int:bid_id>/revisions')
+def api_bid_revisions(bid_id):
+    """Anbudets versioner, senaste först."""
+    conn = get_db()
+    if conn.execute("SELECT 1 FROM bids WHERE id = ?", (bid_id,)).fetchone() is None:
+        return jsonify({"error": "Anbudet hittades inte."}), 404
+    return jsonify({"revisions": [dict(revision) for revision in list_revisions(conn, bid_id)]})
+
+@app.route('/api/bid/<int:bid_id>/revisions/<int:revision>')
+def api_bid_revision(bid_id, revision):
+    """Anbudet som det sparades i en viss version: {"bid_info": ..., "kalkyl": [...]}."""
+    bid_data = load_revision(get_db(), bid_id, revision)
+    if bid_data is None:
+        return jsonify({"error": "Versionen hittades inte."}), 404
+    return jsonify(bid_data)
+
 @app.route('/edit_pipe/<int:index>', methods=['GET','POST'])
 def edit_pipe(index):
-    pipe_list = session.get("pipe_list", [])
-    if not (0 <= index < len(pipe_list)):
+    draft_id = current_draft_id()
+    row_id = drafts.row_id_at(draft_id, index)
+    if row_id is None:
         flash("Ogiltigt index, kunde inte redigera receptet.", "danger")
         return redirect(url_for("calculate"))
 
     if request.method == 'POST':
         # Hämta befintlig post
-        pipe_data = pipe_list[index]
+        pipe_data = drafts.get(draft_id, row_id)
         # Uppdatera med nya värden
         pipe_type = request.form.get("pipe_type", "Rör")
         try:
@@ -710,171 +853,54 @@ def edit_pipe(index):
         pipe_data["hojdtillagg"] = float(request.form.get("hojdtillagg") or 0)
         # ... eventuellt fler fält ...
         
-        # Spara tillbaka
-        pipe_list[index] = pipe_data
-        session["pipe_list"] = pipe_list
+        # Spara tillbaka (endast den här raden skrivs)
+        drafts.update(draft_id, row_id, pipe_data)
         flash("Receptet har uppdaterats.", "success")
         return redirect(url_for("calculate"))
     
     # GET => visa ett formulär
-    pipe_data = pipe_list[index]
+    pipe_data = drafts.get(draft_id, row_id)
     return render_template("edit_pipe.html", pipe=pipe_data, pipe_index=index)
 
 @app.route('/remove_pipe/<int:index>', methods=['POST'])
 def remove_pipe(index):
-    pipe_list = session.get("pipe_list", [])
-    if 0 <= index < len(pipe_list):
-        pipe_list.pop(index)
-        session["pipe_list"] = pipe_list
+    draft_id = current_draft_id()
+    row_id = drafts.row_id_at(draft_id, index)
+    if row_id is not None:
+        drafts.delete(draft_id, row_id)
         flash("Receptet har tagits bort.", "success")
     else:
         flash("Ogiltigt index, kunde inte ta bort receptet.", "danger")
     return redirect(url_for("calculate"))
 @app.route('/detailed_calculations')
 def detailed_calculations():
-    pipe_list = session.get("pipe_list", [])
-    total_material_cost = 0.0
-    total_work_time = 0.0
-
-    for pipe in pipe_list:
-        # Tejp
-        tape_cost = 0
-        if pipe.get("tejp_quantity"):
-            if pipe.get("material") and ("lamellmatta" in pipe.get("material", "").lower()):
-                tape_cost = pipe["tejp_quantity"] * materialer["9556523"]["kostnad"]
-            elif pipe.get("material") and ("conlit fire mat" in pipe.get("material", "").lower()):
-                tape_cost = pipe["tejp_quantity"] * materialer["PTBCR07550"]["kostnad"]
-
-        # Spoltråd
-        spool_cost = pipe.get("spoltrad_kg", 0) * materialer["4023313"]["kostnad"]
-
-        # Band
-        band_cost = 0
-        if pipe.get("band"):
-            band_cost = pipe.get("band_length", 0) * materialer["9556892"]["kostnad"]
-
-        # Folie
-        foil_area = pipe.get("foil_area", 0)
-        folie_cost = foil_area * materialer["4025571"]["kostnad"]
-
-        # Räkna ut total materialkostnad för raden med full precision
-        row_total = (
-            pipe.get("price", 0) +
-            pipe.get("ytbekladnad_cost", 0) +
-            tape_cost +
-            spool_cost +
-            band_cost +
-            folie_cost
-        )
-        # Avrunda varje rads total till 0 decimaler och lägg till i den totala summan
-        total_material_cost += round(row_total, 0)
-
-# Beräkna total arbetstid för receptet (isolering + ytbeklädnad + band + folie)
-    total_work_time = 0.0
-    for pipe in pipe_list:
-        # Arbetstid för isolering och ytbeklädnad
-        pipe_total_work = pipe.get("work_time_isolering", 0) + pipe.get("work_time_ytbekladnad", 0)
-        # Lägg till band-arbetstid (om den finns)
-        pipe_total_work += pipe.get("band_arbetstid", 0)
-        # Lägg till foliearbetstid om folien är vald
-        if pipe.get("folie"):
-            pipe_total_work += (0.03 * pipe.get("length", 0) + 0.049 * pipe.get("area", 0))
-        total_work_time += pipe_total_work
-
-    return render_template("detailed_calculations.html",
-                           pipe_list=pipe_list,
-                           materialer=materialer,
-                           total_material_cost=total_material_cost,
-                           total_work_time=total_work_time)
+    # Raderna räknas i aggregate.row_costs och formateras i detail_rows.py;
+    # mallen skriver bara ut celltexterna. Bara den visade sidan läses in,
+    # summorna kommer från utkastlagringens löpande summor.
+    draft_id = current_draft_id()
+    totals = drafts.totals(draft_id)
+    offset, limit, pager = page_window(drafts.count(draft_id), "detailed_calculations")
+
+    return stream_page("detailed_calculations.html",
+                       rows=draft_detail_rows(draft_id, offset, limit),
+                       pager=pager,
+                       total_material_cost=thousands(totals["material_cost_rounded"]),
+                       total_work_time=round(totals["work_time"], 2))
 
 @app.route('/sammanstallning')
 def sammanstallning():
     bid_info = session.get("bid_info", {})
-    pipe_list = session.get("pipe_list", [])
+    # Sammanställningen behöver bara summorna, inte raderna. De hålls löpande
+    # av utkastlagringen med samma radkostnader (aggregate.row_costs) som vyerna.
+    totals = drafts.totals(current_draft_id())
     datum_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-    # Materialkostnader
-    total_isolering = sum(p.get("price", 0) for p in pipe_list)
-    total_ytbekladnad = sum(p.get("ytbekladnad_cost", 0) for p in pipe_list)
-    tape_price = materialer.get("PTBCR07550", {}).get("kostnad", 0)
-    spool_price = materialer.get("4023313", {}).get("kostnad", 0)
-    total_tape_cost = sum(p.get("tejp_quantity", 0) * tape_price for p in pipe_list)
-    total_spool_cost = sum(p.get("spoltrad_kg", 0) * spool_price for p in pipe_list)
-    total_tillbehor = total_tape_cost + total_spool_cost
-    total_material_cost = total_isolering + total_ytbekladnad + total_tillbehor
-
-    # Arbetstid (beräknad från receptet)
-    total_work_time_calc = 0.0
-    for pipe in pipe_list:
-        pipe_total_work = pipe.get("work_time_isolering", 0) + pipe.get("work_time_ytbekladnad", 0)
-        pipe_total_work += pipe.get("band_arbetstid", 0)
-        if pipe.get("folie"):
-            pipe_total_work += (0.03 * pipe.get("length", 0) + 0.049 * pipe.get("area", 0))
-        total_work_time_calc += pipe_total_work
-
-    # Hämta multiplikator, höjdtillägg och timtid – med defaultvärden
-    multiplikator = float(session.get("multiplikator") or 1)
-    hoejdtillaeg = float(session.get("hoejdtillaeg") or 0)  # i procent
-    timtid = float(session.get("timtid") or 0)             # extra timmar att lägga till
-
-    # Beräkna total arbetstid med nya värden
-    total_work_time = total_work_time_calc * multiplikator * (1 + hoejdtillaeg/100) + timtid
-
-    # Timlön
-    hourly_wage = float(session.get("hourly_wage") or 252)
-    labor_cost_per_hour = hourly_wage * 1.70
-    total_labor_cost = total_work_time * labor_cost_per_hour
-
-    # UE‑kostnader
-    ue_cost = float(session.get("ue_cost") or 0)
-    ue_hours = float(session.get("ue_hours") or 0)
-    ue_montage = float(session.get("ue_montage") or 0)
-    ue_tillverkning = float(session.get("ue_tillverkning") or 0)
-    total_ue_cost = ue_cost + ue_hours + ue_montage + ue_tillverkning
-
-    diverse_cost = total_material_cost * 0.015
-    servicebil_days = float(session.get("servicebil_days") or 0)
-    servicebil_cost = servicebil_days * 400
-
-    total_work_cost = total_labor_cost + total_ue_cost + diverse_cost + servicebil_cost
-
-    coverage_percentage = float(session.get("coverage_percentage") or 0)
-    coverage_rate = coverage_percentage / 100.0
-    final_price = (total_material_cost + total_work_cost) / (1 - coverage_rate) if coverage_rate < 1 else 0
-
-    total_length = sum(p.get("length", 0) for p in pipe_list)
-    labor_cost_per_meter = total_length > 0 and (total_labor_cost / total_length) or 0
-    final_price_per_meter = total_length > 0 and (final_price / total_length) or 0
+    # Kostnader och slutpris räknas i totals.bid_summary (samma som exporten)
+    figures = bid_summary(totals, accessory_prices(), session)
 
     return render_template("sammanstallning.html",
                            bid_info=bid_info,
                            datum=datum_str,
-                           total_isolering=total_isolering,
-                           total_ytbekladnad_cost=total_ytbekladnad,
-                           total_accessories=total_tillbehor,
-                           total_material_cost=total_material_cost,
-                           total_work_time_calc=total_work_time_calc,
-                           multiplikator=multiplikator,
-                           hoejdtillaeg=hoejdtillaeg,
-                           timtid=timtid,
-                           total_work_time=total_work_time,
-                           hourly_wage=hourly_wage,
-                           labor_cost_per_hour=labor_cost_per_hour,
-                           total_labor_cost=total_labor_cost,
-                           ue_cost=ue_cost,
-                           ue_hours=ue_hours,
-                           ue_montage=ue_montage,
-                           ue_tillverkning=ue_tillverkning,
-                           total_ue_cost=total_ue_cost,
-                           diverse_cost=diverse_cost,
-                           servicebil_days=servicebil_days,
-                           servicebil_cost=servicebil_cost,
-                           total_work_cost=total_work_cost,
-                           coverage_percentage=coverage_percentage,
-                           final_price=final_price,
-                           total_length=total_length,
-                           labor_cost_per_meter=labor_cost_per_meter,
-                           final_price_per_meter=final_price_per_meter,
+                           **figures,
                            notering_values=session.get("notering_values"))
 
 
@@ -907,7 +933,6 @@ def thousandspace(value):
         return value
 
 
-import pandas as pd
 import os
 from flask import Flask, render_template, request, redirect, url_for, flash
 
@@ -917,30 +942,9 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
 CUSTOMER_FILE = os.path.join(UPLOAD_FOLDER, "customers.xlsx")
 
-# Läs in kunder från Excel-fil
-def load_customers_from_excel():
-    if not os.path.exists(CUSTOMER_FILE):
-        return []
-    
-    df = pd.read_excel(CUSTOMER_FILE, dtype=str).fillna("")
-    customers = df.to_dict(orient='records')  
-    return customers
-
-# Uppdatera kunddatabasen från en ny Excel-fil
-def update_customers(file_path):
-    if not os.path.exists(CUSTOMER_FILE):
-        df_old = pd.DataFrame()
-    else:
-        df_old = pd.read_excel(CUSTOMER_FILE, dtype=str).fillna("")
-
-    df_new = pd.read_excel(file_path, dtype=str).fillna("")
-
-    # Slå ihop gamla och nya kunder, baserat på "Kundnr"
-    df_merged = pd.concat([df_old, df_new]).drop_duplicates(subset=["Kundnr"], keep="last")
-
-    # Spara den uppdaterade listan
-    df_merged.to_excel(CUSTOMER_FILE, index=False)
-    return len(df_new), len(df_merged) - len(df_old)
+# Kundregistret läser customers.xlsx en gång och svarar sedan ur minnet.
+# Uppladdade kundlistor läggs direkt in i registret (tabellen customers).
+customer_registry = CustomerRegistry(db_pool, CUSTOMER_FILE)
 
 # Route för att ladda upp och uppdatera kunder
 @app.route('/upload_customers', methods=['POST'])
@@ -956,34 +960,48 @@ def upload_customers():
         return redirect(request.url)
 
     if file:
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], "temp_customers.xlsx")
-        file.save(file_path)
-
-        new_entries, updated_entries = update_customers(file_path)
+        # Filen läses rad för rad direkt ur uppladdningen; ingen temporär kopia sparas
+        try:
+            counts = customer_registry.import_file(file.stream)
+        except Exception:
+            flash('Filen kunde inte läsas. Ladda upp kundlistan som en Excel-fil (.xlsx).', 'danger')
+            return redirect(url_for('customers'))
 
-        flash(f'Kundlistan har uppdaterats! {new_entries} nya kunder, {updated_entries} uppdaterade.', 'success')
+        flash(f'Kundlistan har uppdaterats! {counts["inserted"]} nya kunder, {counts["updated"]} uppdaterade, '
+              f'{counts["unchanged"]} oförändrade.', 'success')
+        if counts["skipped"]:
+            flash(f'{counts["skipped"]} rader saknade Kundnr och hoppades över.', 'warning')
 
     return redirect(url_for('customers'))
 
 # Route för att visa kundsidan
 @app.route('/customers')
 def customers():
-    customers = load_customers_from_excel()
-    return render_template('customers.html', customers=customers)
+    # Tabellen fylls från /api/customers/search
+    return render_template('customers.html')
+
+# Sökning i kundregistret (prefix- och trigramindex), bästa träff först
+@app.route('/api/customers/search')
+def search_customers():
+    query = request.args.get('q', '')
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 200)
+    except ValueError:
+        limit = 20
+    return jsonify(customer_registry.search(query, limit))
+
 @app.route('/redigera/<int:bid_id>', methods=['GET'])
 def redigera_anbud(bid_id):
-    conn = get_db_connection()
-    bid = conn.execute("SELECT id, datum, data FROM anbud WHERE id = ?", (bid_id,)).fetchone()
-    conn.close()
+    conn = get_db()
+    try:
+        bid, bid_data = load_bid(conn, bid_id)
+    except ValueError:
+        bid = conn.execute("SELECT id, datum FROM bids WHERE id = ?", (bid_id,)).fetchone()
+        bid_data = {}
     if not bid:
         flash("Anbudet hittades inte.", "danger")
         return redirect(url_for("old_bids"))
     
-    try:
-        bid_data = json.loads(bid["data"])
-    except Exception:
-        bid_data = {}
-    
     # Lägg till anbudets id i bid_info
     bid_info = bid_data.get("bid_info", {})
     bid_info["id"] = bid["id"]
@@ -996,7 +1014,7 @@ def redigera_anbud(bid_id):
         "Kalkylansvarig": bid_info.get("Kalkylansvarig", ""),
         "id": bid_info.get("id")  # Lägg med id:t
     }
-    session["pipe_list"] = bid_data.get("kalkyl", [])
+    start_new_draft(bid_data.get("kalkyl", []))
     
     flash("Kalkylen och anbudsinfo har laddats. Du kan nu bygga om receptet.", "success")
     return redirect(url_for("calculate"))
@@ -1004,10 +1022,8 @@ def redigera_anbud(bid_id):
 
 @app.route('/delete_bid/<int:bid_id>', methods=['POST'])
 def delete_bid(bid_id):
-    conn = get_db_connection()
-    conn.execute("DELETE FROM anbud WHERE id = ?", (bid_id,))
-    conn.commit()
-    conn.close()
+    conn = get_db()
+    delete_bid_record(conn, bid_id)
     flash("Anbudet har raderats.", "success")
     return redirect(url_for("old_bids"))
 
@@ -1125,27 +1141,46 @@ def delete_project_manager(index):
 
 @app.route('/copy_recipe', methods=['POST'])
 def copy_recipe():
-    pipe_list = session.get("pipe_list", [])
-    if pipe_list:
+    draft_id = current_draft_id()
+    last = drafts.last(draft_id)
+    if last:
         # Hämta det senaste receptet
-        last_recipe = pipe_list[-1]
+        last_recipe = last[1]
         # Skapa en kopia (en enkel copy)
         new_recipe = last_recipe.copy()
         # Lägg till kopian i översikten
-        pipe_list.append(new_recipe)
+        drafts.append(draft_id, new_recipe)
         # Spara det valda materialet för nästa recept
         session["default_material"] = new_recipe.get("material_key")
-        session["pipe_list"] = pipe_list
         flash("Receptet har kopierats och lagts till i översikten.", "success")
     else:
         flash("Inget recept att kopiera.", "danger")
     return redirect(url_for("calculate"))
 
 
+@app.route('/undo', methods=['POST'])
+def undo():
+    if drafts.undo(current_draft_id()):
+        flash("Ändringen har ångrats.", "success")
+    else:
+        flash("Det finns inget att ångra.", "warning")
+    return redirect(url_for("calculate"))
+
+@app.route('/redo', methods=['POST'])
+def redo():
+    if drafts.redo(current_draft_id()):
+        flash("Ändringen har gjorts om.", "success")
+    else:
+        flash("Det finns inget att göra om.", "warning")
+    return redirect(url_for("calculate"))
+
+
 @app.route('/save_adjusted_prices', methods=['POST'])
 def save_adjusted_prices():
     form_data = request.form.to_dict()
-    pipe_list = session.get("pipe_list", [])
+    draft_id = current_draft_id()
+    items = drafts.items(draft_id)
+    changed = set()
     # Gå igenom varje nyckel i formuläret
     for key, val in form_data.items():
         if key.startswith("adjusted_price_"):
@@ -1157,34 +1192,42 @@ def save_adjusted_prices():
             group_key = key[len("adjusted_price_"):]  # Exempel: "base_123456" eller "layer_4023313"
             if group_key.startswith("base_"):
                 material_key = group_key[len("base_"):]
-                for pipe in pipe_list:
+                for row_id, pipe in items:
                     if pipe.get("material_key") == material_key:
                         # Om inget nytt värde anges, gör ingenting (behåll tidigare sparade värdet)
-                        if adjusted_price is not None:
+                        if adjusted_price is not None and pipe.get("adjusted_price") != adjusted_price:
                             pipe["adjusted_price"] = adjusted_price
+                            changed.add(row_id)
             elif group_key.startswith("layer_"):
                 material_key = group_key[len("layer_"):]
-                for pipe in pipe_list:
+                for row_id, pipe in items:
                     layers = pipe.get("layers", [])
                     for layer in layers:
                         if layer.get("material_key") == material_key:
-                            if adjusted_price is not None:
+                            if adjusted_price is not None and layer.get("adjusted_price") != adjusted_price:
                                 layer["adjusted_price"] = adjusted_price
-    session["pipe_list"] = pipe_list
+                                changed.add(row_id)
+    # Skriv bara de rader som faktiskt ändrats, som en ändring
+    drafts.update_many(draft_id, {row_id: pipe for row_id, pipe in items if row_id in changed})
     flash("Justerade priser sparade i anbudet.", "success")
     return redirect(url_for("materialspecifikation"))
 
 @app.route('/update_overview', methods=['POST'])
 def update_overview():
-    pipe_list = session.get("pipe_list", [])
-    # Uppdatera endast de rader som finns i pipe_list
-    for i, pipe in enumerate(pipe_list):
+    draft_id = current_draft_id()
+    # Uppdatera endast de rader som finns i utkastet, och skriv bara de som ändrats
+    changed = {}
+    for i, (row_id, pipe) in enumerate(drafts.items(draft_id)):
         # Använd request.form.get() med defaultvärde, så att tomma fält inte ger fel
-        pipe['objekt'] = request.form.get(f"objekt_{i}", pipe.get('objekt', ''))
-        pipe['sektion'] = request.form.get(f"sektion_{i}", pipe.get('sektion', ''))
-    session["pipe_list"] = pipe_list
+        objekt = request.form.get(f"objekt_{i}", pipe.get('objekt', ''))
+        sektion = request.form.get(f"sektion_{i}", pipe.get('sektion', ''))
+        if objekt != pipe.get('objekt') or sektion != pipe.get('sektion'):
+            pipe['objekt'] = objekt
+            pipe['sektion'] = sektion
+            changed[row_id] = pipe
+    drafts.update_many(draft_id, changed)
     flash("Ändringarna har sparats.", "success")
-    return redirect(url_for("calculate"))
+    return redirect(url_for("calculate", page=request.form.get("page") or None))
 
 
 @app.route('/new_material', methods=['GET', 'POST'])
@@ -1236,6 +1279,10 @@ def new_material():
             session["materialer"] = materials_dict
             session.modified = True  # 🔥 Viktigt för att spara sessionen!
 
+            # Lägg även till i materialregistret så att det syns i listor och uppslag
+            materialer[artikelnr] = new_mat
+            catalog.invalidate()
+
             flash("Nytt material tillagt.", "success")
             return redirect(url_for("show_materials"))
 
@@ -1261,6 +1308,8 @@ def update_material_sheet():
             artikelnr = key.split("senast_uppdaterad_")[1]
             if artikelnr in materialer:
                 materialer[artikelnr]["senast_uppdaterad"] = value
+    # Materialtyper kan ha ändrats – bygg om katalogens index
+    catalog.invalidate()
     flash("Hela materialbladet har uppdaterats.", "success")
     return redirect(url_for("show_materials"))
 
@@ -0,0 +1,340 @@
+# batch_calc.py
+#
+# Vektoriserad motsvarighet till app.calculate_pipe: räknar ut många rörposter
+# på en gång med NumPy-arrayer i stället för en formulärpost i taget.
+
+import math
+
+import numpy as np
+
+# Kolumner som kan skickas in. Alla utom "material" och "length" är valfria.
+INPUT_COLUMNS = (
+    "pipe_type", "length", "dimension", "height", "width",
+    "material", "ytbekladnad", "hojdtillagg",
+    "bojar", "avstick", "ventilkapor", "flanskapa", "rorstod",
+    "folie", "band",
+    "material_layer", "material_layer_tillbehor",
+    "distansjarn_material", "distansjarn_procent", "distansring",
+)
+
+ROLL_LENGTH = 50          # Tejprullens längd (m)
+BAND_GRUNDTID = 0.018     # Grundtid för band (h/m)
+
+
+def _column(rows, name, n, default=None):
+    """Hämtar en kolumn som lista med längd n (saknad kolumn -> default)."""
+    if name in rows:
+        values = list(rows[name])
+        if len(values) != n:
+            raise ValueError(f"Kolumnen '{name}' har {len(values)} rader, förväntade {n}.")
+        return values
+    return [default] * n
+
+
+def _parse_float(values):
+    """
+    Tolkar värden på samma sätt som float(form.get(x) or 0).
+    Returnerar (array, felmask). Felaktiga värden blir 0.
+    """
+    n = len(values)
+    # Snabbväg: hela kolumnen går att tolka på en gång
+    try:
+        return np.array([v or 0 for v in values], dtype=np.float64), np.zeros(n, dtype=bool)
+    except (TypeError, ValueError):
+        pass
+    out = np.zeros(n, dtype=np.float64)
+    bad = np.zeros(n, dtype=bool)
+    for i, v in enumerate(values):
+        if not v:
+            continue
+        try:
+            out[i] = float(v)
+        except (TypeError, ValueError):
+            bad[i] = True
+    return out, bad
+
+
+def _parse_flag(values):
+    """Kryssrutor: sant om värdet är "yes" (eller redan ett sant bool-värde)."""
+    return np.array([v is True or v == "yes" for v in values], dtype=bool)
+
+
+def _lookup(keys, build):
+    """
+    Bygger en uppslagstabell med ett värde per unik nyckel och returnerar
+    (index per rad, tabell), så att materialdata bara läses en gång per nyckel.
+    """
+    index = {}
+    table = []
+    for key in dict.fromkeys(keys):
+        index[key] = len(table)
+        table.append(build(key))
+    codes = np.fromiter(map(index.__getitem__, keys), dtype=np.intp, count=len(keys))
+    return codes, table
+
+
+def _base_values(materialer, key):
+    """(isolering, kostnad, löpmeter, kvm, spoltråd) för ett basmaterial, eller ett felmeddelande."""
+    if not key:
+        return "Välj ett basmaterial."
+    data = materialer.get(key)
+    if not data:
+        return "Valt material finns inte."
+    name_lower = data["artikelnamn"].lower()
+    try:
+        return (
+            float(data.get("isoleringstjocklek", 0)),
+            float(data.get("kostnad", 0)),
+            float(data.get("lopmeter", 0)),
+            float(data.get("kvm", 0)),
+            float("lamellmatta" in name_lower or "conlit fire mat" in name_lower),
+        )
+    except ValueError:
+        # T.ex. tillbehör utan tider (tom sträng) – calculate_pipe kraschar på dessa
+        return "Valt material saknar tider och kan inte användas som isolering."
+
+
+def _yt_values(materialer, key):
+    """(finns, kostnad, aluminium) för en ytbeklädnad."""
+    yt_data = materialer.get(key) if key else None
+    if not yt_data:
+        return (0.0, 0.0, 0.0)
+    return (1.0, float(yt_data.get("kostnad", 0)), float("aluminium" in yt_data["artikelnamn"].lower()))
+
+
+def calculate_pipes(rows, materialer):
+    """
+    Beräknar alla rader i en kolumnbaserad tabell (dict med listor/arrayer
+    eller en DataFrame) och returnerar en dict med NumPy-arrayer per resultatfält.
+
+    Resultatet innehåller även "errors": en lista med felmeddelande per rad
+    (None för giltiga rader). Ogiltiga rader får nollor i alla arrayer.
+    "layers" är None för rader utan extra lager.
+    """
+    n = len(rows["length"]) if "length" in rows else len(rows["material"])
+
+    material_keys = _column(rows, "material", n)
+    yt_keys = _column(rows, "ytbekladnad", n)
+    # Som form.get("pipe_type", "Rör"): bara ett saknat värde blir Rör, inte en tom sträng
+    pipe_types = ["Rör" if p is None else p for p in _column(rows, "pipe_type", n, "Rör")]
+
+    length, bad_length = _parse_float(_column(rows, "length", n))
+    dimension, _ = _parse_float(_column(rows, "dimension", n))
+    height, bad_h = _parse_float(_column(rows, "height", n))
+    width, bad_w = _parse_float(_column(rows, "width", n))
+    # calculate_pipe nollställer både höjd och bredd om något av dem är ogiltigt
+    bad_hw = bad_h | bad_w
+    height[bad_hw] = 0
+    width[bad_hw] = 0
+    hojdtillagg, _ = _parse_float(_column(rows, "hojdtillagg", n))
+    counts = {name: _parse_float(_column(rows, name, n))[0]
+              for name in ("bojar", "avstick", "ventilkapor", "flanskapa", "rorstod")}
+    folie = _parse_flag(_column(rows, "folie", n))
+    band = _parse_flag(_column(rows, "band", n))
+
+    # --- Uppslag av materialdata per unik nyckel (inte per rad) ---
+    base_codes, base_table = _lookup(material_keys, lambda key: _base_values(materialer, key))
+    base_error = [v if isinstance(v, str) else None for v in base_table]
+    base_values = np.array([(0.0,) * 5 if isinstance(v, str) else v for v in base_table], dtype=np.float64).reshape(-1, 5)
+    base_insulation, kostnad, lop, kvm, spool_material = base_values[base_codes].T
+    spool_material = spool_material.astype(bool)
+
+    errors = [base_error[c] for c in base_codes.tolist()]
+    for i in np.flatnonzero(bad_length).tolist():
+        if errors[i] is None:
+            errors[i] = "Ogiltigt värde för längd."
+    valid = np.array([e is None for e in errors], dtype=bool)
+    # Ogiltiga rader räknas som noll överallt
+    base_insulation, kostnad, lop, kvm = (np.where(valid, a, 0.0) for a in (base_insulation, kostnad, lop, kvm))
+
+    ror_type = np.array([p == "Rör" for p in pipe_types], dtype=bool)
+    yt_codes, yt_table = _lookup(yt_keys, lambda key: _yt_values(materialer, key))
+    yt_values = np.array(yt_table, dtype=np.float64).reshape(-1, 3)
+    has_yt, yt_kostnad, yt_aluminium = yt_values[yt_codes].T
+    has_yt = has_yt.astype(bool) & valid
+    yt_aluminium = yt_aluminium.astype(bool)
+    # calculate_pipe slår upp materialer[nyckel] direkt för rör och kraschar på okända nycklar
+    missing_yt = np.array([bool(k) for k in yt_keys], dtype=bool) & ~has_yt & valid & ror_type
+    for i in np.flatnonzero(missing_yt).tolist():
+        errors[i] = "Vald ytbeklädnad finns inte."
+    valid &= ~missing_yt
+
+    # --- Extra lager: summeras per rad (sällsynta, därför en vanlig loop) ---
+    extra_insulation = np.zeros(n)
+    layers_info = [None] * n
+    layer_keys = _column(rows, "material_layer", n, ())
+    layer_tillbehor = _column(rows, "material_layer_tillbehor", n, ())
+    for i, keys in enumerate(layer_keys):
+        if not keys or errors[i]:
+            continue
+        tillbehor_list = list(layer_tillbehor[i] or ())
+        layers_info[i] = []
+        for j, mat_key in enumerate(keys):
+            mat = materialer.get(mat_key) if mat_key else None
+            if not mat:
+                continue
+            insulation = mat.get("isoleringstjocklek", 0)
+            extra_insulation[i] += insulation
+            try:
+                raw = tillbehor_list[j] if j < len(tillbehor_list) else ""
+                tillbehor = float(raw) if str(raw).strip() != "" else 0.0
+            except ValueError:
+                tillbehor = 0.0
+            layers_info[i].append({
+                "material_key": mat_key,
+                "insulation": insulation,
+                "artikelnamn": mat.get("artikelnamn"),
+                "tillbehor": tillbehor
+            })
+
+    is_ror = ror_type & valid
+    is_box = ~ror_type & valid
+
+    # --- Geometri ---
+    outer_diameter = np.where(is_ror, (dimension + 2 * (base_insulation + extra_insulation)) / 1000.0, 0.0)
+    circumference = math.pi * outer_diameter
+    area = np.where(is_ror, circumference * length, 0.0)
+    area = np.where(is_box, 2 * length * ((height + width + 4 * base_insulation) / 1000.0), area)
+
+    # --- Pris och arbetstid för isolering ---
+    price = area * kostnad
+    work_time_isolering = (lop * length) + (kvm * area)
+    work_time_isolering = np.where(hojdtillagg > 0, work_time_isolering * (1 + hojdtillagg / 100.0), work_time_isolering)
+
+    # --- Folie och band ---
+    foil_area = np.where(folie & is_ror, area * 1.1, 0.0)
+    band_length = np.where(band & is_ror, 3 * circumference * length, 0.0)
+    band_on = band & (band_length > 0)
+    band_grundtid = np.where(band_on, BAND_GRUNDTID, 0.0)
+    band_arbetstid = np.where(band_on, band_length * BAND_GRUNDTID, 0.0)
+
+    # --- Ytbeklädnad ---
+    yt_rows = has_yt & is_ror
+    yt_area = np.where(yt_rows, circumference * length, 0.0)
+    yt_cost = yt_area * yt_kostnad
+
+    # Aluminiumplåtens tider beror på ytterdiametern (mm)
+    outer_diameter_mm = outer_diameter * 1000
+    alu = yt_rows & yt_aluminium
+    other = yt_rows & ~yt_aluminium
+    grundtid_montering = np.select(
+        [alu & (outer_diameter_mm <= 250), alu & (outer_diameter_mm <= 640), alu, other],
+        [0.110, 0.07, 0.144, lop], 0.0)
+    grundtid_tillverkning = np.select(
+        [alu & (outer_diameter_mm <= 250), alu & (outer_diameter_mm <= 640), alu, other],
+        [0.04, 0.02, 0.08, kvm], 0.0)
+    tillaggstid_montering = np.where(alu, 0.068, 0.0)
+    work_time_ytbekladnad = np.where(
+        yt_rows,
+        (grundtid_montering * length) + (grundtid_tillverkning * yt_area) + (tillaggstid_montering * yt_area),
+        0.0)
+
+    # --- Tejp och spoltråd ---
+    tejp_quantity = np.where(is_ror, np.ceil(length * circumference / ROLL_LENGTH), 0).astype(np.int64)
+    spool = is_ror & spool_material
+    spoltrad_m = np.where(spool, 5 * math.pi * outer_diameter * length, 0.0)
+    spoltrad_kg = spoltrad_m / 350
+
+    return {
+        "n": n,
+        "errors": errors,
+        "valid": valid,
+        "pipe_type": pipe_types,
+        "material_key": material_keys,
+        "ytbekladnad_key": yt_keys,
+        "is_ror": is_ror,
+        "dimension": dimension,
+        "length": length,
+        "outer_diameter": outer_diameter,
+        "area": area,
+        "hojdtillagg": hojdtillagg,
+        "price": price,
+        "work_time_isolering": work_time_isolering,
+        "work_time_ytbekladnad": work_time_ytbekladnad,
+        "isolering_grund_montering": lop,
+        "isolering_grund_tillverkning": kvm,
+        "ytbekladnad_cost": yt_cost,
+        "ytbekladnad_area": yt_area,
+        "grundtid_montering": grundtid_montering,
+        "grundtid_tillverkning": grundtid_tillverkning,
+        "tillaggstid_montering": tillaggstid_montering,
+        "tejp_quantity": tejp_quantity,
+        "spoltrad_m": spoltrad_m,
+        "spoltrad_kg": spoltrad_kg,
+        "folie": folie,
+        "foil_area": foil_area,
+        "band": band,
+        "band_length": band_length,
+        "band_grundtid": band_grundtid,
+        "band_arbetstid": band_arbetstid,
+        "layers": layers_info,
+        "distansjarn_material": _column(rows, "distansjarn_material", n),
+        "distansjarn_procent": _column(rows, "distansjarn_procent", n),
+        "distansring": _column(rows, "distansring", n),
+        **counts,
+    }
+
+
+def to_rows(result, materialer):
+    """
+    Gör om resultatet från calculate_pipes till samma rad-dictionaries som
+    calculate_pipe ger. Returnerar (rader, fel) där fel är en lista med
+    (radindex, meddelande) för ogiltiga rader.
+    """
+    # tolist() ger vanliga Python-tal, så att raderna kan JSON-serialiseras
+    cols = {key: value.tolist() for key, value in result.items() if isinstance(value, np.ndarray)}
+    rows = []
+    errors = []
+    for i in range(result["n"]):
+        if result["errors"][i]:
+            errors.append((i, result["errors"][i]))
+            continue
+        material_key = result["material_key"][i]
+        base_name = materialer[material_key]["artikelnamn"]
+        layers = result["layers"][i] or []
+        if layers:
+            extra_names = ", ".join([layer["artikelnamn"] for layer in layers])
+            display_material = f"{base_name} (+ {extra_names})"
+        else:
+            display_material = base_name
+        is_ror = cols["is_ror"][i]
+        rows.append({
+            "pipe_type": result["pipe_type"][i],
+            "material": display_material,
+            "material_key": material_key,
+            "dimension": cols["dimension"][i] if is_ror else "",
+            "length": cols["length"][i],
+            "area": cols["area"][i],
+            "hojdtillagg": cols["hojdtillagg"][i],
+            "price": cols["price"][i],
+            "work_time": cols["work_time_isolering"][i],
+            "work_time_isolering": cols["work_time_isolering"][i],
+            "work_time_ytbekladnad": cols["work_time_ytbekladnad"][i],
+            "bojar": cols["bojar"][i],
+            "avstick": cols["avstick"][i],
+            "ventilkapor": cols["ventilkapor"][i],
+            "flanskapa": cols["flanskapa"][i],
+            "rorstod": cols["rorstod"][i],
+            "layers": layers,
+            "ytbekladnad_key": result["ytbekladnad_key"][i],
+            "ytbekladnad_cost": cols["ytbekladnad_cost"][i],
+            "ytbekladnad_area": cols["ytbekladnad_area"][i],
+            "grundtid_montering": cols["grundtid_montering"][i],
+            "grundtid_tillverkning": cols["grundtid_tillverkning"][i],
+            "tillaggstid_montering": cols["tillaggstid_montering"][i],
+            "isolering_grund_montering": cols["isolering_grund_montering"][i],
+            "isolering_grund_tillverkning": cols["isolering_grund_tillverkning"][i],
+            "tejp_quantity": cols["tejp_quantity"][i],
+            "spoltrad_m": cols["spoltrad_m"][i],
+            "spoltrad_kg": cols["spoltrad_kg"][i],
+            "folie": cols["folie"][i],
+            "foil_area": cols["foil_area"][i],
+            "band": cols["band"][i],
+            "band_length": cols["band_length"][i],
+            "band_grundtid": cols["band_grundtid"][i],
+            "band_arbetstid": cols["band_arbetstid"][i],
+            "distansjarn_material": result["distansjarn_material"][i],
+            "distansjarn_procent": result["distansjarn_procent"][i],
+            "distansring": result["distansring"][i]
+        })
+    return rows, errors
@@ -0,0 +1,556 @@
+# benchmark.py
+#
+# Prestandamätningar för Thermkalk. Körs från appens katalog, t.ex.:
+#   python benchmark.py batch
+#   python benchmark.py batch --rows 10000 100000
+#   python benchmark.py startup
+#   python benchmark.py bids --bids 1000 10000 100000
+#   python benchmark.py customers --rows 10000 100000
+#   python benchmark.py render --rows 1000 10000 50000
+#   python benchmark.py stream --rows 1000 10000 50000
+#   python benchmark.py importtime --check
+#   python benchmark.py drafts --rows 1000 10000 50000
+#   python benchmark.py revisions --rows 1000 10000 50000
+#   python benchmark.py codec --rows 1000 10000 50000
+#   python benchmark.py search --bids 1000 10000 100000
+
+import argparse
+import json
+import random
+import time
+
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+# --- Batchberäkning (calculate_pipe rad för rad mot batch_calc) ---
+def _synthetic_recipes(materialer, n, seed=1):
+    """Skapar n slumpmässiga receptrader som kolumner (som från ett formulär)."""
+    rng = random.Random(seed)
+    base_keys = [k for k, d in materialer.items()
+                 if d.get("material typ") not in ("Tillbehör", "Aluminiumplåt", "Stålplåt")]
+    yt_keys = [k for k, d in materialer.items() if "aluminium" in d["artikelnamn"].lower()]
+    return {
+        "pipe_type": [rng.choice(("Rör", "Rör", "Rör", "Fyrkantig")) for _ in range(n)],
+        "length": [str(round(rng.uniform(1, 200), 1)) for _ in range(n)],
+        "dimension": [str(rng.choice((22, 48, 89, 114, 219, 508))) for _ in range(n)],
+        "height": [str(rng.randint(100, 800)) for _ in range(n)],
+        "width": [str(rng.randint(100, 800)) for _ in range(n)],
+        "material": [rng.choice(base_keys) for _ in range(n)],
+        "ytbekladnad": [rng.choice(yt_keys + ["", ""]) for _ in range(n)],
+        "hojdtillagg": [rng.choice(("", "0", "10", "25")) for _ in range(n)],
+        "folie": [rng.choice(("yes", "")) for _ in range(n)],
+        "band": [rng.choice(("yes", "")) for _ in range(n)],
+    }
+
+
+def bench_batch(sizes):
+    from werkzeug.datastructures import MultiDict
+    from app import calculate_pipe, materialer
+    from batch_calc import calculate_pipes, to_rows
+
+    print(f"{'rader':>8} {'per rad (s)':>12} {'batch (s)':>10} {'batch+rader (s)':>16} {'faktor':>8}")
+    for n in sizes:
+        columns = _synthetic_recipes(materialer, n)
+        forms = [MultiDict({name: values[i] for name, values in columns.items()}) for i in range(n)]
+
+        per_row, t_row = _timed(lambda: [calculate_pipe(f)[0] for f in forms])
+        result, t_batch = _timed(calculate_pipes, columns, materialer)
+        (rows, errors), t_rows = _timed(to_rows, result, materialer)
+
+        assert not errors and rows == per_row, "batch_calc skiljer sig från calculate_pipe"
+        print(f"{n:>8} {t_row:>12.3f} {t_batch:>10.3f} {t_batch + t_rows:>16.3f} {t_row / t_batch:>7.1f}x")
+
+
+# --- Uppstart av materialregistret (materials.py mot ögonblicksbild) ---
+_STARTUP_SNIPPET = """
+import resource, sys, time
+start = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - start
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(elapsed, rss_kb, len(materialer))
+"""
+
+
+def _startup_run(code):
+    import subprocess
+    import sys
+    out = subprocess.run([sys.executable, "-c", _STARTUP_SNIPPET.format(code=code)],
+                         capture_output=True, text=True, check=True).stdout.split()
+    return float(out[0]), int(out[1]) / 1024, int(out[2])
+
+
+def bench_startup(repeat):
+    import materials_snapshot
+    materials_snapshot.build_snapshot()
+    variants = [
+        ("materials.py", "from materials import materialer"),
+        ("ögonblicksbild", "from materials_snapshot import get_materialer; materialer = get_materialer()"),
+    ]
+    print(f"{'variant':>16} {'import (ms)':>12} {'max RSS (MB)':>13} {'material':>9}")
+    for name, code in variants:
+        runs = [_startup_run(code) for _ in range(repeat)]
+        best = min(runs)
+        print(f"{name:>16} {best[0] * 1000:>12.1f} {best[1]:>13.1f} {best[2]:>9}")
+
+
+# --- Anbudslistan (nyckelbaserad bläddring i bids) ---
+def _synthetic_bids_db(path, n, seed=1):
+    """Skapar en anbudsdatabas med n syntetiska anbud (utan kalkylrader)."""
+    import datetime
+    import db
+    rng = random.Random(seed)
+    customers = [f"Kund {i} AB" for i in range(500)]
+    departments = ["Stockholm", "Göteborg", "Malmö", "Uppsala", "60 Sundsvall", "89 Luleå"]
+    managers = [f"Projektledare {i}" for i in range(40)]
+    start = datetime.datetime(2020, 1, 1)
+    db.init_db(path)
+    conn = db.get_db_connection(path)
+    header = ", ".join(column for column, _ in db.HEADER_FIELDS)
+    rows = []
+    for i in range(n):
+        datum = (start + datetime.timedelta(minutes=i * 25 + rng.randint(0, 20))).strftime("%Y-%m-%d %H:%M:%S")
+        info = {"Anbudsnummer": str(10000 + i), "Anbudsnamn": f"Anbud {i}", "Kund": rng.choice(customers),
+                "Avdelning": rng.choice(departments), "Projektledare": rng.choice(managers),
+                "Kalkylansvarig": "Kalkyl", "projekt_typ": rng.choice(("VS", "Vent", "Industri", "Tankar"))}
+        rows.append((datum, *[info.get(key) for _, key in db.HEADER_FIELDS], "{}"))
+    with conn:
+        conn.executemany(f"INSERT INTO bids (datum, {header}, bid_info) VALUES (?, {', '.join('?' for _ in db.HEADER_FIELDS)}, ?)",
+                         rows)
+    db.analyze(conn)  # som vid appstart
+    return conn
+
+
+def bench_bids(sizes, repeat):
+    import os
+    import tempfile
+    import db
+
+    def best(func):
+        return min(_timed(func)[1] for _ in range(repeat)) * 1000
+
+    print(f"{'anbud':>8} {'första sidan':>13} {'sista sidan':>12} {'filtrerad':>10} {'OFFSET sista':>13} {'alla (gammal)':>14}  (ms)")
+    for n in sizes:
+        path = os.path.join(tempfile.mkdtemp(), "anbud.db")
+        conn = _synthetic_bids_db(path, n)
+        # Markör för sidan näst längst bak (som efter att ha bläddrat hela vägen)
+        deep = conn.execute("SELECT datum, id FROM bids ORDER BY datum, id LIMIT 1 OFFSET 60").fetchone()
+        after = (deep["datum"], deep["id"])
+        customer = conn.execute("SELECT kund FROM bids LIMIT 1").fetchone()[0]
+
+        first = best(lambda: db.list_bids(conn))
+        last = best(lambda: db.list_bids(conn, after=after))
+        filtered = best(lambda: db.list_bids(conn, {"kund": customer, "projekt_typ": "VS"}, date_from="2020-01-01"))
+        offset = best(lambda: conn.execute("SELECT * FROM bids ORDER BY datum DESC, id DESC LIMIT 50 OFFSET ?",
+                                           (max(n - 60, 0),)).fetchall())
+        everything = best(lambda: conn.execute("SELECT * FROM bids ORDER BY id DESC").fetchall())
+        print(f"{n:>8} {first:>13.2f} {last:>12.2f} {filtered:>10.2f} {offset:>13.2f} {everything:>14.2f}")
+        conn.close()
+
+
+# --- Fulltextsökning bland anbud (FTS5) ---
+def bench_search(sizes, repeat):
+    import os
+    import tempfile
+    import db
+
+    def best(func):
+        return min(_timed(func)[1] for _ in range(repeat)) * 1000
+
+    queries = (("anbudsnummer", "10042"), ("kund", "Kund 123"), ("prefix", "Projektled"), ("alla anbud", "Anbud"))
+    print(f"{'anbud':>8} {'bygg index (s)':>15} {'spara (ms)':>11} " + " ".join(f"{name:>13}" for name, _ in queries)
+          + "   (ms per sökning, 20 träffar)")
+    for n in sizes:
+        path = os.path.join(tempfile.mkdtemp(), "anbud.db")
+        conn = _synthetic_bids_db(path, n)
+        with conn:
+            _, t_build = _timed(db.rebuild_search_index, conn)
+        # Sparning av ett anbud med 100 rader, inklusive uppdatering av indexet
+        rows = [{"material": "Rörskål Diff 042/020mm, Isover", "material_key": "00129042020",
+                 "objekt": f"Objekt {i}", "sektion": f"Plan {i % 5}"} for i in range(100)]
+        bid_id = db.save_bid_record(conn, {"Anbudsnamn": "Benchmark"}, rows, "2025-01-01 00:00:00")
+        t_save = best(lambda: db.save_bid_record(conn, {"Anbudsnamn": "Benchmark"}, rows, "2025-01-01 00:00:00",
+                                                 bid_id))
+        times = [best(lambda: db.search_bids(conn, query)) for _, query in queries]
+        print(f"{n:>8} {t_build:>15.2f} {t_save:>11.2f} " + " ".join(f"{t:>13.2f}" for t in times))
+        conn.close()
+
+
+# --- Import av kundlista (openpyxl read-only, upsert per Kundnr) ---
+def _synthetic_customer_file(path, n, changed=0, seed=1):
+    """Skriver en kundlista med n kunder; de första changed kunderna får ny adress."""
+    import openpyxl
+    rng = random.Random(seed)
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(["Kundnr", "Kund", "Kundtyp", "Person/Orgnr", "Adressrad 1", "Postnr", "Ort", "Land", "Telefon"])
+    for i in range(n):
+        number, postnr = rng.randint(1, 200), rng.randint(10000, 99999)
+        street = f"Ändrad väg {i}" if i < changed else f"Gatan {number}"
+        ws.append([str(100000 + i), f"Kund {i} AB", "Företag", f"55{i:04d}-{i % 10000:04d}", street,
+                   str(postnr), "Ort", "Sverige", ""])
+    wb.save(path)
+
+
+def _customer_registry(directory):
+    import os
+    import db
+    from customers import CustomerRegistry
+    path = os.path.join(directory, "anbud.db")
+    db.init_db(path)
+    pool = db.ConnectionPool(path, size=1)
+    return CustomerRegistry(pool, os.path.join(directory, "customers.xlsx")), pool
+
+
+def bench_customers(sizes):
+    import os
+    import tempfile
+    import tracemalloc
+
+    print(f"{'rader':>8} {'ny (s)':>7} {'samma (s)':>10} {'1 % ändr. (s)':>14} {'max minne (MB)':>15}  utfall vid 1 % ändr.")
+    for n in sizes:
+        directory = tempfile.mkdtemp()
+        first = os.path.join(directory, "upload1.xlsx")
+        second = os.path.join(directory, "upload2.xlsx")
+        _synthetic_customer_file(first, n)
+        _synthetic_customer_file(second, n, changed=n // 100)
+
+        registry, pool = _customer_registry(directory)
+        _, t_new = _timed(registry.import_file, first)
+        _, t_same = _timed(registry.import_file, first)
+        counts, t_changed = _timed(registry.import_file, second)
+        pool.close()
+
+        # Minnestoppen mäts i en separat körning (tracemalloc gör importen långsammare)
+        registry, pool = _customer_registry(tempfile.mkdtemp())
+        tracemalloc.start()
+        registry.import_file(first)
+        peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+        pool.close()
+        print(f"{n:>8} {t_new:>7.2f} {t_same:>10.2f} {t_changed:>14.2f} {peak:>15.1f}  {counts}")
+
+
+# --- Detaljerade beräkningar (radmodeller + rendering av mallen) ---
+def bench_render(sizes, repeat):
+    from app import app, materialer, accessory_prices
+    from aggregate import aggregate
+    from batch_calc import calculate_pipes, to_rows
+    from detail_rows import detail_rows, thousands
+    from flask import render_template
+
+    def best(func):
+        runs = [_timed(func) for _ in range(repeat)]
+        return runs[0][0], min(elapsed for _, elapsed in runs)
+
+    print(f"{'rader':>8} {'aggregate (s)':>14} {'radmodeller (s)':>16} {'mall (s)':>9} {'µs/rad':>7} {'HTML (MB)':>10}")
+    for n in sizes:
+        rows, errors = to_rows(calculate_pipes(_synthetic_recipes(materialer, n), materialer), materialer)
+        assert not errors
+        summary, t_aggregate = best(lambda: aggregate(rows, materialer, accessory_prices()))
+        models, t_models = best(lambda: detail_rows(summary.rows, materialer))
+        with app.test_request_context("/detailed_calculations"):
+            html, t_render = best(lambda: render_template(
+                "detailed_calculations.html", rows=models,
+                total_material_cost=thousands(summary.material_cost_rounded),
+                total_work_time=round(summary.work_time, 2)))
+        total = t_aggregate + t_models + t_render
+        print(f"{n:>8} {t_aggregate:>14.3f} {t_models:>16.3f} {t_render:>9.3f} {total / n * 1e6:>7.1f} "
+              f"{len(html.encode()) / 1024 / 1024:>10.1f}")
+
+
+# --- Strömmade sidor (tid till första biten och minnestopp per förfrågan) ---
+def _first_and_total(client, path):
+    start = time.perf_counter()
+    response = client.get(path, buffered=False)
+    chunks = iter(response.response)
+    next(chunks)
+    first = time.perf_counter() - start
+    size = sum(len(chunk) for chunk in chunks)
+    response.close()
+    return first, time.perf_counter() - start, size
+
+
+def bench_stream(sizes):
+    import tracemalloc
+    from app import app, drafts, materialer
+    from batch_calc import calculate_pipes, to_rows
+
+    client = app.test_client()
+    print(f"{'rader':>8} {'sida':>24} {'första biten (ms)':>18} {'hela (ms)':>10} {'max minne (MB)':>15}")
+    for n in sizes:
+        rows, errors = to_rows(calculate_pipes(_synthetic_recipes(materialer, n), materialer), materialer)
+        assert not errors
+        draft_id = drafts.create()
+        try:
+            drafts.extend(draft_id, rows)
+            del rows
+            with client.session_transaction() as sess:
+                sess["draft_id"] = draft_id
+            for path in ("/calculate", "/detailed_calculations"):
+                _first_and_total(client, path)  # värmer upp cacharna
+                first, total, _ = _first_and_total(client, path)
+                # Minnestoppen mäts i en separat körning (tracemalloc gör renderingen långsammare)
+                tracemalloc.start()
+                _first_and_total(client, path)
+                peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+                tracemalloc.stop()
+                print(f"{n:>8} {path:>24} {first * 1000:>18.1f} {total * 1000:>10.1f} {peak:>15.1f}")
+        finally:
+            drafts.drop(draft_id)
+
+
+# --- Utkastlagringar: kostnad per ändring ---
+def bench_drafts(sizes, stores, repeat):
+    import os
+    import tempfile
+    from app import accessory_prices, materialer
+    from batch_calc import calculate_pipes, to_rows
+    from drafts import create_draft_store
+    from totals import RunningTotals
+
+    print(f"{'rader':>8} {'lagring':>8} {'lägg till':>10} {'ändra':>8} {'flytta':>8} {'ta bort':>8} "
+          f"{'första läsning':>15} {'ögonblicksbild':>15}   (ms)")
+    for n in sizes:
+        rows, errors = to_rows(calculate_pipes(_synthetic_recipes(materialer, n), materialer), materialer)
+        assert not errors
+        for kind in stores:
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "drafts" if kind == "files" else "drafts.db")
+                store = create_draft_store(kind, path, totals=RunningTotals(accessory_prices))
+                draft_id = store.create()
+                store.extend(draft_id, rows)
+                row_ids = [row_id for row_id, _ in store.items(draft_id)]
+                rng = random.Random(1)
+
+                def per_edit(edit):
+                    start = time.perf_counter()
+                    for _ in range(repeat):
+                        edit()
+                    return (time.perf_counter() - start) / repeat * 1000
+
+                t_add = per_edit(lambda: store.append(draft_id, rows[0]))
+                t_update = per_edit(lambda: store.update(draft_id, rng.choice(row_ids),
+                                                         dict(rows[0], objekt=str(rng.random()))))
+                t_move = per_edit(lambda: store.move(draft_id, rng.choice(row_ids), rng.randrange(n)))
+                deleted = rng.sample(row_ids, repeat)
+                t_delete = per_edit(lambda: store.delete(draft_id, deleted.pop()))
+                compact = getattr(store, "compact", None)
+                t_compact = _timed(compact, draft_id)[1] * 1000 if compact else None
+                # En ny lagring motsvarar en ny arbetsprocess (eller omstart efter krasch)
+                fresh = create_draft_store(kind, path, totals=RunningTotals(accessory_prices))
+                _, t_load = _timed(fresh.items, draft_id, 0, 1)
+                print(f"{n:>8} {kind:>8} {t_add:>10.2f} {t_update:>8.2f} {t_move:>8.2f} {t_delete:>8.2f} "
+                      f"{t_load * 1000:>15.1f} {'-' if t_compact is None else f'{t_compact:.1f}':>15}")
+
+
+# --- Versionshistorik för sparade anbud ---
+def bench_revisions(sizes, saves, edits):
+    """Varje sparning ändrar edits rader; historikens storlek jämförs med en hel kopia per version."""
+    import os
+    import tempfile
+    from app import materialer
+    from batch_calc import calculate_pipes, to_rows
+    import db
+
+    print(f"{'rader':>8} {'versioner':>10} {'spara (ms)':>11} {'historik (kB)':>14} {'hela kopior (kB)':>17} "
+          f"{'läs senaste (ms)':>17} {'läs äldsta (ms)':>16}")
+    for n in sizes:
+        rows, errors = to_rows(calculate_pipes(_synthetic_recipes(materialer, n), materialer), materialer)
+        assert not errors
+        spare, _ = to_rows(calculate_pipes(_synthetic_recipes(materialer, edits, seed=2), materialer), materialer)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "anbud.db")
+            db.init_db(path)
+            conn = db.get_db_connection(path)
+            bid_info = {"Anbudsnamn": "Benchmark"}
+            bid_id = db.save_bid_record(conn, bid_info, rows, "2025-01-01 00:00:00")
+            rng = random.Random(1)
+            start = time.perf_counter()
+            for _ in range(saves):
+                rows = list(rows)
+                for row in spare:
+                    rows[rng.randrange(n)] = dict(row, objekt=str(rng.random()))
+                db.save_bid_record(conn, bid_info, rows, "2025-01-01 00:00:00", bid_id)
+            t_save = (time.perf_counter() - start) / saves
+            revisions = db.list_revisions(conn, bid_id)
+            full_size = len(db._keyframe("{}", [json.dumps(row) for row in rows])) * len(revisions)
+            history = sum(revision["size"] for revision in revisions)
+            # Senaste versionen ligger längst från sin nyckelbild när den inte själv är en
+            _, t_last = _timed(db.load_revision, conn, bid_id, revisions[0]["revision"])
+            _, t_first = _timed(db.load_revision, conn, bid_id, 1)
+            conn.close()
+        print(f"{n:>8} {len(revisions):>10} {t_save * 1000:>11.1f} {history / 1000:>14.0f} "
+              f"{full_size / 1000:>17.0f} {t_last * 1000:>17.1f} {t_first * 1000:>16.1f}")
+
+
+# --- Komprimering av lagrade kalkylrader ---
+def bench_codec(sizes, repeat):
+    """Lagrad storlek och lästid för kalkylraderna: okomprimerade mot komprimerade med ordbok."""
+    import os
+    import tempfile
+    import zlib
+    from app import materialer
+    from batch_calc import calculate_pipes, to_rows
+    import codec
+    import db
+
+    methods = [("zlib", codec.ZLIB)] + ([("zstd", codec.ZSTD)] if codec.zstandard else [])
+    print(f"{'rader':>8} {'lagring':>16} {'storlek (kB)':>13} {'per rad (B)':>12} {'komprimera (µs/rad)':>20} "
+          f"{'läs sida (ms)':>14} {'läs alla (ms)':>14}")
+    for n in sizes:
+        rows, errors = to_rows(calculate_pipes(_synthetic_recipes(materialer, n), materialer), materialer)
+        assert not errors
+        texts = [json.dumps(row) for row in rows]
+        plain = sum(len(zlib.compress(text.encode("utf-8"))) for text in texts)
+        print(f"{n:>8} {'zlib utan ordbok':>16} {plain / 1000:>13.0f} {plain / n:>12.0f} {'-':>20} {'-':>14} {'-':>14}")
+        samples = texts[::max(len(texts) // codec.TRAIN_SAMPLES, 1)][:codec.TRAIN_SAMPLES]
+        for name, method in [("text", None)] + methods:
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "anbud.db")
+                db.init_db(path)
+                conn = db.get_db_connection(path)
+                bid_id = db.save_bid_record(conn, {}, [], "2025-01-01 00:00:00")
+                if method is None:
+                    values, t_pack = texts, None
+                else:
+                    dictionary = codec.train(samples, method)
+                    db._add_dictionary(conn, dictionary, len(samples))
+                    values, t_pack = _timed(lambda: [codec.pack(dictionary, text) for text in texts])
+                with conn:
+                    db._insert_row_values(conn, bid_id, values)
+                size = conn.execute("SELECT SUM(LENGTH(data)) FROM bid_rows WHERE bid_id = ?", (bid_id,)).fetchone()[0]
+                t_page = min(_timed(db.load_rows, conn, bid_id, n // 2, 100)[1] for _ in range(repeat))
+                t_all = min(_timed(db.load_rows, conn, bid_id)[1] for _ in range(repeat))
+                conn.close()
+            packed = "-" if t_pack is None else f"{t_pack / n * 1e6:.1f}"
+            label = name if method is None else f"{name} med ordbok"
+            print(f"{n:>8} {label:>16} {size / 1000:>13.0f} {size / n:>12.0f} {packed:>20} "
+                  f"{t_page * 1000:>14.2f} {t_all * 1000:>14.1f}")
+
+
+# --- Importtid för appen (python -X importtime) ---
+# Tunga beroenden som bara behövs för Excel-filer och importen av receptrader;
+# de ska inte laddas när en arbetsprocess startar.
+HEAVY_MODULES = ("openpyxl", "numpy", "pandas")
+
+
+def _importtime(code):
+    """
+    Kör code i en ny process med -X importtime. Returnerar ({modul: kumulativ
+    importtid (s)} för de moduler code importerar direkt, alla laddade moduler).
+    """
+    import subprocess
+    import sys
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            capture_output=True, text=True, check=True).stderr
+    times, loaded = {}, set()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # rubrikraden
+        loaded.add(name.strip())
+        if not name.startswith("  "):  # indragna moduler importeras av en annan modul
+            times[name.strip()] = int(cumulative) / 1e6
+    return times, loaded
+
+
+def bench_importtime(repeat, check):
+    """Importtid för app.py och vad de tunga beroendena kostar när de väl behövs."""
+    variants = [
+        ("import app", ("app",)),
+        ("+ Excel (openpyxl)", ("app", "openpyxl")),
+        ("+ receptimport", ("app", "batch_calc")),
+    ]
+    print(f"{'variant':>20} {'import (ms)':>12}  tunga moduler")
+    loaded_at_start = ()
+    for name, modules in variants:
+        runs = [_importtime("import " + ", ".join(modules)) for _ in range(repeat)]
+        total = min(sum(times.get(module, 0) for module in modules) for times, _ in runs)
+        heavy = [module for module in HEAVY_MODULES if module in runs[0][1]]
+        if modules == ("app",):
+            loaded_at_start = heavy
+        print(f"{name:>20} {total * 1000:>12.1f}  {', '.join(heavy) or '-'}")
+    if check and loaded_at_start:
+        raise SystemExit(f"Laddas vid uppstart: {', '.join(loaded_at_start)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prestandamätningar för Thermkalk")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("batch", help="calculate_pipe rad för rad mot batch_calc.calculate_pipes")
+    p.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+
+    p = sub.add_parser("startup", help="Importtid och minne: materials.py mot ögonblicksbild")
+    p.add_argument("--repeat", type=int, default=5)
+
+    p = sub.add_parser("bids", help="Anbudslistan: nyckelbaserad bläddring på en syntetisk databas")
+    p.add_argument("--bids", type=int, nargs="+", default=[1000, 10000, 100000])
+    p.add_argument("--repeat", type=int, default=5)
+
+    p = sub.add_parser("search", help="Fulltextsökning bland anbud: bygga indexet, spara och söka")
+    p.add_argument("--bids", type=int, nargs="+", default=[1000, 10000, 100000])
+    p.add_argument("--repeat", type=int, default=5)
+
+    p = sub.add_parser("customers", help="Import av kundlista: tid och minne per uppladdning")
+    p.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+
+    p = sub.add_parser("render", help="Detaljerade beräkningar: radmodeller och rendering av mallen")
+    p.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 50000])
+    p.add_argument("--repeat", type=int, default=3)
+
+    p = sub.add_parser("stream", help="Strömmade sidor: tid till första biten och minnestopp")
+    p.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 50000])
+
+    p = sub.add_parser("drafts", help="Utkastlagringarna: tid per ändring, första läsning och ögonblicksbild")
+    p.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 50000])
+    p.add_argument("--stores", nargs="+", default=["sqlite", "oplog"], choices=["sqlite", "oplog", "files"])
+    p.add_argument("--repeat", type=int, default=50)
+
+    p = sub.add_parser("revisions", help="Versionshistoriken: tid per sparning, lagrad storlek och läsning av en version")
+    p.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 50000])
+    p.add_argument("--saves", type=int, default=30)
+    p.add_argument("--edits", type=int, default=5, help="ändrade rader per sparning")
+
+    p = sub.add_parser("codec", help="Komprimerade kalkylrader: lagrad storlek, tid att komprimera och att läsa")
+    p.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 50000])
+    p.add_argument("--repeat", type=int, default=3)
+
+    p = sub.add_parser("importtime", help="Importtid för appen och de tunga beroendena (python -X importtime)")
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--check", action="store_true", help="avsluta med fel om ett tungt beroende laddas vid uppstart")
+
+    args = parser.parse_args()
+    if args.command == "batch":
+        bench_batch(args.rows)
+    elif args.command == "startup":
+        bench_startup(args.repeat)
+    elif args.command == "bids":
+        bench_bids(args.bids, args.repeat)
+    elif args.command == "search":
+        bench_search(args.bids, args.repeat)
+    elif args.command == "customers":
+        bench_customers(args.rows)
+    elif args.command == "render":
+        bench_render(args.rows, args.repeat)
+    elif args.command == "stream":
+        bench_stream(args.rows)
+    elif args.command == "drafts":
+        bench_drafts(args.rows, args.stores, args.repeat)
+    elif args.command == "revisions":
+        bench_revisions(args.rows, args.saves, args.edits)
+    elif args.command == "codec":
+        bench_codec(args.rows, args.repeat)
+    elif args.command == "importtime":
+        bench_importtime(args.repeat, args.check)
+
+
+if __name__ == "__main__":
+    main()
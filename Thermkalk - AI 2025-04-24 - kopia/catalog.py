@@ -0,0 +1,320 @@
+# catalog.py
+#
+# Indexerat materialregister. Omsluter dicten materialer och bygger en gång
+# de uppslag som sidorna behöver (per materialtyp, diameter, isoleringstjocklek
+# och ytbeklädnad) i stället för att gå igenom hela registret vid varje anrop.
+# Indexen byggs om först när registret har ändrats (invalidate()).
+#
+# export() ger registret som JSON tillsammans med en versionshash av
+# innehållet; /api/materials använder hashen som ETag och i adressen.
+#
+# profile() ger en fryst MaterialProfile per material med de värden och
+# flaggor som calculate_pipe behöver, så att namn och tider inte tolkas om
+# för varje rad. Profilerna kastas också vid invalidate().
+
+import hashlib
+import json
+import re
+from datetime import datetime, timezone
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from typing import NamedTuple
+
+# Materialtyper som inte kan väljas som isolering på kalkylsidan
+EXCLUDED_TYPES = ("Tillbehör", "Aluminiumplåt", "Stålplåt")
+PIPE_SECTION_TYPES = ("Rörskål", "Rörskål Diff")
+
+# Arbetstider för aluminiumplåt per ytterdiameter (mm):
+# (största ytterdiameter, grundtid montering, grundtid tillverkning, tilläggstid montering)
+ALUMINIUM_CLADDING_BANDS = (
+    (250, 0.110, 0.04, 0.068),
+    (640, 0.07, 0.02, 0.068),
+    (float("inf"), 0.144, 0.08, 0.068),
+)
+
+_DIAMETER_RE = re.compile(r"^\s*(\d+(?:[.,]\d+)?)\s*(?:-\s*(\d+(?:[.,]\d+)?))?\s*$")
+
+
+def parse_diameter(value):
+    """
+    Tolkar diameterfältet: "219" -> (219.0, 219.0), "22-28" -> (22.0, 28.0).
+    Returnerar None om fältet är tomt eller inte går att tolka.
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return (float(value), float(value))
+    match = _DIAMETER_RE.match(str(value))
+    if not match:
+        return None
+    low = float(match.group(1).replace(",", "."))
+    high = float(match.group(2).replace(",", ".")) if match.group(2) else low
+    return (low, high)
+
+
+def _as_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _nearest(sorted_values, target):
+    """Index för värdet närmast target i en sorterad lista (lika avstånd -> det större)."""
+    pos = bisect_left(sorted_values, target)
+    if pos == 0:
+        return 0
+    if pos == len(sorted_values):
+        return pos - 1
+    before, after = sorted_values[pos - 1], sorted_values[pos]
+    return pos - 1 if target - before < after - target else pos
+
+
+class MaterialProfile(NamedTuple):
+    """
+    Fryst sammanfattning av en materialpost. Värdena är oförändrade från
+    registret (samma typ), så att beräkningarna ger samma resultat som förut.
+    """
+    key: str
+    artikelnamn: str
+    isoleringstjocklek: object
+    kostnad: object
+    lopmeter: object
+    kvm: object
+    is_lamellmatta: bool
+    is_fire_mat: bool
+    is_aluminium_cladding: bool
+    cladding_bands: tuple
+
+    @classmethod
+    def from_data(cls, key, data):
+        name = data.get("artikelnamn", "")
+        name_lower = name.lower()
+        is_aluminium = "aluminium" in name_lower
+        return cls(
+            key=key,
+            artikelnamn=name,
+            isoleringstjocklek=data.get("isoleringstjocklek", 0),
+            kostnad=data.get("kostnad", 0),
+            lopmeter=data.get("lopmeter", 0),
+            kvm=data.get("kvm", 0),
+            is_lamellmatta="lamellmatta" in name_lower,
+            is_fire_mat="conlit fire mat" in name_lower,
+            is_aluminium_cladding=is_aluminium,
+            cladding_bands=ALUMINIUM_CLADDING_BANDS if is_aluminium else (),
+        )
+
+    @property
+    def uses_spool(self):
+        """Lamellmatta och Conlit Fire Mat fästs med spoltråd och tejp."""
+        return self.is_lamellmatta or self.is_fire_mat
+
+    def cladding_times(self, outer_diameter_mm):
+        """
+        (grundtid montering, grundtid tillverkning, tilläggstid montering) som
+        ytbeklädnad vid given ytterdiameter, eller None om materialet inte har
+        egna tider (då används isoleringens tider).
+        """
+        for limit, montering, tillverkning, tillagg in self.cladding_bands:
+            if outer_diameter_mm <= limit:
+                return montering, tillverkning, tillagg
+        return None
+
+
+class MaterialCatalog:
+    """Materialregister med förbyggda sekundärindex."""
+
+    def __init__(self, materialer):
+        self.materialer = materialer
+        self.version = 0
+        self.modified = datetime.now(timezone.utc).replace(microsecond=0)
+        self._index = None
+        self._export = None
+        self._profiles = {}
+
+    def invalidate(self):
+        """Anropas när materialregistret har ändrats; indexen byggs om vid nästa uppslag."""
+        self.version += 1
+        self.modified = datetime.now(timezone.utc).replace(microsecond=0)
+        self._index = None
+        self._export = None
+        self._profiles = {}
+
+    def export(self):
+        """
+        (versionshash, registret som UTF-8-kodad JSON). Hashen beror bara på
+        innehållet, så alla arbetsprocesser med samma register ger samma hash.
+        """
+        if self._export is None:
+            body = json.dumps(self.materialer, ensure_ascii=False, sort_keys=True,
+                              separators=(",", ":")).encode("utf-8")
+            self._export = (hashlib.sha256(body).hexdigest()[:16], body)
+        return self._export
+
+    @property
+    def version_hash(self):
+        return self.export()[0]
+
+    # --- Indexbygge ---
+    def _build(self):
+        by_typ = defaultdict(list)
+        by_diameter = defaultdict(list)
+        by_thickness = defaultdict(list)
+        cladding = []
+        material_options = []
+        # Rörskålar per typ: sorterade diametrar och per diameter sorterade tjocklekar
+        sections = {typ: defaultdict(list) for typ in PIPE_SECTION_TYPES}
+        # (typ, diameter, tjocklek) per nyckel, för filter() och sorteringen
+        attributes = {}
+
+        for key, data in self.materialer.items():
+            typ = data.get("material typ", "")
+            name = data.get("artikelnamn", "")
+            by_typ[typ].append(key)
+            material_options.append((key, f'{data.get("artikelnr")} - {name}'))
+            if "aluminium" in name.lower():
+                cladding.append(key)
+
+            thickness = _as_number(data.get("isoleringstjocklek"))
+            if thickness is not None:
+                by_thickness[thickness].append(key)
+
+            diameter = parse_diameter(data.get("diameter"))
+            attributes[key] = (typ, diameter[0] if diameter else None, thickness)
+            if diameter is not None:
+                by_diameter[diameter[0]].append(key)
+                if typ in sections and thickness is not None:
+                    sections[typ][diameter].append((thickness, key))
+
+        # Sorteringsordning för filtrerade listor: diameter, tjocklek, namn
+        def sort_key(key):
+            typ, diameter, thickness = attributes[key]
+            return (diameter if diameter is not None else float("inf"),
+                    thickness if thickness is not None else float("inf"),
+                    self.materialer[key].get("artikelnamn", ""), key)
+        ordered = sorted(self.materialer, key=sort_key)
+        rank = {key: pos for pos, key in enumerate(ordered)}
+        for lookup in (by_typ, by_diameter, by_thickness):
+            for keys in lookup.values():
+                keys.sort(key=rank.__getitem__)
+
+        pipe_sections = {}
+        for typ, by_range in sections.items():
+            ranges = sorted(by_range)
+            per_range = [sorted(by_range[r]) for r in ranges]
+            # reach[i]: det av intervallen 0..i som når högst (första vid lika)
+            reach = []
+            for i, (_, high) in enumerate(ranges):
+                reach.append(i if not reach or high > ranges[reach[-1]][1] else reach[-1])
+            pipe_sections[typ] = (
+                [low for low, _ in ranges],
+                ranges,
+                [([t for t, _ in items], [k for _, k in items]) for items in per_range],
+                reach,
+            )
+
+        self._index = {
+            "by_typ": dict(by_typ),
+            "by_diameter": dict(by_diameter),
+            "by_thickness": dict(by_thickness),
+            "cladding": cladding,
+            "material_options": material_options,
+            "ytbekladnad_options": [(key, self.materialer[key]["artikelnamn"]) for key in cladding],
+            "material_types": sorted(typ for typ in by_typ if typ not in EXCLUDED_TYPES),
+            "pipe_sections": pipe_sections,
+            "attributes": attributes,
+            "ordered": ordered,
+        }
+        return self._index
+
+    @property
+    def index(self):
+        return self._index if self._index is not None else self._build()
+
+    # --- Uppslag ---
+    @property
+    def material_options(self):
+        """(nyckel, "artikelnr - artikelnamn") för alla material."""
+        return self.index["material_options"]
+
+    @property
+    def ytbekladnad_options(self):
+        """(nyckel, artikelnamn) för material som kan användas som ytbeklädnad (aluminium)."""
+        return self.index["ytbekladnad_options"]
+
+    @property
+    def material_types(self):
+        """Sorterade materialtyper som kan väljas som isolering."""
+        return self.index["material_types"]
+
+    def by_typ(self, typ):
+        return self.index["by_typ"].get(typ, [])
+
+    def cladding(self):
+        return self.index["cladding"]
+
+    def profile(self, key):
+        """MaterialProfile för nyckeln (byggs en gång per version), eller None."""
+        profile = self._profiles.get(key)
+        if profile is None:
+            data = self.materialer.get(key) if key else None
+            if not data:
+                return None
+            profile = self._profiles[key] = MaterialProfile.from_data(key, data)
+        return profile
+
+    def filter(self, typ=None, diameter=None, thickness=None):
+        """
+        Nycklar för material som matchar alla angivna villkor, sorterade på
+        diameter, isoleringstjocklek och namn. Villkoren slås upp i indexen;
+        den minsta träfflistan (redan sorterad) gås igenom och resten av
+        villkoren kontrolleras per material.
+        """
+        index = self.index
+        wanted = (typ,
+                  float(diameter) if diameter is not None else None,
+                  float(thickness) if thickness is not None else None)
+        lookups = zip((index["by_typ"], index["by_diameter"], index["by_thickness"]), wanted)
+        candidates = [lookup.get(value, []) for lookup, value in lookups if value is not None]
+        if len(candidates) == 1:
+            return candidates[0]
+        keys = min(candidates, key=len) if candidates else index["ordered"]
+        attributes = index["attributes"]
+        return [key for key in keys
+                if all(want is None or want == have for want, have in zip(wanted, attributes[key]))]
+
+    def nearest_pipe_section(self, diameter, thickness, typ="Rörskål"):
+        """
+        Närmaste rörskål för given rördiameter (mm) och isoleringstjocklek (mm).
+        Diametrar anges ibland som intervall ("22-28"); ett intervall som
+        innehåller diametern räknas som träff (det som börjar lägst, om flera
+        gör det). Annars väljs det intervall som ligger närmast. Returnerar
+        materialnyckeln eller None.
+        """
+        lows, ranges, thicknesses, reach = self.index["pipe_sections"].get(typ, ([], [], [], []))
+        if not lows:
+            return None
+        diameter = float(diameter)
+        thickness = float(thickness)
+
+        # Intervallen före pos börjar på eller under diametern. Av dem kan bara
+        # de innehålla diametern som ligger före ett intervall som når upp till
+        # den (reach), så sökningen bakåt slutar där inget längre gör det.
+        pos = bisect_right(lows, diameter)
+        best = None
+        i = pos - 1
+        while i >= 0 and ranges[reach[i]][1] >= diameter:
+            if ranges[i][1] >= diameter:
+                best = i
+            i -= 1
+        if best is None:
+            # Inget intervall innehåller diametern: det som når högst under
+            # den eller det som börjar närmast över den
+            below = reach[pos - 1] if pos else None
+            above = pos if pos < len(ranges) else None
+            if above is None or below is not None and diameter - ranges[below][1] <= ranges[above][0] - diameter:
+                best = below
+            else:
+                best = above
+        values, keys = thicknesses[best]
+        return keys[_nearest(values, thickness)]
@@ -0,0 +1,108 @@
+# codec.py
+#
+# Komprimering av lagrade anbudsdata (kalkylrader i bid_rows och versioner i
+# bid_revisions). En kalkylrad är en JSON-text där ett fyrtiotal långa
+# nycklar ("work_time_ytbekladnad", "isolering_grund_tillverkning" m.fl.)
+# återkommer i varje rad. Raderna komprimeras därför en och en med en
+# gemensam ordbok som tränas på sparade rader: då blir även en enskild rad
+# liten, och raderna kan fortfarande läsas (och packas upp) en i taget.
+#
+# Ett komprimerat värde är en BLOB: en byte för metoden (zlib eller zstd),
+# fyra byte ordbokens id och därefter data. Okomprimerade värden är TEXT som
+# förut, så värden som sparades före komprimeringen läses som vanligt.
+# Ordbokens id räknas fram ur innehållet (CRC-32), så samma ordbok har samma
+# id i alla databaser. Ordböckerna sparas i databasen (db.py).
+#
+# zstd används om paketet zstandard är installerat, annars zlib.
+
+import struct
+import threading
+import zlib
+
+try:
+    import zstandard  # valfritt; utan det komprimeras med zlib
+except ImportError:
+    zstandard = None
+
+ZLIB = 1
+ZSTD = 2
+DEFAULT_METHOD = ZSTD if zstandard else ZLIB
+
+DICTIONARY_SIZE = 32 * 1024  # zlib använder högst 32 kB av ordboken
+TRAIN_SAMPLES = 200          # antal värden som en ordbok tränas på
+LEVELS = {ZLIB: 6, ZSTD: 3}
+
+_HEADER = struct.Struct(">BI")  # metod, ordbokens id
+
+
+class Dictionary:
+    """En ordbok och komprimeringen med den. Kan delas mellan trådar."""
+
+    def __init__(self, method, data):
+        if method == ZSTD and zstandard is None:
+            raise ValueError("Anbudsdata är komprimerade med zstd, men paketet zstandard är inte installerat.")
+        if method not in LEVELS:
+            raise ValueError(f"Okänd komprimeringsmetod: {method}")
+        self.method = method
+        self.data = data
+        self.id = zlib.crc32(bytes([method]) + data)
+        self._header = _HEADER.pack(method, self.id)
+        if method == ZLIB:
+            # Rå deflate utan zlib-huvud; kompressorn med inläst ordbok kopieras per värde
+            self._compressor = zlib.compressobj(LEVELS[ZLIB], zlib.DEFLATED, -15, zdict=data)
+        else:
+            self._zstd_dict = zstandard.ZstdCompressionDict(data)
+            self._zstd_dict.precompute_compress(level=LEVELS[ZSTD])
+            self._local = threading.local()  # zstandards (de)kompressorer är inte trådsäkra
+
+    def _zstd(self):
+        local = self._local
+        if not hasattr(local, "compressor"):
+            local.compressor = zstandard.ZstdCompressor(dict_data=self._zstd_dict)
+            local.decompressor = zstandard.ZstdDecompressor(dict_data=self._zstd_dict)
+        return local
+
+    def compress(self, text):
+        """Texten som ett komprimerat värde (med huvud)."""
+        raw = text.encode("utf-8")
+        if self.method == ZLIB:
+            compressor = self._compressor.copy()
+            return self._header + compressor.compress(raw) + compressor.flush()
+        return self._header + self._zstd().compressor.compress(raw)
+
+    def decompress(self, payload):
+        if self.method == ZLIB:
+            return zlib.decompressobj(-15, zdict=self.data).decompress(payload).decode("utf-8")
+        return self._zstd().decompressor.decompress(payload).decode("utf-8")
+
+
+def train(samples, method=DEFAULT_METHOD):
+    """En ordbok tränad på samples (JSON-texter)."""
+    encoded = [text.encode("utf-8") for text in samples]
+    if method == ZSTD:
+        try:
+            return Dictionary(ZSTD, zstandard.train_dictionary(DICTIONARY_SIZE, encoded).as_bytes())
+        except zstandard.ZstdError:
+            pass  # för få prover att träna på; proverna används då som de är
+    # zlib letar efter upprepningar i ordbokens text, så proverna blir ordboken
+    return Dictionary(method, b"".join(encoded)[-DICTIONARY_SIZE:])
+
+
+def pack(dictionary, text):
+    """Värdet att lagra: komprimerat om det blir mindre, annars texten som den är."""
+    value = dictionary.compress(text)
+    return value if len(value) < len(text) else text
+
+
+def unpack(value, dictionary):
+    """
+    Texten i ett lagrat värde. dictionary är en funktion som ger ordboken
+    för ett id. Text (okomprimerade värden) returneras som den är.
+    """
+    if isinstance(value, str):
+        return value
+    method, dictionary_id = _HEADER.unpack_from(value)
+    found = dictionary(dictionary_id)
+    if found.method != method:
+        raise ValueError("Komprimerat värde och ordbok hör inte ihop.")
+    return found.decompress(memoryview(value)[_HEADER.size:])
@@ -0,0 +1,320 @@
+# customers.py
+#
+# Kundregistret. Tidigare lästes uploads/customers.xlsx med pandas vid varje
+# visning av /new_bid och /customers. Nu läses filen in en gång till tabellen
+# customers i anbud.db (nyckel Kundnr) och listan hålls i minnet. Filen läses
+# om bara när dess storlek/ändringstid och innehåll (SHA-256) har ändrats,
+# eller när refresh() anropas.
+#
+# Uppladdade kundlistor läses rad för rad (openpyxl read-only) och läggs in
+# eller uppdateras per Kundnr, så att minnesåtgången inte växer med filen.
+#
+# Sökningen (/api/customers/search) går mot ett prefixindex och ett
+# trigramindex över kundnamn och Kundnr som byggs när listan läses in.
+#
+# openpyxl (som i sin tur laddar numpy) importeras först när en xlsx-fil
+# faktiskt läses, så att appens uppstart inte betalar för det.
+
+import hashlib
+import heapq
+import json
+import math
+import os
+import re
+import threading
+from bisect import bisect_left, bisect_right
+from collections import Counter
+
+# Antal rader som jämförs mot tabellen per fråga vid import
+IMPORT_BATCH = 1000
+
+
+def _file_signature(path):
+    """(mtime_ns, storlek) för filen, eller None om den saknas."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _text(value):
+    # Samma textform som pandas.read_excel(dtype=str).fillna("") gav
+    return "" if value is None else str(value)
+
+
+def iter_workbook_records(source):
+    """
+    Läser första bladet i en xlsx-fil (sökväg eller filobjekt) rad för rad och
+    ger en dict per rad med rubrikraden som nycklar och alla värden som text.
+    Tomma rader hoppas över.
+    """
+    import openpyxl
+    wb = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [(i, _text(name)) for i, name in enumerate(header) if name is not None]
+        for values in rows:
+            if all(value is None or value == "" for value in values):
+                continue
+            yield {name: _text(values[i]) if i < len(values) else "" for i, name in columns}
+    finally:
+        wb.close()
+
+
+def _batches(records, size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def _normalize(text):
+    return _WHITESPACE_RE.sub(" ", str(text)).strip().casefold()
+
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class CustomerIndex:
+    """
+    Sökindex över kundnamn och Kundnr. Träffarna rangordnas i nivåer och
+    sökningen avbryts så snart limit träffar har hittats:
+      1. exakt namn eller Kundnr
+      2. namnet eller Kundnr börjar med frågan (sorterade nycklar + bisect)
+      3. något ord i namnet börjar med frågan ("bygg" -> "Norrlands Bygg AB")
+      4. felstavningar och delord via trigram (minst hälften av frågans trigram)
+    """
+
+    FUZZY_MIN = 0.5
+
+    def __init__(self, customers):
+        self.customers = customers
+        self._names = [_normalize(customer.get("Kund", "")) for customer in customers]
+        self._kundnrs = [_normalize(customer.get("Kundnr", "")) for customer in customers]
+        self._grams = {}
+        words = []
+        for idx, (name, kundnr) in enumerate(zip(self._names, self._kundnrs)):
+            for word in set(name.split()[1:]):
+                words.append((word, name, idx))
+            for gram in _trigrams(name) | _trigrams(kundnr):
+                self._grams.setdefault(gram, []).append(idx)
+        words.sort()
+        by_name = sorted(range(len(customers)), key=lambda idx: self._names[idx])
+        by_kundnr = sorted(range(len(customers)), key=lambda idx: self._kundnrs[idx])
+        self._sorted = (
+            ([self._names[idx] for idx in by_name], by_name),
+            ([self._kundnrs[idx] for idx in by_kundnr], by_kundnr),
+        )
+        self._words = ([word for word, _, _ in words], [idx for _, _, idx in words])
+
+    @staticmethod
+    def _matches(keys, ids, query, exact=False):
+        lo = bisect_left(keys, query)
+        hi = bisect_right(keys, query) if exact else bisect_left(keys, query + "\U0010ffff")
+        return (ids[pos] for pos in range(lo, hi))
+
+    def _fuzzy(self, query, exclude, limit):
+        """Högst limit kunder som delar minst FUZZY_MIN av frågans trigram, mest lika först."""
+        query_grams = _trigrams(query)
+        need = math.ceil(len(query_grams) * self.FUZZY_MIN)
+        shared = Counter()
+        for gram in query_grams:
+            shared.update(self._grams.get(gram, ()))
+        best = heapq.nsmallest(limit, ((-count, self._names[idx], idx) for idx, count in shared.items()
+                                       if count >= need and idx not in exclude))
+        return (idx for _, _, idx in best)
+
+    def search(self, query, limit=20):
+        """De limit bästa träffarna för query (tom fråga ger de första kunderna)."""
+        query = _normalize(query)
+        if not query:
+            return self.customers[:limit]
+
+        found, seen = [], set()
+
+        def take(ids):
+            for idx in ids:
+                if idx not in seen:
+                    seen.add(idx)
+                    found.append(idx)
+                    if len(found) >= limit:
+                        return True
+            return False
+
+        done = (take(idx for keys, ids in self._sorted for idx in self._matches(keys, ids, query, exact=True))
+                or take(idx for keys, ids in self._sorted for idx in self._matches(keys, ids, query))
+                or take(self._matches(*self._words, query))
+                or (len(query) >= 3 and take(self._fuzzy(query, seen, limit - len(found)))))
+        return [self.customers[idx] for idx in found]
+
+
+class CustomerRegistry:
+    """
+    Kunder indexerade på Kundnr. all() och get() svarar ur minnet; varje anrop
+    kontrollerar bara filens signatur och registrets versionsnummer, så att
+    en import i en annan arbetsprocess också syns här.
+    """
+
+    def __init__(self, pool, path):
+        self.pool = pool
+        self.path = path
+        self._lock = threading.Lock()
+        self._version = None
+        self._customers = []
+        self._by_kundnr = {}
+        self._index = CustomerIndex([])
+
+    def all(self):
+        """Alla kunder i filens ordning, som dictar med kolumnnamnen från Excel."""
+        self._ensure_current()
+        return self._customers
+
+    def get(self, kundnr):
+        self._ensure_current()
+        return self._by_kundnr.get(kundnr)
+
+    def search(self, query, limit=20):
+        """Kunder vars namn eller Kundnr matchar query, bästa träff först."""
+        self._ensure_current()
+        return self._index.search(query, limit)
+
+    def refresh(self):
+        """Läser om kundfilen direkt."""
+        self._ensure_current(force=True)
+
+    def import_file(self, source):
+        """
+        Lägger in eller uppdaterar kunderna i en uppladdad xlsx-fil (sökväg
+        eller filobjekt), rad för rad. Returnerar antal per utfall:
+        {"inserted", "updated", "unchanged", "skipped"} där skipped är rader
+        utan Kundnr.
+        """
+        conn = self.pool.acquire()
+        try:
+            with self._lock, conn:
+                conn.execute("BEGIN IMMEDIATE")
+                counts = self._upsert(conn, iter_workbook_records(source))
+                if counts["inserted"] or counts["updated"]:
+                    self._bump_version(conn)
+        finally:
+            self.pool.release(conn)
+        return counts
+
+    def _ensure_current(self, force=False):
+        conn = self.pool.acquire()
+        try:
+            with self._lock:
+                source = conn.execute("SELECT * FROM customer_source WHERE id = 1").fetchone()
+                signature = _file_signature(self.path)
+                known = (source["mtime_ns"], source["size"]) if source else None
+                if signature is not None and (force or signature != known):
+                    source = self._sync_file(conn, source, signature)
+                version = source["version"] if source else 0
+                if version != self._version:
+                    self._load(conn, version)
+        finally:
+            self.pool.release(conn)
+
+    def _sync_file(self, conn, source, signature):
+        """Importerar filen om innehållet har ändrats; annars uppdateras bara signaturen."""
+        digest = _file_hash(self.path)
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            changed = source is None or source["sha256"] != digest
+            if changed and any(self._upsert(conn, iter_workbook_records(self.path))[k] for k in ("inserted", "updated")):
+                self._bump_version(conn)
+            conn.execute('''
+                INSERT INTO customer_source (id, mtime_ns, size, sha256) VALUES (1, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET mtime_ns = excluded.mtime_ns, size = excluded.size,
+                                               sha256 = excluded.sha256
+            ''', (*signature, digest))
+        return conn.execute("SELECT * FROM customer_source WHERE id = 1").fetchone()
+
+    def _bump_version(self, conn):
+        conn.execute('''
+            INSERT INTO customer_source (id, version) VALUES (1, 1)
+            ON CONFLICT (id) DO UPDATE SET version = version + 1
+        ''')
+
+    def _upsert(self, conn, records):
+        """
+        Lägger in nya kunder och uppdaterar ändrade, per Kundnr. Raderna
+        jämförs mot tabellen i omgångar om IMPORT_BATCH, så att hela filen
+        aldrig behöver ligga i minnet. Dubbletter i filen: sista raden gäller.
+
+        Utfallen räknas en gång per Kundnr, mot tabellen som den var före
+        importen: kundens ursprungliga data sparas i en temporär tabell första
+        gången Kundnr förekommer och jämförs med slutresultatet efteråt.
+        """
+        skipped = 0
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS customer_import (kundnr TEXT PRIMARY KEY, original TEXT)")
+        conn.execute("DELETE FROM customer_import")
+        position = conn.execute("SELECT COALESCE(MAX(position), -1) FROM customers").fetchone()[0]
+        for batch in _batches(records, IMPORT_BATCH):
+            keys = list({record.get("Kundnr", "") for record in batch})
+            placeholders = ', '.join('?' for _ in keys)
+            stored = conn.execute(f"SELECT kundnr, data FROM customers WHERE kundnr IN ({placeholders})",
+                                  keys).fetchall()
+            # Kundnr som inte setts tidigare i filen: spara hur de såg ut före importen
+            conn.execute(f"INSERT OR IGNORE INTO customer_import (kundnr, original) "
+                         f"SELECT value, data FROM json_each(?) LEFT JOIN customers ON kundnr = value",
+                         (json.dumps([key for key in keys if key]),))
+            existing = {kundnr: json.loads(data) for kundnr, data in stored}
+            for record in batch:
+                kundnr = record.get("Kundnr", "")
+                if not kundnr:
+                    skipped += 1
+                    continue
+                old = existing.get(kundnr)
+                if old == record:
+                    continue
+                data = json.dumps(record, ensure_ascii=False)
+                if old is None:
+                    position += 1
+                    conn.execute("INSERT INTO customers (kundnr, kund, position, data) VALUES (?, ?, ?, ?)",
+                                 (kundnr, record.get("Kund", ""), position, data))
+                else:
+                    conn.execute("UPDATE customers SET kund = ?, data = ? WHERE kundnr = ?",
+                                 (record.get("Kund", ""), data, kundnr))
+                existing[kundnr] = record
+
+        counts = {"inserted": 0, "updated": 0, "unchanged": 0, "skipped": skipped}
+        for original, data in conn.execute(
+                "SELECT original, data FROM customer_import JOIN customers USING (kundnr)"):
+            if original is None:
+                counts["inserted"] += 1
+            elif original == data or json.loads(original) == json.loads(data):
+                counts["unchanged"] += 1
+            else:
+                counts["updated"] += 1
+        conn.execute("DELETE FROM customer_import")
+        return counts
+
+    def _load(self, conn, version):
+        customers = [json.loads(data) for (data,) in
+                     conn.execute("SELECT data FROM customers ORDER BY position")]
+        self._by_kundnr = {customer.get("Kundnr", ""): customer for customer in customers}
+        self._index = CustomerIndex(customers)
+        self._customers = customers
+        self._version = version
@@ -0,0 +1,863 @@
+# db.py
+#
+# Databashantering för sparade anbud (anbud.db).
+#
+# Schemaversion (PRAGMA user_version):
+#   0 - ursprungligt schema: tabellen anbud (id, datum, data) där data är
+#       hela anbudet som en JSON-text.
+#   1 - normaliserat schema: bids (en rad per anbud med indexerade kolumner
+#       för anbudsinfo) och bid_rows (en rad per kalkylrad).
+#   2 - kundregistret: customers (nyckel Kundnr) och customer_source.
+#   3 - versionshistorik: bid_revisions, en rad per sparning av ett anbud
+#       (hela anbudet som nyckelbild, eller skillnaden mot föregående version).
+#   4 - komprimering: codec_dictionaries med ordböckerna för codec.py. Nya
+#       kalkylrader och versioner sparas komprimerade; äldre värden är kvar
+#       som text tills anbudet sparas om (eller python db.py compress körs).
+#   5 - fulltextsökning: bids_fts (FTS5), ett dokument per anbud med
+#       anbudsinfo, radernas objekt/sektion och materialnamn. Uppdateras i
+#       samma transaktion som anbudet sparas eller raderas.
+#
+# Migreringen körs automatiskt vid start och kan backas för befintliga filer:
+#   python db.py upgrade anbud.db
+#   python db.py downgrade anbud.db [version]
+#   python db.py compress anbud.db
+
+import difflib
+import functools
+import json
+import os
+import queue
+import re
+import sqlite3
+import sys
+import threading
+
+import codec
+
+DB_PATH = 'anbud.db'
+SCHEMA_VERSION = 5
+
+# Var KEYFRAME_INTERVAL:e version sparas hela anbudet (nyckelbild), däremellan
+# bara skillnaden mot föregående version. En version byggs då upp av en
+# nyckelbild och högst KEYFRAME_INTERVAL - 1 skillnader.
+KEYFRAME_INTERVAL = 20
+
+# Anbudsinfo som får egna, indexerade kolumner: (kolumn, nyckel i bid_info)
+HEADER_FIELDS = (
+    ("anbudsnummer", "Anbudsnummer"),
+    ("anbudsnamn", "Anbudsnamn"),
+    ("kund", "Kund"),
+    ("avdelning", "Avdelning"),
+    ("projektledare", "Projektledare"),
+    ("kalkylansvarig", "Kalkylansvarig"),
+    ("projekt_typ", "projekt_typ"),
+)
+
+
+# Sökbara fält i bids_fts och deras vikt i rankningen (bm25): (kolumn, vikt).
+# Anbudsinfons kolumner har samma namn som i HEADER_FIELDS; etiketter är
+# radernas objekt och sektion, material radernas materialnamn och artikelnr.
+SEARCH_COLUMNS = (
+    ("anbudsnamn", 10.0),
+    ("anbudsnummer", 10.0),
+    ("kund", 5.0),
+    ("projektledare", 2.0),
+    ("kalkylansvarig", 2.0),
+    ("etiketter", 1.0),
+    ("material", 1.0),
+)
+
+
+def get_db_connection(path=None):
+    conn = sqlite3.connect(path or DB_PATH)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+# --- Anslutningspool ---
+class ConnectionPool:
+    """
+    Pool med SQLite-anslutningar för en arbetsprocess. Anslutningarna öppnas
+    med WAL-journal (läsare och skrivare blockerar inte varandra), en angiven
+    sidcache, minnesmappning och en cache för förberedda satser, och
+    återanvänds mellan förfrågningar i stället för att öppnas på nytt.
+
+    Poolen är bunden till processen som skapade den; efter fork (t.ex. i
+    gunicorn) öppnar varje arbetsprocess egna anslutningar.
+    """
+
+    def __init__(self, path=DB_PATH, size=5, cache_size_kb=16384, mmap_size=64 * 1024 * 1024,
+                 cached_statements=256, busy_timeout=30):
+        self.path = path
+        self.size = size
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.cached_statements = cached_statements
+        self.busy_timeout = busy_timeout
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA cache_size = -{int(self.cache_size_kb)}")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        return conn
+
+    def acquire(self):
+        """Hämtar en ledig anslutning; väntar om alla används."""
+        if self._pid != os.getpid():
+            # Ärvd från föräldraprocessen: anslutningarna får inte delas över fork
+            self._reset()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._opened -= 1
+                    raise
+        return self._idle.get(timeout=self.busy_timeout)
+
+    def release(self, conn):
+        """Lämnar tillbaka en anslutning; en påbörjad transaktion rullas tillbaka."""
+        if self._pid != os.getpid():
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # Trasig anslutning: stäng den och låt poolen öppna en ny vid behov
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+            return
+        self._idle.put(conn)
+
+    def close(self):
+        """Stänger alla lediga anslutningar."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+
+def _create_v1(conn):
+    columns = ",\n            ".join(f"{column} TEXT" for column, _ in HEADER_FIELDS)
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS bids (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            datum TEXT,
+            {columns},
+            bid_info TEXT,
+            legacy_data TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS bid_rows (
+            bid_id INTEGER NOT NULL REFERENCES bids (id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (bid_id, position)
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_bids_datum ON bids (datum, id)")
+    # Ett index per filterkolumn; datum sist så att listan kan sorteras direkt ur indexet
+    for column, _ in HEADER_FIELDS:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_bids_{column} ON bids ({column}, datum, id)")
+
+
+def _header_values(bid_info):
+    return [bid_info.get(key) for _, key in HEADER_FIELDS]
+
+
+def _insert_rows(conn, bid_id, rows):
+    _insert_row_values(conn, bid_id, [json.dumps(row) for row in rows])
+
+
+def _insert_row_values(conn, bid_id, values):
+    """Radernas lagrade värden: JSON-texter eller komprimerade (codec.py)."""
+    conn.executemany("INSERT INTO bid_rows (bid_id, position, data) VALUES (?, ?, ?)",
+                     [(bid_id, position, value) for position, value in enumerate(values)])
+
+
+def _sequence(conn, table):
+    found = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+    return found[0] if found else None
+
+
+def _set_sequence(conn, table, seq):
+    if seq is None:
+        return
+    if _sequence(conn, table) is None:
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, seq))
+    else:
+        conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = ?", (seq, table))
+
+
+def _table_exists(conn, table):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+
+
+def _upgrade_1(conn):
+    """Migrerar från anbud (JSON-blobbar) till bids/bid_rows."""
+    _create_v1(conn)
+    if _table_exists(conn, "anbud"):
+        header_columns = ", ".join(column for column, _ in HEADER_FIELDS)
+        placeholders = ", ".join("?" for _ in HEADER_FIELDS)
+        for bid in conn.execute("SELECT id, datum, data FROM anbud").fetchall():
+            try:
+                bid_data = json.loads(bid["data"])
+                bid_info = bid_data.get("bid_info") or {}
+                rows = bid_data.get("kalkyl") or []
+                legacy = None
+            except (TypeError, ValueError, AttributeError):
+                # Oläsbar post: spara originaltexten så att den kan återställas
+                bid_info, rows, legacy = {}, [], bid["data"]
+            conn.execute(
+                f"INSERT INTO bids (id, datum, {header_columns}, bid_info, legacy_data) "
+                f"VALUES (?, ?, {placeholders}, ?, ?)",
+                [bid["id"], bid["datum"], *_header_values(bid_info), json.dumps(bid_info), legacy])
+            _insert_rows(conn, bid["id"], rows)
+        # Behåll räknaren så att id:n för raderade anbud inte återanvänds
+        _set_sequence(conn, "bids", _sequence(conn, "anbud"))
+        conn.execute("DROP TABLE anbud")
+
+
+def _downgrade_1(conn):
+    """Återställer tabellen anbud (id, datum, data) från bids/bid_rows."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS anbud (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            datum TEXT,
+            data TEXT
+        )
+    ''')
+    if _table_exists(conn, "bids"):
+        for bid_id, datum, bid_data in iter_bids_as_json(conn):
+            conn.execute("INSERT INTO anbud (id, datum, data) VALUES (?, ?, ?)", (bid_id, datum, bid_data))
+        _set_sequence(conn, "anbud", _sequence(conn, "bids"))
+        conn.execute("DROP TABLE bid_rows")
+        conn.execute("DROP TABLE bids")
+
+
+def _upgrade_2(conn):
+    """Kundregistret: en rad per kund (alla kolumner som JSON) och källfilens signatur."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS customers (
+            kundnr TEXT PRIMARY KEY,
+            kund TEXT,
+            position INTEGER,
+            data TEXT NOT NULL
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_customers_position ON customers (position)")
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS customer_source (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            mtime_ns INTEGER,
+            size INTEGER,
+            sha256 TEXT,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+
+def _downgrade_2(conn):
+    # Kunderna finns kvar i customers.xlsx och läses in igen vid nästa uppgradering
+    conn.execute("DROP TABLE IF EXISTS customer_source")
+    conn.execute("DROP TABLE IF EXISTS customers")
+
+
+def _upgrade_3(conn):
+    """Versionshistorik för sparade anbud. Befintliga anbud får sin första version när de sparas om."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS bid_revisions (
+            bid_id INTEGER NOT NULL,
+            revision INTEGER NOT NULL,
+            datum TEXT,
+            keyframe INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (bid_id, revision)
+        )
+    ''')
+
+
+def _downgrade_3(conn):
+    # Anbudens senaste version finns kvar i bids/bid_rows; historiken tas bort
+    conn.execute("DROP TABLE IF EXISTS bid_revisions")
+
+
+# Tabeller med komprimerade värden i kolumnen data
+_COMPRESSED_TABLES = ("bid_rows", "bid_revisions")
+
+
+def _upgrade_4(conn):
+    """Ordböcker för komprimeringen. Den första tränas på befintliga kalkylrader, om det finns några."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS codec_dictionaries (
+            id INTEGER PRIMARY KEY,
+            method INTEGER NOT NULL,
+            samples INTEGER NOT NULL,
+            data BLOB NOT NULL
+        )
+    ''')
+    samples = [data for (data,) in conn.execute(
+        "SELECT data FROM bid_rows WHERE typeof(data) = 'text' ORDER BY random() LIMIT ?", (codec.TRAIN_SAMPLES,))]
+    if samples:
+        _add_dictionary(conn, codec.train(samples), len(samples))
+
+
+def _downgrade_4(conn):
+    # Packa upp allt till text igen innan ordböckerna tas bort
+    for table in _COMPRESSED_TABLES:
+        values = conn.execute(f"SELECT rowid, data FROM {table} WHERE typeof(data) = 'blob'").fetchall()
+        conn.executemany(f"UPDATE {table} SET data = ? WHERE rowid = ?",
+                         [(_decode(conn, data), rowid) for rowid, data in values])
+    conn.execute("DROP TABLE IF EXISTS codec_dictionaries")
+
+
+def _upgrade_5(conn):
+    """Fulltextindex över anbuden, byggt från de befintliga anbuden."""
+    columns = ", ".join(column for column, _ in SEARCH_COLUMNS)
+    # prefix: index för korta prefix, så att sökningen kan ske medan man skriver
+    conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS bids_fts USING fts5({columns}, "
+                 f"tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')")
+    # Kolumnernas vikter gäller för ORDER BY rank
+    weights = ", ".join(str(weight) for _, weight in SEARCH_COLUMNS)
+    conn.execute("INSERT INTO bids_fts (bids_fts, rank) VALUES ('rank', ?)", (f"bm25({weights})",))
+    rebuild_search_index(conn)
+
+
+def _downgrade_5(conn):
+    conn.execute("DROP TABLE IF EXISTS bids_fts")
+
+
+# Migreringar per schemaversion: (upp, ner)
+MIGRATIONS = {
+    1: (_upgrade_1, _downgrade_1),
+    2: (_upgrade_2, _downgrade_2),
+    3: (_upgrade_3, _downgrade_3),
+    4: (_upgrade_4, _downgrade_4),
+    5: (_upgrade_5, _downgrade_5),
+}
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def upgrade(conn, target=SCHEMA_VERSION):
+    """Migrerar databasen steg för steg upp till target."""
+    if schema_version(conn) == 0 and not _table_exists(conn, "anbud"):
+        # Tom databas: skapa den gamla tabellen så att migreringarna har en utgångspunkt
+        conn.execute("CREATE TABLE anbud (id INTEGER PRIMARY KEY AUTOINCREMENT, datum TEXT, data TEXT)")
+    for version in range(schema_version(conn) + 1, target + 1):
+        with conn:
+            # Hela steget i en transaktion (även CREATE/DROP), så att ett avbrutet steg inte lämnar halva schemat
+            conn.execute("BEGIN")
+            MIGRATIONS[version][0](conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+
+
+def downgrade(conn, target=0):
+    """Backar databasen steg för steg ner till target."""
+    for version in range(schema_version(conn), target, -1):
+        with conn:
+            conn.execute("BEGIN")
+            MIGRATIONS[version][1](conn)
+            conn.execute(f"PRAGMA user_version = {version - 1}")
+
+
+def iter_bids_as_json(conn):
+    """(id, datum, data) i det ursprungliga JSON-formatet för alla anbud."""
+    for bid in conn.execute("SELECT id, datum, bid_info, legacy_data FROM bids ORDER BY id").fetchall():
+        if bid["legacy_data"] is not None:
+            yield bid["id"], bid["datum"], bid["legacy_data"]
+            continue
+        bid_data = {"bid_info": json.loads(bid["bid_info"] or "{}"), "kalkyl": load_rows(conn, bid["id"])}
+        yield bid["id"], bid["datum"], json.dumps(bid_data)
+
+
+def init_db(path=None):
+    conn = get_db_connection(path)
+    if schema_version(conn) < SCHEMA_VERSION:
+        upgrade(conn)
+    analyze(conn)
+    conn.close()
+
+
+def analyze(conn):
+    """
+    Uppdaterar frågeplanerarens statistik så att anbudslistan filtreras via
+    det mest selektiva indexet (t.ex. kund före projekttyp). Stickprovet är
+    begränsat så att det går snabbt även på stora databaser.
+    """
+    conn.execute("PRAGMA analysis_limit = 1000")
+    conn.execute("ANALYZE")
+    conn.commit()
+
+
+# --- Komprimering (codec.py) ---
+# Ordböckerna ändras aldrig och har samma id i alla databaser, så de kan
+# delas mellan anslutningar när de väl har lästs in.
+_dictionaries = {}
+
+
+def _dictionary(conn, dictionary_id):
+    found = _dictionaries.get(dictionary_id)
+    if found is None:
+        row = conn.execute("SELECT method, data FROM codec_dictionaries WHERE id = ?", (dictionary_id,)).fetchone()
+        if row is None:
+            raise ValueError("Ordboken för komprimerade anbudsdata saknas.")
+        found = _dictionaries[dictionary_id] = codec.Dictionary(row[0], bytes(row[1]))
+    return found
+
+
+def _decoder(conn):
+    """Funktion som ger texten i ett lagrat värde (komprimerat eller text)."""
+    return functools.partial(codec.unpack, dictionary=functools.partial(_dictionary, conn))
+
+
+def _decode(conn, value):
+    return _decoder(conn)(value)
+
+
+def _add_dictionary(conn, dictionary, samples):
+    conn.execute("INSERT OR IGNORE INTO codec_dictionaries (id, method, samples, data) VALUES (?, ?, ?, ?)",
+                 (dictionary.id, dictionary.method, samples, dictionary.data))
+    _dictionaries[dictionary.id] = dictionary
+
+
+def _encoder(conn, texts):
+    """
+    Ordboken som nya värden komprimeras med: den som tränats på flest värden.
+    Finns ingen, eller bygger den på färre värden än texts har (eller på en
+    metod som inte längre används), tränas en ny på texts.
+    """
+    found = conn.execute("SELECT id, method, samples FROM codec_dictionaries ORDER BY samples DESC LIMIT 1").fetchone()
+    samples = min(len(texts), codec.TRAIN_SAMPLES)
+    if found and (found["method"] == codec.DEFAULT_METHOD and found["samples"] >= samples or not samples):
+        return _dictionary(conn, found["id"])
+    if not samples:
+        return None
+    # Värden jämnt fördelade över anbudet
+    dictionary = codec.train(texts[::len(texts) // samples][:samples])
+    _add_dictionary(conn, dictionary, samples)
+    return dictionary
+
+
+def _encode(dictionary, text):
+    return codec.pack(dictionary, text) if dictionary else text
+
+
+def compress_all(conn, batch_size=1000):
+    """Komprimerar värden som fortfarande är sparade som text. Returnerar antalet komprimerade."""
+    compressed = 0
+    for table in _COMPRESSED_TABLES:
+        last = 0
+        while True:
+            with conn:
+                values = conn.execute(f"SELECT rowid, data FROM {table} WHERE rowid > ? AND typeof(data) = 'text' "
+                                      f"ORDER BY rowid LIMIT ?", (last, batch_size)).fetchall()
+                if not values:
+                    break
+                dictionary = _encoder(conn, [data for _, data in values])
+                packed = [(codec.pack(dictionary, data), rowid) for rowid, data in values]
+                conn.executemany(f"UPDATE {table} SET data = ? WHERE rowid = ?", packed)
+            compressed += sum(isinstance(data, bytes) for data, _ in packed)
+            last = values[-1][0]
+    return compressed
+
+
+# --- Läsning och skrivning av anbud ---
+def load_rows(conn, bid_id, offset=0, limit=None):
+    """Anbudets kalkylrader i ordning (alla, eller limit stycken från offset)."""
+    cur = conn.execute("SELECT data FROM bid_rows WHERE bid_id = ? ORDER BY position LIMIT ? OFFSET ?",
+                       (bid_id, -1 if limit is None else limit, offset))
+    decode = _decoder(conn)
+    return [json.loads(decode(data)) for (data,) in cur]
+
+
+def iter_rows(conn, bid_id):
+    """Anbudets kalkylrader i ordning, en i taget (för export av stora anbud)."""
+    decode = _decoder(conn)
+    for (data,) in conn.execute("SELECT data FROM bid_rows WHERE bid_id = ? ORDER BY position", (bid_id,)):
+        yield json.loads(decode(data))
+
+
+def count_rows(conn, bid_id):
+    return conn.execute("SELECT COUNT(*) FROM bid_rows WHERE bid_id = ?", (bid_id,)).fetchone()[0]
+
+
+def load_bid(conn, bid_id, offset=0, limit=None):
+    """
+    Returnerar (bid, bid_data) där bid har id och datum och bid_data är
+    {"bid_info": ..., "kalkyl": [...]}, eller (None, None) om anbudet saknas.
+    offset/limit begränsar kalkylraderna till en sida.
+    Oläsbara poster från före migreringen ger ValueError.
+    """
+    bid = conn.execute("SELECT id, datum, bid_info, legacy_data FROM bids WHERE id = ?", (bid_id,)).fetchone()
+    if bid is None:
+        return None, None
+    if bid["legacy_data"] is not None:
+        raise ValueError("Anbudsdata kunde inte läsas.")
+    bid_data = {"bid_info": json.loads(bid["bid_info"] or "{}"), "kalkyl": load_rows(conn, bid_id, offset, limit)}
+    return bid, bid_data
+
+
+def save_bid_record(conn, bid_info, rows, datum, bid_id=None):
+    """
+    Sparar ett anbud (nytt eller befintligt) och returnerar dess id. Varje
+    sparning blir också en ny version i anbudets historik (bid_revisions).
+    """
+    header_columns = [column for column, _ in HEADER_FIELDS]
+    info_text = json.dumps(bid_info)
+    values = [datum, *_header_values(bid_info), info_text]
+    texts = [json.dumps(row) for row in rows]
+    with conn:
+        # Skrivlåset tas innan den sparade versionen läses, så att en annan
+        # sparning inte hinner emellan och gör versionens skillnad felaktig
+        conn.execute("BEGIN IMMEDIATE")
+        updated = 0
+        previous = None
+        if bid_id:
+            previous = _current_version(conn, bid_id)
+            assignments = ", ".join(f"{column} = ?" for column in header_columns)
+            updated = conn.execute(
+                f"UPDATE bids SET datum = ?, {assignments}, bid_info = ?, legacy_data = NULL WHERE id = ?",
+                [*values, bid_id]).rowcount
+            conn.execute("DELETE FROM bid_rows WHERE bid_id = ?", (bid_id,))
+        if not updated:
+            # Nytt anbud (eller ett som raderats medan det redigerades)
+            placeholders = ", ".join("?" for _ in header_columns)
+            cur = conn.execute(
+                f"INSERT INTO bids (id, datum, {', '.join(header_columns)}, bid_info) "
+                f"VALUES (?, ?, {placeholders}, ?)",
+                [bid_id or None, *values])
+            bid_id = cur.lastrowid
+            previous = None
+        dictionary = _encoder(conn, texts)
+        if previous is not None:
+            # Oförändrade rader behåller sina redan komprimerade värden
+            stored = {text: value for text, value in zip(previous[2], previous[3]) if isinstance(value, bytes)}
+            values = [stored.get(text) or _encode(dictionary, text) for text in texts]
+        else:
+            values = [_encode(dictionary, text) for text in texts]
+        _insert_row_values(conn, bid_id, values)
+        _add_revision(conn, bid_id, previous, info_text, texts, datum, dictionary)
+        _index_bid(conn, bid_id, dict(zip(header_columns, _header_values(bid_info))), rows)
+    return bid_id
+
+
+# Kolumner som anbudslistan kan filtreras på (exakt matchning)
+FILTER_COLUMNS = ("kund", "avdelning", "projektledare", "projekt_typ")
+
+_LIST_COLUMNS = '''
+    id, datum,
+    COALESCE(anbudsnummer, id) AS anbudsnummer,
+    COALESCE(anbudsnamn, 'Okänt') AS anbudsnamn,
+    COALESCE(avdelning, '') AS avdelning,
+    COALESCE(projektledare, '') AS projektledare,
+    COALESCE(kalkylansvarig, '') AS kalkylansvarig,
+    COALESCE(kund, '') AS kund,
+    COALESCE(projekt_typ, '') AS projekt_typ
+'''
+
+
+def encode_cursor(bid):
+    """Sidmarkör för ett anbud i listan: "datum~id"."""
+    return f'{bid["datum"] or ""}~{bid["id"]}'
+
+
+def decode_cursor(cursor):
+    """Tolkar en sidmarkör; ogiltiga markörer ger None."""
+    if not cursor:
+        return None
+    datum, _, bid_id = cursor.rpartition("~")
+    try:
+        return datum, int(bid_id)
+    except ValueError:
+        return None
+
+
+def list_bids(conn, filters=None, date_from=None, date_to=None, after=None, before=None, limit=50):
+    """
+    En sida ur anbudslistan, senaste först (datum, id).
+
+    Sökningen använder nyckelbaserad bläddring: after/before är (datum, id)
+    för sista respektive första anbudet på den sida man kommer från, så att
+    frågan söker direkt i indexet i stället för att hoppa över rader med
+    OFFSET. Filter är exakt matchning på FILTER_COLUMNS och ett datumintervall
+    (date_to inklusive hela dagen).
+
+    Returnerar (anbud, has_newer, has_older).
+    """
+    where, params = [], []
+    for column, value in (filters or {}).items():
+        if column in FILTER_COLUMNS and value:
+            where.append(f"{column} = ?")
+            params.append(value)
+    if date_from:
+        where.append("datum >= ?")
+        params.append(date_from)
+    if date_to:
+        where.append("datum < ?")
+        params.append(date_to + "~")  # "~" sorterar efter alla tider samma dag
+
+    seek = list(where)
+    if before:
+        seek.append("(datum, id) > (?, ?)")
+        order = "datum ASC, id ASC"
+        seek_params = params + list(before)
+    else:
+        if after:
+            seek.append("(datum, id) < (?, ?)")
+        order = "datum DESC, id DESC"
+        seek_params = params + (list(after) if after else [])
+
+    sql = f"SELECT {_LIST_COLUMNS} FROM bids"
+    if seek:
+        sql += " WHERE " + " AND ".join(seek)
+    # En extra rad avgör om det finns fler anbud i bläddringsriktningen
+    bids = conn.execute(f"{sql} ORDER BY {order} LIMIT ?", seek_params + [limit + 1]).fetchall()
+    more = len(bids) > limit
+    bids = bids[:limit]
+    if before:
+        bids.reverse()
+        return bids, more, True
+    return bids, after is not None, more
+
+
+def delete_bid_record(conn, bid_id):
+    with conn:
+        conn.execute("DELETE FROM bids_fts WHERE rowid = ?", (bid_id,))
+        conn.execute("DELETE FROM bid_revisions WHERE bid_id = ?", (bid_id,))
+        conn.execute("DELETE FROM bid_rows WHERE bid_id = ?", (bid_id,))
+        conn.execute("DELETE FROM bids WHERE id = ?", (bid_id,))
+
+
+# --- Fulltextsökning ---
+def _index_bid(conn, bid_id, header, rows):
+    """
+    Ersätter anbudets dokument i bids_fts (i anroparens transaktion). header
+    har anbudsinfons kolumner (som bids), rows är kalkylraderna.
+    """
+    labels, materials = {}, {}  # unika värden i radernas ordning
+    for row in rows:
+        for field in ("objekt", "sektion"):
+            if row.get(field):
+                labels[str(row[field])] = None
+        for field in ("material", "material_key", "ytbekladnad_key"):
+            if row.get(field):
+                materials[str(row[field])] = None
+    values = [header[column] for column, _ in SEARCH_COLUMNS[:-2]]
+    conn.execute("DELETE FROM bids_fts WHERE rowid = ?", (bid_id,))
+    conn.execute(f"INSERT INTO bids_fts (rowid, {', '.join(column for column, _ in SEARCH_COLUMNS)}) "
+                 f"VALUES (?, {', '.join('?' for _ in SEARCH_COLUMNS)})",
+                 [bid_id, *values, ", ".join(labels), ", ".join(materials)])
+
+
+def rebuild_search_index(conn):
+    """Bygger om bids_fts från alla anbud (vid migreringen eller om indexet har kommit ur fas)."""
+    conn.execute("DELETE FROM bids_fts")
+    for bid in conn.execute("SELECT * FROM bids WHERE legacy_data IS NULL").fetchall():
+        _index_bid(conn, bid["id"], bid, iter_rows(conn, bid["id"]))
+
+
+# Markerar träffarna i search_bids utdrag; ersätts med HTML i appen
+HIT_START, HIT_END = "\x02", "\x03"
+
+# Matchar sökningen fler anbud än så rangordnas de inte (bm25 räknas för
+# varje träff); de senast skapade (högst id) visas i stället först. Den
+# ordningen ger FTS5 direkt, medan sortering på datum kräver alla träffar.
+RANK_LIMIT = 5000
+
+
+def _match_expression(query):
+    """Sökorden som FTS5-uttryck: alla ord ska finnas, vart och ett som prefix."""
+    return " ".join(f'"{word}"*' for word in re.findall(r"\w+", query))
+
+
+def search_bids(conn, query, limit=20):
+    """
+    Anbud som matchar sökorden, bäst först (bm25 med vikterna i
+    SEARCH_COLUMNS), eller senast skapade (högst id) först om fler än
+    RANK_LIMIT anbud matchar. Varje träff har listans kolumner och snippet:
+    ett utdrag ur den bäst matchande kolumnen där sökorden omges av
+    HIT_START/HIT_END.
+    """
+    expression = _match_expression(query)
+    if not expression:
+        return []
+    matches = conn.execute("SELECT COUNT(*) FROM (SELECT 1 FROM bids_fts WHERE bids_fts MATCH ? LIMIT ?)",
+                           (expression, RANK_LIMIT + 1)).fetchone()[0]
+    order = "rank" if matches <= RANK_LIMIT else "bids_fts.rowid DESC"
+    # bids_fts först (CROSS JOIN), så att FTS5 sorterar och utdrag bara tas fram för de limit första
+    return conn.execute(f'''
+        SELECT bids.id, bids.datum,
+               COALESCE(bids.anbudsnummer, bids.id) AS anbudsnummer,
+               COALESCE(bids.anbudsnamn, 'Okänt') AS anbudsnamn,
+               COALESCE(bids.kund, '') AS kund,
+               COALESCE(bids.projektledare, '') AS projektledare,
+               snippet(bids_fts, -1, ?, ?, '…', 12) AS snippet
+        FROM bids_fts CROSS JOIN bids ON bids.id = bids_fts.rowid
+        WHERE bids_fts MATCH ?
+        ORDER BY {order}
+        LIMIT ?
+    ''', (HIT_START, HIT_END, expression, limit)).fetchall()
+
+
+# --- Versionshistorik ---
+# Varje sparning av ett anbud lagras i bid_revisions som version 1, 2, ...
+# En nyckelbild innehåller hela anbudet ({"bid_info": ..., "kalkyl": [...]}).
+# Övriga versioner innehåller bara skillnaden mot föregående version:
+# {"rows": operationer, "bid_info": ...} där bid_info bara finns om den har
+# ändrats och operationerna är ["=", n] (behåll n rader), ["-", n] (ta bort
+# n rader) och ["+", [rader]] (lägg till rader). Historiken växer alltså med
+# ändringarnas storlek, inte med anbudets.
+
+def _current_version(conn, bid_id):
+    """
+    (datum, bid_info som JSON-text, rader som JSON-texter, radernas lagrade
+    värden) för anbudets sparade version, eller None.
+    """
+    bid = conn.execute("SELECT datum, bid_info, legacy_data FROM bids WHERE id = ?", (bid_id,)).fetchone()
+    if bid is None or bid["legacy_data"] is not None:
+        return None
+    stored = [data for (data,) in conn.execute(
+        "SELECT data FROM bid_rows WHERE bid_id = ? ORDER BY position", (bid_id,))]
+    return bid["datum"], bid["bid_info"] or "{}", list(map(_decoder(conn), stored)), stored
+
+
+def _row_delta(old, new):
+    """Operationerna som gör radlistan old till new (båda listor med JSON-texter)."""
+    start = 0
+    while start < len(old) and start < len(new) and old[start] == new[start]:
+        start += 1
+    end = 0
+    while end < len(old) - start and end < len(new) - start and old[-1 - end] == new[-1 - end]:
+        end += 1
+    ops = [["=", start]] if start else []
+    # Bara den ändrade delen i mitten jämförs rad för rad
+    middle_new = new[start:len(new) - end]
+    matcher = difflib.SequenceMatcher(None, old[start:len(old) - end], middle_new)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append(["=", i2 - i1])
+            continue
+        if i2 > i1:
+            ops.append(["-", i2 - i1])
+        if j2 > j1:
+            ops.append(["+", [json.loads(text) for text in middle_new[j1:j2]]])
+    if end:
+        ops.append(["=", end])
+    return ops
+
+
+def _apply_delta(rows, ops):
+    result, position = [], 0
+    for op, value in ops:
+        if op == "=":
+            result.extend(rows[position:position + value])
+            position += value
+        elif op == "-":
+            position += value
+        else:
+            result.extend(value)
+    return result
+
+
+def _keyframe(info_text, texts):
+    # Raderna skrivs in som de redan är serialiserade
+    return f'{{"bid_info": {info_text}, "kalkyl": [{", ".join(texts)}]}}'
+
+
+def _add_revision(conn, bid_id, previous, info_text, texts, datum, dictionary=None):
+    """Lägger till anbudets nya version (i save_bid_record:s transaktion)."""
+    last, last_keyframe = conn.execute(
+        "SELECT MAX(revision), MAX(CASE WHEN keyframe THEN revision END) FROM bid_revisions WHERE bid_id = ?",
+        (bid_id,)).fetchone()
+    if last is None and previous is not None:
+        # Anbud som sparades före versionshistoriken: den gamla versionen blir version 1
+        old_datum, old_info, old_texts, _ = previous
+        conn.execute("INSERT INTO bid_revisions (bid_id, revision, datum, keyframe, data) VALUES (?, 1, ?, 1, ?)",
+                     (bid_id, old_datum, _encode(dictionary, _keyframe(old_info, old_texts))))
+        last = last_keyframe = 1
+    revision = (last or 0) + 1
+    data = None
+    if previous is not None and revision - last_keyframe < KEYFRAME_INTERVAL:
+        _, old_info, old_texts, _ = previous
+        delta = {"rows": _row_delta(old_texts, texts)}
+        if info_text != old_info:
+            delta["bid_info"] = json.loads(info_text)
+        data = json.dumps(delta)
+    full = _keyframe(info_text, texts) if data is None or len(data) * 2 > sum(map(len, texts)) else None
+    conn.execute("INSERT INTO bid_revisions (bid_id, revision, datum, keyframe, data) VALUES (?, ?, ?, ?, ?)",
+                 (bid_id, revision, datum, full is not None, _encode(dictionary, full or data)))
+    return revision
+
+
+def list_revisions(conn, bid_id):
+    """Anbudets versioner, senaste först: revision, datum, keyframe och size (lagrad storlek i tecken)."""
+    return conn.execute(
+        "SELECT revision, datum, keyframe, LENGTH(data) AS size FROM bid_revisions "
+        "WHERE bid_id = ? ORDER BY revision DESC", (bid_id,)).fetchall()
+
+
+def load_revision(conn, bid_id, revision):
+    """
+    Anbudet som det sparades i version revision, som {"bid_info": ..., "kalkyl": [...]},
+    eller None om versionen saknas. Byggs från närmaste nyckelbild och skillnaderna efter den.
+    """
+    keyframe = conn.execute(
+        "SELECT MAX(revision) FROM bid_revisions WHERE bid_id = ? AND revision <= ? AND keyframe",
+        (bid_id, revision)).fetchone()[0]
+    if keyframe is None:
+        return None
+    records = conn.execute(
+        "SELECT revision, data FROM bid_revisions WHERE bid_id = ? AND revision BETWEEN ? AND ? ORDER BY revision",
+        (bid_id, keyframe, revision)).fetchall()
+    if records[-1][0] != revision:
+        return None
+    decode = _decoder(conn)
+    bid_data = json.loads(decode(records[0][1]))
+    bid_info, rows = bid_data["bid_info"], bid_data["kalkyl"]
+    for _, data in records[1:]:
+        delta = json.loads(decode(data))
+        bid_info = delta.get("bid_info", bid_info)
+        rows = _apply_delta(rows, delta["rows"])
+    return {"bid_info": bid_info, "kalkyl": rows}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("upgrade", "downgrade", "compress"):
+        sys.exit("Användning: python db.py upgrade|downgrade|compress [sökväg till anbud.db] [version]")
+    connection = get_db_connection(sys.argv[2] if len(sys.argv) > 2 else None)
+    if sys.argv[1] == "upgrade":
+        upgrade(connection, int(sys.argv[3]) if len(sys.argv) > 3 else SCHEMA_VERSION)
+    elif sys.argv[1] == "compress":
+        if schema_version(connection) < SCHEMA_VERSION:
+            upgrade(connection)
+        print(f"Komprimerade värden: {compress_all(connection)}")
+    else:
+        downgrade(connection, int(sys.argv[3]) if len(sys.argv) > 3 else 0)
+    print(f"Schemaversion: {schema_version(connection)}")
+    connection.close()
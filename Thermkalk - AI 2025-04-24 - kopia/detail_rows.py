@@ -0,0 +1,170 @@
+# detail_rows.py
+#
+# Radmodeller för sidan Detaljerade beräkningar. Mallen slog tidigare upp
+# tillbehör i materialregistret, multiplicerade och avrundade per rad och
+# kolumn, och gjorde samma sak en gång till för böjraden. Här formateras
+# varje tabellrad en gång till en DetailRow med färdiga celltexter, så att
+# mallen bara skriver ut värdena. Kostnaderna kommer från aggregate.row_costs.
+#
+# Celltexterna har samma form som mallen gav (Jinjas round och filtret
+# thousandspace), så sidan ser likadan ut.
+
+from typing import NamedTuple
+
+from aggregate import SPOOL, BAND, FOIL
+
+
+class DetailRow(NamedTuple):
+    bend: bool                # böjrad (visas med klassen bend-row)
+    cells: tuple              # celltexter i tabellhuvudets kolumnordning
+
+
+def thousands(value):
+    """Heltal med mellanslag som tusentalsavgränsare, som mallfiltret thousandspace."""
+    return f"{float(value):,.0f}".replace(",", " ")
+
+
+def _kr(value):
+    return f"{thousands(round(value, 0))} kr"
+
+
+def _artikelnr(materialer, key):
+    data = materialer.get(key) if key else None
+    return str(data.get("artikelnr", "")) if data else "-"
+
+
+def _isoleringstjocklek(materialer, key):
+    data = materialer.get(key) if key else None
+    return str(data.get("isoleringstjocklek", "Ej angivet")) if data else "Ej angivet"
+
+
+def _cladding_name(materialer, key):
+    data = materialer.get(key) if key else None
+    return str(data.get("artikelnamn", "")) if data else "-"
+
+
+class _Accessories(NamedTuple):
+    """Tillbehörens celltexter; samma för alla rader."""
+    spool_artikelnr: str
+    spool_price: str
+    band_artikelnr: str
+    foil_artikelnr: str
+
+    @classmethod
+    def from_materialer(cls, materialer):
+        spool = materialer.get(SPOOL)
+        return cls(
+            spool_artikelnr=str(spool.get("artikelnr", "")) if spool else "-",
+            spool_price=_kr(spool.get("kostnad", 0) if spool else 0),
+            band_artikelnr=str(materialer.get(BAND, {}).get("artikelnr", "")),
+            foil_artikelnr=str(materialer.get(FOIL, {}).get("artikelnr", "")),
+        )
+
+
+def _accessory_cells(pipe, costs, accessories):
+    """Kolumnerna från tejp till folie, gemensamma för rad och böjrad."""
+    tape_key = costs.tape_key
+    band = pipe.get("band")
+    return (
+        str(pipe.get("tejp_quantity", 0)),
+        tape_key or "-",
+        _kr(costs.tape_price) if tape_key else "-",
+        _kr(costs.tape_cost) if pipe.get("tejp_quantity") and tape_key else "-",
+        thousands(round(pipe.get("spoltrad_kg", 0), 0)),
+        accessories.spool_artikelnr,
+        accessories.spool_price,
+        _kr(costs.spool_cost),
+        f"{thousands(round(pipe.get('band_length', 0), 0)) if band else 0} m",
+        accessories.band_artikelnr if band else "-",
+        _kr(costs.band_cost),
+        str(round(pipe.get("band_grundtid", 0), 2)),
+        str(round(pipe.get("band_arbetstid", 0), 2)),
+        str(pipe.get("rorstod", 0)),
+        "0,144" if costs.small_pipe else "0,36",
+        str(costs.rorstod_work),
+        "0,03",
+        "0,049",
+    )
+
+
+def _foil_cells(pipe, costs, accessories):
+    folie = pipe.get("folie")
+    return (
+        f"{thousands(round(pipe.get('foil_area', 0), 0)) if folie else 0} m²",
+        accessories.foil_artikelnr if folie else "-",
+        _kr(costs.foil_cost),
+        f"{thousands(costs.shown_material_cost)} kr",
+    )
+
+
+def _timing_cells(pipe):
+    hojdtillagg = pipe.get("hojdtillagg")
+    return (
+        str(round(pipe.get("isolering_grund_montering", 0), 2)),
+        str(round(pipe.get("isolering_grund_tillverkning", 0), 2)),
+        str(round(pipe.get("isolering_tillagg_montering", 0), 2)),
+        thousands(round(pipe.get("work_time_isolering", 0), 0)),
+        thousands(round(pipe.get("work_time_ytbekladnad", 0), 0)),
+        f"{round(hojdtillagg, 2)}%" if hojdtillagg else "0%",
+        str(round(pipe.get("grundtid_montering", 0), 2)),
+        str(round(pipe.get("grundtid_tillverkning", 0), 2)),
+        str(round(pipe.get("tillaggstid_montering", 0), 2)),
+    )
+
+
+def detail_rows(rows, materialer, start=1):
+    """
+    DetailRow för varje (rad, RowCosts) i rows (se aggregate.costed_rows),
+    följd av en böjrad om raden har böj. start är första radens nummer.
+    """
+    accessories = _Accessories.from_materialer(materialer)
+    result = []
+    for nr, (pipe, costs) in enumerate(rows, start=start):
+        material_key = pipe.get("material_key")
+        cladding_key = pipe.get("ytbekladnad_key")
+        dimension = str(pipe.get("dimension", ""))
+        timing = _timing_cells(pipe)
+        accessory = _accessory_cells(pipe, costs, accessories)
+        foil = _foil_cells(pipe, costs, accessories)
+        folie = pipe.get("folie")
+        area = thousands(round(pipe.get("area", 0), 0))
+        price = _kr(pipe.get("price", 0))
+        ytbekladnad_cost = pipe.get("ytbekladnad_cost")
+        ytbekladnad_area = pipe.get("ytbekladnad_area")
+
+        result.append(DetailRow(False, (
+            str(nr),
+            str(pipe.get("material", "-")),
+            _isoleringstjocklek(materialer, material_key),
+            _artikelnr(materialer, material_key),
+            _cladding_name(materialer, cladding_key),
+            _artikelnr(materialer, cladding_key),
+            dimension,
+            thousands(round(pipe.get("length", 0), 0)),
+            area,
+            price,
+            *timing,
+            _kr(ytbekladnad_cost) if ytbekladnad_cost else "-",
+            f"{thousands(round(ytbekladnad_area, 0))} m²" if ytbekladnad_area else "-",
+            *accessory,
+            str(round(costs.foil_work, 2)) if folie else "-",
+            *foil,
+            thousands(round(costs.total_work, 0)),
+        )))
+
+        if pipe.get("boj"):
+            result.append(DetailRow(True, (
+                str(nr), "Böj", "-", "-", "-", "-",
+                dimension,
+                thousands(round(pipe.get("boj_length", 0), 0)),
+                area,
+                price,
+                *timing,
+                _kr(ytbekladnad_cost or 0),
+                f"{thousands(round(ytbekladnad_area or 0, 0))} m²",
+                *accessory,
+                str(round(costs.bend_foil_work, 2)) if folie else "-",
+                *foil,
+                thousands(round(costs.bend_total_work, 0)),
+            )))
+    return result
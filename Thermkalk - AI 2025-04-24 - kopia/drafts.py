@@ -0,0 +1,1069 @@
+# drafts.py
+#
+# Lagring av pågående kalkyler (utkast) på servern. Tidigare låg hela
+# pipe_list i Flasks signerade sessionscookie, som har en gräns på ca 4 KB.
+# Nu sparas bara ett utkast-id i sessionen och raderna ligger här, en post
+# per rad, så att en ändring bara skriver den rad som ändrats.
+#
+# Tre lagringar finns: en operationslogg i SQLite (standard), SQLite med en
+# post per rad, och lokala filer. Välj med
+# app.config["DRAFT_STORE"] = "oplog" | "sqlite" | "files" och DRAFT_STORE_PATH.
+# Operationsloggen sparar varje ändring som en liten operation och kan
+# ångra och göra om ändringar.
+#
+# Med en RunningTotals (totals.py) håller lagringen också utkastets löpande
+# summor och justerar dem vid varje radändring.
+
+import bisect
+import datetime
+import json
+import os
+import queue
+import sqlite3
+import threading
+import uuid
+from collections import OrderedDict
+
+
+def _now():
+    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _ord_between(before, after):
+    """
+    Ordningsvärde mellan grannarnas (None = början eller slutet av kalkylen),
+    eller None om det inte finns något tal emellan och raderna måste numreras om.
+    """
+    if before is None:
+        return 1 if after is None else after - 1
+    if after is None:
+        return before + 1
+    middle = (before + after) / 2
+    return middle if before < middle < after else None
+
+
+class DraftStore:
+    """
+    Gränssnitt för utkastlagring. Rader identifieras med ett stabilt row_id;
+    ordningen i kalkylen hålls separat så att radindex (som i /edit_pipe/<index>)
+    kan översättas med row_id_at().
+
+    totals är en valfri totals.RunningTotals; utan den finns inga summor.
+    """
+
+    _totals = None
+
+    def create(self):
+        """Skapar ett tomt utkast och returnerar dess id."""
+        raise NotImplementedError
+
+    def exists(self, draft_id):
+        raise NotImplementedError
+
+    def items(self, draft_id, offset=0, limit=None):
+        """Raderna i ordning som (row_id, rad); offset/limit ger en del av dem (en sida)."""
+        raise NotImplementedError
+
+    def rows(self, draft_id, offset=0, limit=None):
+        """Raderna i ordning (alla, eller limit stycken från offset)."""
+        return [row for _, row in self.items(draft_id, offset, limit)]
+
+    def count(self, draft_id):
+        return len(self.items(draft_id))
+
+    def row_id_at(self, draft_id, index):
+        """row_id för raden på plats index, eller None."""
+        items = self.items(draft_id)
+        return items[index][0] if 0 <= index < len(items) else None
+
+    def get(self, draft_id, row_id):
+        raise NotImplementedError
+
+    def last(self, draft_id):
+        """Sista raden som (row_id, rad), eller None."""
+        items = self.items(draft_id)
+        return items[-1] if items else None
+
+    def append(self, draft_id, row):
+        """Lägger till en rad sist och returnerar dess row_id."""
+        return self.extend(draft_id, [row])[0]
+
+    def extend(self, draft_id, rows):
+        raise NotImplementedError
+
+    def update(self, draft_id, row_id, row):
+        raise NotImplementedError
+
+    def update_many(self, draft_id, rows):
+        """Uppdaterar flera rader ({row_id: rad}) som en ändring."""
+        for row_id, row in rows.items():
+            self.update(draft_id, row_id, row)
+
+    def delete(self, draft_id, row_id):
+        raise NotImplementedError
+
+    def move(self, draft_id, row_id, index):
+        """
+        Flyttar raden till plats index (räknat som om raden redan var borttagen).
+        Bara radens ordningsvärde skrivs. Returnerar False om raden saknas.
+        """
+        raise NotImplementedError
+
+    def replace(self, draft_id, rows):
+        """Ersätter alla rader (t.ex. när ett sparat anbud laddas)."""
+        raise NotImplementedError
+
+    def drop(self, draft_id):
+        """Tar bort utkastet helt."""
+        raise NotImplementedError
+
+    def revision(self, draft_id):
+        """Räknas upp vid varje ändring av utkastets rader (för cachning per version)."""
+        raise NotImplementedError
+
+    def undo(self, draft_id):
+        """Ångrar den senaste ändringen. Returnerar False om det inte finns något att ångra (eller ingen historik)."""
+        return False
+
+    def redo(self, draft_id):
+        """Gör om den senast ångrade ändringen. Returnerar False om det inte finns någon."""
+        return False
+
+    def totals(self, draft_id):
+        """
+        Utkastets löpande summor (se totals.TOTAL_FIELDS). Räknas om från
+        raderna bara om de saknas eller räknades med andra tillbehörspriser.
+        """
+        raise NotImplementedError
+
+    def _adjusted_totals(self, stored, added=(), removed=()):
+        """
+        Nya sparade summor efter en radändring, eller None om de sparade
+        summorna saknas eller är inaktuella (då räknas de om vid nästa läsning).
+        """
+        prices = self._totals.prices()
+        if stored is None or stored["prices"] != prices:
+            return None
+        return {"prices": prices, "totals": self._totals.apply(stored["totals"], prices, added, removed)}
+
+    def _built_totals(self, rows):
+        prices = self._totals.prices()
+        return {"prices": prices, "totals": self._totals.build(rows, prices)}
+
+
+class SqliteDraftStore(DraftStore):
+    """Utkast i en SQLite-fil. En rad per kalkylrad, ordnad via kolumnen ord."""
+
+    def __init__(self, path, max_age_days=30, totals=None):
+        self.path = path
+        self.max_age_days = max_age_days
+        self._totals = totals
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS drafts (
+                draft_id TEXT PRIMARY KEY,
+                created TEXT,
+                updated TEXT,
+                revision INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS draft_rows (
+                row_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                draft_id TEXT NOT NULL,
+                ord REAL NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_draft_rows_order ON draft_rows (draft_id, ord);
+            CREATE TABLE IF NOT EXISTS draft_totals (
+                draft_id TEXT PRIMARY KEY,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_drafts_updated ON drafts (updated);
+        ''')
+        # Äldre utkastfiler saknar kolumnen revision
+        if "revision" not in [column[1] for column in conn.execute("PRAGMA table_info(drafts)")]:
+            conn.execute("ALTER TABLE drafts ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+        conn.commit()
+
+    def _conn(self):
+        # En anslutning per tråd (Flask kan köra förfrågningar i flera trådar)
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _touch(self, conn, draft_id):
+        conn.execute("UPDATE drafts SET updated = ?, revision = revision + 1 WHERE draft_id = ?",
+                     (_now(), draft_id))
+
+    def _load_totals(self, conn, draft_id):
+        found = conn.execute("SELECT data FROM draft_totals WHERE draft_id = ?", (draft_id,)).fetchone()
+        return json.loads(found[0]) if found else None
+
+    def _store_totals(self, conn, draft_id, stored):
+        if stored is None:
+            conn.execute("DELETE FROM draft_totals WHERE draft_id = ?", (draft_id,))
+        else:
+            conn.execute("INSERT OR REPLACE INTO draft_totals (draft_id, data) VALUES (?, ?)",
+                         (draft_id, json.dumps(stored)))
+
+    def _adjust_totals(self, conn, draft_id, added=(), removed=()):
+        # Körs i samma transaktion som radändringen (efter BEGIN IMMEDIATE)
+        if self._totals is not None:
+            stored = self._adjusted_totals(self._load_totals(conn, draft_id), added, removed)
+            self._store_totals(conn, draft_id, stored)
+
+    def create(self):
+        draft_id = uuid.uuid4().hex
+        conn = self._conn()
+        with conn:
+            now = _now()
+            conn.execute("INSERT INTO drafts (draft_id, created, updated) VALUES (?, ?, ?)", (draft_id, now, now))
+            if self._totals is not None:
+                self._store_totals(conn, draft_id, self._built_totals([]))
+            self._purge(conn)
+        return draft_id
+
+    def _purge(self, conn):
+        # Städa bort övergivna utkast
+        if not self.max_age_days:
+            return
+        limit = (datetime.datetime.now() - datetime.timedelta(days=self.max_age_days)).strftime("%Y-%m-%d %H:%M:%S")
+        old = [r[0] for r in conn.execute("SELECT draft_id FROM drafts WHERE updated < ?", (limit,))]
+        for draft_id in old:
+            conn.execute("DELETE FROM draft_rows WHERE draft_id = ?", (draft_id,))
+            conn.execute("DELETE FROM draft_totals WHERE draft_id = ?", (draft_id,))
+            conn.execute("DELETE FROM drafts WHERE draft_id = ?", (draft_id,))
+
+    def exists(self, draft_id):
+        return self._conn().execute("SELECT 1 FROM drafts WHERE draft_id = ?", (draft_id,)).fetchone() is not None
+
+    def items(self, draft_id, offset=0, limit=None):
+        cur = self._conn().execute(
+            "SELECT row_id, data FROM draft_rows WHERE draft_id = ? ORDER BY ord LIMIT ? OFFSET ?",
+            (draft_id, -1 if limit is None else limit, offset))
+        return [(row_id, json.loads(data)) for row_id, data in cur]
+
+    def count(self, draft_id):
+        return self._conn().execute("SELECT COUNT(*) FROM draft_rows WHERE draft_id = ?", (draft_id,)).fetchone()[0]
+
+    def row_id_at(self, draft_id, index):
+        if index < 0:
+            return None
+        found = self._conn().execute(
+            "SELECT row_id FROM draft_rows WHERE draft_id = ? ORDER BY ord LIMIT 1 OFFSET ?",
+            (draft_id, index)).fetchone()
+        return found[0] if found else None
+
+    def get(self, draft_id, row_id):
+        found = self._conn().execute(
+            "SELECT data FROM draft_rows WHERE draft_id = ? AND row_id = ?", (draft_id, row_id)).fetchone()
+        return json.loads(found[0]) if found else None
+
+    def last(self, draft_id):
+        found = self._conn().execute(
+            "SELECT row_id, data FROM draft_rows WHERE draft_id = ? ORDER BY ord DESC LIMIT 1",
+            (draft_id,)).fetchone()
+        return (found[0], json.loads(found[1])) if found else None
+
+    def extend(self, draft_id, rows):
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            top = conn.execute("SELECT MAX(ord) FROM draft_rows WHERE draft_id = ?", (draft_id,)).fetchone()[0] or 0
+            row_ids = []
+            for i, row in enumerate(rows, start=1):
+                cur = conn.execute("INSERT INTO draft_rows (draft_id, ord, data) VALUES (?, ?, ?)",
+                                   (draft_id, top + i, json.dumps(row)))
+                row_ids.append(cur.lastrowid)
+            self._adjust_totals(conn, draft_id, added=rows)
+            self._touch(conn, draft_id)
+        return row_ids
+
+    def update(self, draft_id, row_id, row):
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            old = self.get(draft_id, row_id)
+            if old is None:
+                return
+            conn.execute("UPDATE draft_rows SET data = ? WHERE draft_id = ? AND row_id = ?",
+                         (json.dumps(row), draft_id, row_id))
+            self._adjust_totals(conn, draft_id, added=[row], removed=[old])
+            self._touch(conn, draft_id)
+
+    def delete(self, draft_id, row_id):
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            old = self.get(draft_id, row_id)
+            if old is None:
+                return
+            conn.execute("DELETE FROM draft_rows WHERE draft_id = ? AND row_id = ?", (draft_id, row_id))
+            self._adjust_totals(conn, draft_id, removed=[old])
+            self._touch(conn, draft_id)
+
+    def move(self, draft_id, row_id, index):
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if self.get(draft_id, row_id) is None:
+                return False
+            index = max(index, 0)
+            others = "FROM draft_rows WHERE draft_id = ? AND row_id != ?"
+            if index == 0:
+                before, after = None, conn.execute(f"SELECT MIN(ord) {others}", (draft_id, row_id)).fetchone()[0]
+            else:
+                found = [r[0] for r in conn.execute(f"SELECT ord {others} ORDER BY ord LIMIT 2 OFFSET ?",
+                                                    (draft_id, row_id, index - 1))]
+                if not found:
+                    before, after = conn.execute(f"SELECT MAX(ord) {others}", (draft_id, row_id)).fetchone()[0], None
+                else:
+                    before, after = found[0], found[1] if len(found) > 1 else None
+            ord_ = _ord_between(before, after)
+            if ord_ is None:
+                # Inget tal kvar mellan grannarna: numrera om raderna med en lucka på plats index
+                row_ids = [r[0] for r in conn.execute(f"SELECT row_id {others} ORDER BY ord", (draft_id, row_id))]
+                conn.executemany("UPDATE draft_rows SET ord = ? WHERE row_id = ?",
+                                 [(i + 1 if i < index else i + 2, other) for i, other in enumerate(row_ids)])
+                ord_ = min(index, len(row_ids)) + 1
+            conn.execute("UPDATE draft_rows SET ord = ? WHERE row_id = ?", (ord_, row_id))
+            self._touch(conn, draft_id)
+        return True
+
+    def replace(self, draft_id, rows):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM draft_rows WHERE draft_id = ?", (draft_id,))
+            conn.executemany("INSERT INTO draft_rows (draft_id, ord, data) VALUES (?, ?, ?)",
+                             [(draft_id, i, json.dumps(row)) for i, row in enumerate(rows, start=1)])
+            if self._totals is not None:
+                self._store_totals(conn, draft_id, self._built_totals(rows))
+            self._touch(conn, draft_id)
+
+    def drop(self, draft_id):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM draft_rows WHERE draft_id = ?", (draft_id,))
+            conn.execute("DELETE FROM draft_totals WHERE draft_id = ?", (draft_id,))
+            conn.execute("DELETE FROM drafts WHERE draft_id = ?", (draft_id,))
+
+    def revision(self, draft_id):
+        found = self._conn().execute("SELECT revision FROM drafts WHERE draft_id = ?", (draft_id,)).fetchone()
+        return found[0] if found else None
+
+    def totals(self, draft_id):
+        conn = self._conn()
+        stored = self._load_totals(conn, draft_id)
+        if stored is None or stored["prices"] != self._totals.prices():
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                stored = self._built_totals(self.rows(draft_id))
+                self._store_totals(conn, draft_id, stored)
+        return stored["totals"]
+
+
+class FileDraftStore(DraftStore):
+    """
+    Utkast som filer: en katalog per utkast och en JSON-fil per rad
+    ({"ord": ..., "row": {...}}). En ändring skriver bara den radens fil
+    (och metafilen med nästa row_id och revisionen).
+    """
+
+    def __init__(self, path, totals=None):
+        self.path = path
+        self._totals = totals
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _dir(self, draft_id):
+        # Utkast-id:n är hex-strängar; allt annat avvisas för att undvika sökvägstrick
+        if not draft_id or not all(c in "0123456789abcdef" for c in draft_id):
+            raise ValueError("Ogiltigt utkast-id.")
+        return os.path.join(self.path, draft_id)
+
+    def _row_file(self, draft_id, row_id):
+        return os.path.join(self._dir(draft_id), f"{int(row_id)}.json")
+
+    def _write(self, file_path, data):
+        tmp_path = file_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, file_path)
+
+    def _entries(self, draft_id):
+        directory = self._dir(draft_id)
+        if not os.path.isdir(directory):
+            return []
+        entries = []
+        for name in os.listdir(directory):
+            if name.endswith(".json"):
+                with open(os.path.join(directory, name), encoding="utf-8") as f:
+                    data = json.load(f)
+                entries.append((data["ord"], int(name[:-5]), data["row"]))
+        entries.sort()
+        return entries
+
+    def create(self):
+        draft_id = uuid.uuid4().hex
+        os.makedirs(self._dir(draft_id))
+        self._write(os.path.join(self._dir(draft_id), "meta"), {"next": 1, "revision": 0})
+        if self._totals is not None:
+            self._store_totals(draft_id, self._built_totals([]))
+        return draft_id
+
+    def exists(self, draft_id):
+        try:
+            return os.path.isdir(self._dir(draft_id))
+        except ValueError:
+            return False
+
+    def items(self, draft_id, offset=0, limit=None):
+        entries = self._entries(draft_id)[offset:None if limit is None else offset + limit]
+        return [(row_id, row) for _, row_id, row in entries]
+
+    def get(self, draft_id, row_id):
+        try:
+            with open(self._row_file(draft_id, row_id), encoding="utf-8") as f:
+                return json.load(f)["row"]
+        except FileNotFoundError:
+            return None
+
+    def _meta(self, draft_id):
+        # Nästa lediga row_id (och ordningsvärde) och revisionen sparas i en liten metafil
+        try:
+            with open(os.path.join(self._dir(draft_id), "meta"), encoding="utf-8") as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            meta = {"next": max((max(e[0], e[1]) for e in self._entries(draft_id)), default=0) + 1}
+        meta.setdefault("revision", 0)
+        return meta
+
+    def _next_id(self, draft_id):
+        return self._meta(draft_id)["next"]
+
+    def _bump(self, draft_id, next_id=None):
+        # Anropas med self._lock låst efter varje ändring
+        meta = self._meta(draft_id)
+        if next_id is not None:
+            meta["next"] = next_id
+        meta["revision"] += 1
+        self._write(os.path.join(self._dir(draft_id), "meta"), meta)
+
+    def revision(self, draft_id):
+        if not self.exists(draft_id):
+            return None
+        return self._meta(draft_id)["revision"]
+
+    def _load_totals(self, draft_id):
+        try:
+            with open(os.path.join(self._dir(draft_id), "totals"), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _store_totals(self, draft_id, stored):
+        file_path = os.path.join(self._dir(draft_id), "totals")
+        if stored is None:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        else:
+            self._write(file_path, stored)
+
+    def _adjust_totals(self, draft_id, added=(), removed=()):
+        # Anropas med self._lock låst
+        if self._totals is not None:
+            self._store_totals(draft_id, self._adjusted_totals(self._load_totals(draft_id), added, removed))
+
+    def extend(self, draft_id, rows):
+        with self._lock:
+            next_id = self._next_id(draft_id)
+            row_ids = []
+            for i, row in enumerate(rows):
+                self._write(self._row_file(draft_id, next_id + i), {"ord": next_id + i, "row": row})
+                row_ids.append(next_id + i)
+            self._bump(draft_id, next_id=next_id + len(rows))
+            self._adjust_totals(draft_id, added=rows)
+        return row_ids
+
+    def update(self, draft_id, row_id, row):
+        file_path = self._row_file(draft_id, row_id)
+        with self._lock:
+            with open(file_path, encoding="utf-8") as f:
+                old = json.load(f)
+            self._write(file_path, {"ord": old["ord"], "row": row})
+            self._bump(draft_id)
+            self._adjust_totals(draft_id, added=[row], removed=[old["row"]])
+
+    def delete(self, draft_id, row_id):
+        with self._lock:
+            old = self.get(draft_id, row_id)
+            if old is None:
+                return
+            os.remove(self._row_file(draft_id, row_id))
+            self._bump(draft_id)
+            self._adjust_totals(draft_id, removed=[old])
+
+    def move(self, draft_id, row_id, index):
+        with self._lock:
+            row = self.get(draft_id, row_id)
+            if row is None:
+                return False
+            others = [(ord_, other, data) for ord_, other, data in self._entries(draft_id) if other != row_id]
+            index = min(max(index, 0), len(others))
+            ord_ = _ord_between(others[index - 1][0] if index > 0 else None,
+                                others[index][0] if index < len(others) else None)
+            if ord_ is None:
+                # Inget tal kvar mellan grannarna: numrera om raderna med en lucka på plats index
+                for i, (_, other, data) in enumerate(others):
+                    self._write(self._row_file(draft_id, other), {"ord": i + 1 if i < index else i + 2, "row": data})
+                ord_ = index + 1
+            self._write(self._row_file(draft_id, row_id), {"ord": ord_, "row": row})
+            # Nya rader får ordningsvärdet next; det ska ligga efter den flyttade raden
+            self._bump(draft_id, next_id=max(self._next_id(draft_id), int(ord_) + 1))
+        return True
+
+    def replace(self, draft_id, rows):
+        with self._lock:
+            for _, row_id, _ in self._entries(draft_id):
+                os.remove(self._row_file(draft_id, row_id))
+            os.makedirs(self._dir(draft_id), exist_ok=True)
+            for i, row in enumerate(rows, start=1):
+                self._write(self._row_file(draft_id, i), {"ord": i, "row": row})
+            self._bump(draft_id, next_id=len(rows) + 1)
+            if self._totals is not None:
+                self._store_totals(draft_id, self._built_totals(rows))
+
+    def drop(self, draft_id):
+        directory = self._dir(draft_id)
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+            os.rmdir(directory)
+
+    def totals(self, draft_id):
+        with self._lock:
+            stored = self._load_totals(draft_id)
+            if stored is None or stored["prices"] != self._totals.prices():
+                stored = self._built_totals(self.rows(draft_id))
+                self._store_totals(draft_id, stored)
+        return stored["totals"]
+
+
+# --- Operationslogg ---
+# Varje ändring sparas som en liten operation sist i en logg (draft_ops):
+#   add     nya rader            {"rows": [[row_id, ord, rad], ...]}
+#   patch   ändrade fält         {"rows": [[row_id, {"set": {...}, "unset": [...], "old": {...}}], ...]}
+#   delete  borttagna rader      {"rows": [[row_id, ord, rad], ...]} (raderna sparas för ångra)
+#   move    nya ordningsvärden   {"rows": [[row_id, ord, gammalt ord], ...]}
+#   reset   allt ersatt (t.ex. ett sparat anbud laddas); raderna finns i ögonblicksbilden
+#   undo/redo  ångrad/återställd operation; "apply" är operationen som tillämpas
+# Justerade priser (save_adjusted_prices) och objekt/sektion blir patch-operationer.
+#
+# Utkastets tillstånd är den senaste ögonblicksbilden (draft_snapshots) med
+# loggens senare operationer tillämpade. Det hålls i minnet och läses bara
+# om när en annan process har skrivit. En bakgrundstråd skriver en ny
+# ögonblicksbild när många rader har ändrats sedan den förra och tar bort gamla
+# operationer, utom de senaste undo_depth som behövs för att ångra.
+
+def _row_patch(old, new):
+    """Skillnaden mellan två versioner av en rad, eller None om de är lika."""
+    changed = {key: value for key, value in new.items() if key not in old or old[key] != value}
+    removed = [key for key in old if key not in new]
+    if not changed and not removed:
+        return None
+    return {"set": changed, "unset": removed, "old": {key: old[key] for key in [*changed, *removed] if key in old}}
+
+
+def _inverse(op):
+    """Operationen som tar tillbaka op."""
+    kind = op["type"]
+    if kind == "add":
+        return {"type": "delete", "rows": op["rows"]}
+    if kind == "delete":
+        return {"type": "add", "rows": op["rows"]}
+    if kind == "patch":
+        return {"type": "patch", "rows": [
+            [row_id, {"set": patch["old"], "unset": [key for key in patch["set"] if key not in patch["old"]],
+                      "old": patch["set"]}]
+            for row_id, patch in reversed(op["rows"])]}
+    if kind == "move":
+        return {"type": "move", "rows": [[row_id, old_ord, ord_] for row_id, ord_, old_ord in reversed(op["rows"])]}
+    raise ValueError(f"Operationen kan inte ångras: {kind}")
+
+
+class _DraftState:
+    """
+    Ett utkast i minnet efter operationen seq. Raderna hålls som JSON-text,
+    så att den som läser en rad alltid får en egen kopia att ändra i.
+    """
+
+    def __init__(self, seq, rows, next_id, stored):
+        self.seq = seq
+        self.rows = {row_id: (ord_, text) for row_id, ord_, text in rows}
+        self.order = sorted((ord_, row_id) for row_id, ord_, _ in rows)
+        self.next = next_id
+        self.stored = stored      # {"prices", "totals"} eller None
+        self.pending = 0          # ändrade rader sedan ögonblicksbilden
+
+    def row(self, row_id):
+        return json.loads(self.rows[row_id][1])
+
+    def _insert(self, row_id, ord_, text):
+        self.rows[row_id] = (ord_, text)
+        bisect.insort(self.order, (ord_, row_id))
+
+    def _remove(self, row_id):
+        ord_, text = self.rows.pop(row_id)
+        del self.order[bisect.bisect_left(self.order, (ord_, row_id))]
+        return text
+
+    def apply(self, op):
+        """Tillämpar op. Returnerar (tillagda, borttagna) rader för de löpande summorna."""
+        kind = op["type"]
+        if kind in ("undo", "redo"):
+            return self.apply(op["apply"])
+        added, removed = [], []
+        if kind == "add":
+            for row_id, ord_, row in op["rows"]:
+                self._insert(row_id, ord_, json.dumps(row))
+                self.next = max(self.next, row_id + 1)
+                added.append(row)
+        elif kind == "delete":
+            for row_id, _, _ in op["rows"]:
+                removed.append(json.loads(self._remove(row_id)))
+        elif kind == "patch":
+            for row_id, patch in op["rows"]:
+                ord_, text = self.rows[row_id]
+                old = json.loads(text)
+                row = dict(old, **patch["set"])
+                for key in patch["unset"]:
+                    row.pop(key, None)
+                self.rows[row_id] = (ord_, json.dumps(row))
+                added.append(row)
+                removed.append(old)
+        elif kind == "move":
+            for row_id, ord_, _ in op["rows"]:
+                self._insert(row_id, ord_, self._remove(row_id))
+        else:
+            raise ValueError(f"Okänd operation: {kind}")
+        return added, removed
+
+    def snapshot(self):
+        """
+        Ögonblicksbilden som text: en rad JSON med next och summorna, sedan en
+        rad per kalkylrad "row_id<tab>ord<tab>rad som JSON". Raderna skrivs och
+        läses som de är, utan att tolkas.
+        """
+        lines = [json.dumps({"next": self.next, "totals": self.stored})]
+        lines.extend(f"{row_id}\t{json.dumps(self.rows[row_id][0])}\t{self.rows[row_id][1]}" for _, row_id in self.order)
+        return "\n".join(lines)
+
+    @classmethod
+    def from_snapshot(cls, seq, data):
+        header, *lines = data.split("\n")
+        header = json.loads(header)
+        rows = []
+        for line in lines:
+            row_id, ord_, text = line.split("\t", 2)
+            rows.append((int(row_id), float(ord_), text))
+        return cls(seq, rows, header["next"], header["totals"])
+
+
+class OpLogDraftStore(DraftStore):
+    """
+    Utkast som en logg av operationer i SQLite, med ögonblicksbilder. En
+    ändring skriver en operation vars storlek beror på ändringen, inte på
+    utkastets storlek. Loggen gör också att ändringar kan ångras (undo/redo).
+
+    compact_after är antalet ändrade rader efter vilket en ny ögonblicksbild
+    skrivs i bakgrunden; undo_depth är hur många operationer som sparas för
+    att kunna ångras; max_rows är hur många rader (sammanlagt för alla utkast)
+    som hålls i minnet.
+    """
+
+    def __init__(self, path, max_age_days=30, totals=None, compact_after=500, undo_depth=100, max_rows=100_000):
+        self.path = path
+        self.max_age_days = max_age_days
+        self._totals = totals
+        self.compact_after = compact_after
+        self.undo_depth = undo_depth
+        self.max_rows = max_rows
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        self._states = OrderedDict()
+        self._compact_queue = queue.Queue()
+        self._compacting = set()
+        self._compactor = None
+        conn = self._conn()
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS log_drafts (
+                draft_id TEXT PRIMARY KEY,
+                created TEXT,
+                updated TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_log_drafts_updated ON log_drafts (updated);
+            CREATE TABLE IF NOT EXISTS draft_snapshots (
+                draft_id TEXT PRIMARY KEY,
+                seq INTEGER NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS draft_ops (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                draft_id TEXT NOT NULL,
+                op TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_draft_ops_draft ON draft_ops (draft_id, seq);
+        ''')
+        conn.commit()
+        # Utkast från SqliteDraftStore i samma fil flyttas över när de används
+        tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        self._legacy = {"drafts", "draft_rows"} <= tables
+
+    def _conn(self):
+        # En anslutning per tråd (Flask kan köra förfrågningar i flera trådar)
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # -- Tillstånd i minnet --
+
+    def _load(self, conn, draft_id):
+        found = conn.execute("SELECT seq, data FROM draft_snapshots WHERE draft_id = ?", (draft_id,)).fetchone()
+        if found is None:
+            return None
+        state = _DraftState.from_snapshot(*found)
+        self._replay(conn, draft_id, state)
+        return state
+
+    def _replay(self, conn, draft_id, state):
+        for seq, op in conn.execute("SELECT seq, op FROM draft_ops WHERE draft_id = ? AND seq > ? ORDER BY seq",
+                                    (draft_id, state.seq)):
+            self._apply(state, seq, json.loads(op))
+
+    def _apply(self, state, seq, op):
+        if op["type"] == "reset":
+            state.seq = seq  # raderna kom redan med ögonblicksbilden
+            return
+        added, removed = state.apply(op)
+        if self._totals is not None:
+            state.stored = self._adjusted_totals(state.stored, added, removed)
+        state.seq = seq
+        state.pending += max(len(added), len(removed), 1)
+
+    def _state(self, conn, draft_id):
+        """Utkastets aktuella tillstånd (med andra processers operationer), eller None. Anropas med self._lock."""
+        last_op, snapshot_seq = conn.execute(
+            "SELECT (SELECT MAX(seq) FROM draft_ops WHERE draft_id = ?),"
+            " (SELECT seq FROM draft_snapshots WHERE draft_id = ?)", (draft_id, draft_id)).fetchone()
+        state = self._states.get(draft_id)
+        if snapshot_seq is None:
+            self._states.pop(draft_id, None)
+            return None
+        if state is None or snapshot_seq > state.seq:
+            # Okänt här, eller en annan process har skrivit en nyare ögonblicksbild
+            state = self._load(conn, draft_id)
+        elif last_op is not None and last_op > state.seq:
+            self._replay(conn, draft_id, state)
+        self._keep(draft_id, state)
+        return state
+
+    def _keep(self, draft_id, state):
+        """Håller state i minnet och släpper de utkast som använts minst nyligen när raderna blir för många."""
+        self._states[draft_id] = state
+        self._states.move_to_end(draft_id)
+        rows = sum(len(cached.order) for cached in self._states.values())
+        while rows > self.max_rows and len(self._states) > 1:
+            rows -= len(self._states.popitem(last=False)[1].order)
+
+    def _read(self, draft_id, read):
+        with self._lock:
+            state = self._state(self._conn(), draft_id)
+            return read(state) if state is not None else None
+
+    def _write(self, draft_id, make_op):
+        """Lägger make_op(conn, state) sist i loggen och tillämpar den. make_op kan ge None (ingen ändring)."""
+        conn = self._conn()
+        with self._lock:
+            try:
+                with conn:
+                    conn.execute("BEGIN IMMEDIATE")
+                    state = self._state(conn, draft_id)
+                    op = make_op(conn, state) if state is not None else None
+                    if op is None:
+                        return None
+                    cur = conn.execute("INSERT INTO draft_ops (draft_id, op) VALUES (?, ?)",
+                                       (draft_id, json.dumps(op)))
+                    conn.execute("UPDATE log_drafts SET updated = ? WHERE draft_id = ?", (_now(), draft_id))
+                    self._apply(state, cur.lastrowid, op)
+                    self._keep(draft_id, state)
+            except BaseException:
+                # Tillståndet i minnet kan ha hunnit ändras; läs om det från loggen
+                self._states.pop(draft_id, None)
+                raise
+            if state.pending >= self.compact_after:
+                self._schedule_compaction(draft_id)
+        return op
+
+    def _reset(self, conn, draft_id, rows):
+        """Ersätter utkastets rader med en ny ögonblicksbild (i en pågående transaktion)."""
+        # reset-operationen ger ögonblicksbilden ett nytt seq, så att revisionen räknas upp
+        seq = conn.execute("INSERT INTO draft_ops (draft_id, op) VALUES (?, ?)",
+                           (draft_id, json.dumps({"type": "reset"}))).lastrowid
+        conn.execute("DELETE FROM draft_ops WHERE draft_id = ? AND seq < ?", (draft_id, seq))
+        state = _DraftState(seq, [(row_id, ord_, json.dumps(row)) for row_id, ord_, row in rows],
+                            max((row_id for row_id, _, _ in rows), default=0) + 1,
+                            self._built_totals([row for _, _, row in rows]) if self._totals is not None else None)
+        conn.execute("INSERT OR REPLACE INTO draft_snapshots (draft_id, seq, data) VALUES (?, ?, ?)",
+                     (draft_id, seq, state.snapshot()))
+        self._keep(draft_id, state)
+
+    # -- Ögonblicksbilder --
+
+    def _schedule_compaction(self, draft_id):
+        if draft_id in self._compacting:
+            return
+        self._compacting.add(draft_id)
+        if self._compactor is None or not self._compactor.is_alive():
+            self._compactor = threading.Thread(target=self._compact_loop, name="draft-compactor", daemon=True)
+            self._compactor.start()
+        self._compact_queue.put(draft_id)
+
+    def _compact_loop(self):
+        while True:
+            draft_id = self._compact_queue.get()
+            try:
+                self.compact(draft_id)
+            except sqlite3.Error:
+                pass  # försöks igen efter nästa ändring
+            finally:
+                with self._lock:
+                    self._compacting.discard(draft_id)
+
+    def compact(self, draft_id):
+        """Skriver en ny ögonblicksbild och tar bort operationer som inte längre behövs för att ångra."""
+        conn = self._conn()
+        with self._lock:
+            state = self._state(conn, draft_id)
+            if state is None:
+                return
+            seq, data = state.seq, state.snapshot()
+            state.pending = 0
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            current = conn.execute("SELECT seq FROM draft_snapshots WHERE draft_id = ?", (draft_id,)).fetchone()
+            if current is None or current[0] >= seq:
+                return  # borttaget, eller redan en nyare ögonblicksbild
+            conn.execute("UPDATE draft_snapshots SET seq = ?, data = ? WHERE draft_id = ?", (seq, data, draft_id))
+            conn.execute(
+                "DELETE FROM draft_ops WHERE draft_id = ? AND seq <= ? AND seq NOT IN"
+                " (SELECT seq FROM draft_ops WHERE draft_id = ? ORDER BY seq DESC LIMIT ?)",
+                (draft_id, seq, draft_id, self.undo_depth))
+
+    # -- DraftStore --
+
+    def create(self):
+        draft_id = uuid.uuid4().hex
+        conn = self._conn()
+        with self._lock, conn:
+            now = _now()
+            conn.execute("INSERT INTO log_drafts (draft_id, created, updated) VALUES (?, ?, ?)", (draft_id, now, now))
+            self._reset(conn, draft_id, [])
+            self._purge(conn)
+        return draft_id
+
+    def _purge(self, conn):
+        # Städa bort övergivna utkast
+        if not self.max_age_days:
+            return
+        limit = (datetime.datetime.now() - datetime.timedelta(days=self.max_age_days)).strftime("%Y-%m-%d %H:%M:%S")
+        for (draft_id,) in conn.execute("SELECT draft_id FROM log_drafts WHERE updated < ?", (limit,)).fetchall():
+            self._delete_draft(conn, draft_id)
+
+    def _delete_draft(self, conn, draft_id):
+        conn.execute("DELETE FROM draft_ops WHERE draft_id = ?", (draft_id,))
+        conn.execute("DELETE FROM draft_snapshots WHERE draft_id = ?", (draft_id,))
+        conn.execute("DELETE FROM log_drafts WHERE draft_id = ?", (draft_id,))
+        self._states.pop(draft_id, None)
+
+    def exists(self, draft_id):
+        conn = self._conn()
+        if conn.execute("SELECT 1 FROM log_drafts WHERE draft_id = ?", (draft_id,)).fetchone() is not None:
+            return True
+        if not self._legacy:
+            return False
+        # Skrivlåset tas bara när det finns ett gammalt utkast att flytta över
+        if conn.execute("SELECT 1 FROM drafts WHERE draft_id = ?", (draft_id,)).fetchone() is None:
+            return False
+        return self._import_legacy(conn, draft_id)
+
+    def _import_legacy(self, conn, draft_id):
+        # Ett utkast som sparades av SqliteDraftStore blir en ögonblicksbild här
+        with self._lock, conn:
+            conn.execute("BEGIN IMMEDIATE")
+            found = conn.execute("SELECT created FROM drafts WHERE draft_id = ?", (draft_id,)).fetchone()
+            if found is None:
+                return False
+            rows = [(row_id, ord_, json.loads(data)) for row_id, ord_, data in conn.execute(
+                "SELECT row_id, ord, data FROM draft_rows WHERE draft_id = ? ORDER BY ord", (draft_id,))]
+            conn.execute("INSERT INTO log_drafts (draft_id, created, updated) VALUES (?, ?, ?)",
+                         (draft_id, found[0], _now()))
+            self._reset(conn, draft_id, rows)
+            conn.execute("DELETE FROM draft_rows WHERE draft_id = ?", (draft_id,))
+            conn.execute("DELETE FROM draft_totals WHERE draft_id = ?", (draft_id,))
+            conn.execute("DELETE FROM drafts WHERE draft_id = ?", (draft_id,))
+        return True
+
+    def items(self, draft_id, offset=0, limit=None):
+        def read(state):
+            page = state.order[offset:None if limit is None else offset + limit]
+            return [(row_id, state.row(row_id)) for _, row_id in page]
+        return self._read(draft_id, read) or []
+
+    def count(self, draft_id):
+        return self._read(draft_id, lambda state: len(state.order)) or 0
+
+    def row_id_at(self, draft_id, index):
+        return self._read(draft_id, lambda state: state.order[index][1] if 0 <= index < len(state.order) else None)
+
+    def get(self, draft_id, row_id):
+        return self._read(draft_id, lambda state: state.row(row_id) if row_id in state.rows else None)
+
+    def last(self, draft_id):
+        def read(state):
+            if not state.order:
+                return None
+            row_id = state.order[-1][1]
+            return row_id, state.row(row_id)
+        return self._read(draft_id, read)
+
+    def extend(self, draft_id, rows):
+        if not rows:
+            return []
+
+        def make_op(conn, state):
+            top = state.order[-1][0] if state.order else 0
+            return {"type": "add", "rows": [[state.next + i, top + i + 1, row] for i, row in enumerate(rows)]}
+        op = self._write(draft_id, make_op)
+        return [row_id for row_id, _, _ in op["rows"]] if op else []
+
+    def update(self, draft_id, row_id, row):
+        self.update_many(draft_id, {row_id: row})
+
+    def update_many(self, draft_id, rows):
+        def make_op(conn, state):
+            patches = []
+            for row_id, row in rows.items():
+                if row_id in state.rows:
+                    patch = _row_patch(state.row(row_id), row)
+                    if patch is not None:
+                        patches.append([row_id, patch])
+            return {"type": "patch", "rows": patches} if patches else None
+        self._write(draft_id, make_op)
+
+    def delete(self, draft_id, row_id):
+        def make_op(conn, state):
+            if row_id not in state.rows:
+                return None
+            return {"type": "delete", "rows": [[row_id, state.rows[row_id][0], state.row(row_id)]]}
+        self._write(draft_id, make_op)
+
+    def move(self, draft_id, row_id, index):
+        found = False
+
+        def make_op(conn, state):
+            nonlocal found
+            if row_id not in state.rows:
+                return None
+            found = True
+            old_ord = state.rows[row_id][0]
+            position = bisect.bisect_left(state.order, (old_ord, row_id))
+            # Plats i ordningen utan den flyttade raden
+            others = len(state.order) - 1
+            index_ = min(max(index, 0), others)
+            other = lambda i: state.order[i if i < position else i + 1][0]
+            ord_ = _ord_between(other(index_ - 1) if index_ > 0 else None,
+                                other(index_) if index_ < others else None)
+            if ord_ is not None:
+                return {"type": "move", "rows": [[row_id, ord_, old_ord]]}
+            # Inget tal kvar mellan grannarna: numrera om raderna med en lucka på plats index
+            moves = []
+            for i in range(others):
+                other_ord, other_id = state.order[i if i < position else i + 1]
+                new_ord = i + 1 if i < index_ else i + 2
+                if new_ord != other_ord:
+                    moves.append([other_id, new_ord, other_ord])
+            return {"type": "move", "rows": moves + [[row_id, index_ + 1, old_ord]]}
+        self._write(draft_id, make_op)
+        return found
+
+    def replace(self, draft_id, rows):
+        conn = self._conn()
+        with self._lock, conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._reset(conn, draft_id, [(i, i, row) for i, row in enumerate(rows, start=1)])
+            conn.execute("UPDATE log_drafts SET updated = ? WHERE draft_id = ?", (_now(), draft_id))
+
+    def drop(self, draft_id):
+        conn = self._conn()
+        with self._lock, conn:
+            self._delete_draft(conn, draft_id)
+
+    def revision(self, draft_id):
+        return self._read(draft_id, lambda state: state.seq)
+
+    def totals(self, draft_id):
+        def read(state):
+            if state.stored is None or state.stored["prices"] != self._totals.prices():
+                state.stored = self._built_totals([json.loads(text) for _, text in state.rows.values()])
+            return state.stored["totals"]
+        return self._read(draft_id, read)
+
+    def _history(self, conn, draft_id):
+        """Ångra- och gör om-stackarna som [(seq, operation att tillämpa)] ur de sparade operationerna."""
+        undo, redo = [], []
+        for seq, op in conn.execute("SELECT seq, op FROM draft_ops WHERE draft_id = ? ORDER BY seq", (draft_id,)):
+            op = json.loads(op)
+            kind = op["type"]
+            if kind == "reset":
+                undo, redo = [], []
+            elif kind == "undo":
+                undo = [entry for entry in undo if entry[0] != op["target"]]
+                redo.append((op["target"], _inverse(op["apply"])))
+            elif kind == "redo":
+                redo = [entry for entry in redo if entry[0] != op["target"]]
+                undo.append((op["target"], _inverse(op["apply"])))
+            else:
+                undo.append((seq, _inverse(op)))
+                redo = []
+        return undo, redo
+
+    def undo(self, draft_id):
+        def make_op(conn, state):
+            undo, _ = self._history(conn, draft_id)
+            return {"type": "undo", "target": undo[-1][0], "apply": undo[-1][1]} if undo else None
+        return self._write(draft_id, make_op) is not None
+
+    def redo(self, draft_id):
+        def make_op(conn, state):
+            _, redo = self._history(conn, draft_id)
+            return {"type": "redo", "target": redo[-1][0], "apply": redo[-1][1]} if redo else None
+        return self._write(draft_id, make_op) is not None
+
+
+def create_draft_store(kind, path, totals=None):
+    """Skapar utkastlagringen som anges i appens konfiguration."""
+    if kind == "files":
+        return FileDraftStore(path, totals=totals)
+    if kind == "sqlite":
+        return SqliteDraftStore(path, totals=totals)
+    if kind == "oplog":
+        return OpLogDraftStore(path, totals=totals)
+    raise ValueError(f"Okänd utkastlagring: {kind}")
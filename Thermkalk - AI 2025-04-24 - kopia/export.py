@@ -0,0 +1,167 @@
+# export.py
+#
+# Export av ett sparat anbud till Excel (.xlsx) eller CSV: materialspecifikationen,
+# beräkningen per kalkylrad och sammanställningen, i stället för att siffrorna
+# skrivs av från sidorna.
+#
+# Kalkylraderna läses en i taget ur databasen (db.iter_rows) och skrivs direkt
+# vidare, så att minnet inte växer med anbudets storlek. CSV-filen skickas i
+# bitar medan den skrivs. Excel-filen skrivs med openpyxl i write-only-läge,
+# där varje blad hamnar i en temporär fil i stället för i minnet. openpyxl
+# importeras först när en Excel-fil skrivs.
+
+import csv
+import io
+from typing import NamedTuple
+
+from aggregate import costed_rows, material_groups
+from db import iter_rows
+from totals import RunningTotals, bid_summary
+
+
+class Section(NamedTuple):
+    """Ett blad i Excel-filen (ett avsnitt i CSV-filen). rows skapas först när de läses."""
+    title: str
+    header: tuple
+    rows: object
+
+
+MATERIAL_HEADER = ("Artikelnamn", "Artikelnr", "Senast uppdaterad", "Mängd", "Enhet",
+                   "Á-pris (kr)", "Total kostnad (kr)")
+
+DETAIL_HEADER = (
+    "Nr", "Material", "Artikelnr material", "Isoleringstjocklek (mm)", "Ytbeklädnad",
+    "Artikelnr ytbeklädnad", "Dimension (mm)", "Längd (m)", "Isolering area (m²)", "Isolering (kr)",
+    "Arbetstid isolering (t)", "Höjdtillägg (%)", "Ytbeklädnad (kr)", "Ytbeklädnad area (m²)",
+    "Arbetstid ytbeklädnad (t)", "Tejp (rullar)", "Artikelnr tejp", "Tejp (kr)", "Spoltråd (kg)",
+    "Spoltråd (kr)", "Band (m)", "Band (kr)", "Arbetstid band (t)", "Rörstöd (antal)",
+    "Arbetstid rörstöd (t)", "Folie (m²)", "Folie (kr)", "Arbetstid folie (t)",
+    "Materialkostnad (kr)", "Arbetstid (t)",
+)
+
+# Anbudsinfo överst i sammanställningen
+BID_INFO_LABELS = (
+    ("Anbudsnamn", "Anbudsnamn"), ("Anbudsnummer", "Anbudsnummer"), ("Kund", "Kund"),
+    ("Projektledare", "Projektledare"), ("Kalkylansvarig", "Kalkylansvarig"),
+    ("Avdelning", "Avdelning"), ("projekt_typ", "Projekttyp"),
+)
+
+# Sammanställningens rader (nycklar från totals.bid_summary)
+SUMMARY_LABELS = (
+    ("total_isolering", "Material isolering (kr)"),
+    ("total_ytbekladnad_cost", "Material ytbeklädnad (kr)"),
+    ("total_accessories", "Material tillbehör (kr)"),
+    ("total_material_cost", "Total materialkostnad (kr)"),
+    ("total_work_time_calc", "Beräknad arbetstid (t)"),
+    ("multiplikator", "Multiplikator"),
+    ("hoejdtillaeg", "Höjdtillägg (%)"),
+    ("timtid", "Timtid (t)"),
+    ("total_work_time", "Total arbetstid (t)"),
+    ("hourly_wage", "Timlön (kr/timme)"),
+    ("labor_cost_per_hour", "Lön + sociala kostnader (kr/timme)"),
+    ("total_labor_cost", "Total lönekostnad (kr)"),
+    ("total_ue_cost", "UE-kostnader (kr)"),
+    ("diverse_cost", "Diverse förbrukning (kr)"),
+    ("servicebil_cost", "Servicebil (kr)"),
+    ("total_work_cost", "Total arbetskostnad (kr)"),
+    ("coverage_percentage", "Täckningsgrad (%)"),
+    ("final_price", "Slutpris (kr)"),
+    ("total_length", "Total längd (m)"),
+    ("labor_cost_per_meter", "Lönekostnad per meter (kr)"),
+    ("final_price_per_meter", "Slutpris per meter (kr)"),
+)
+
+
+def _material_rows(conn, bid_id, materialer):
+    groups = material_groups(iter_rows(conn, bid_id), materialer)
+    for group in groups:
+        yield (group.artikelnamn, group.artikelnr, group.senast_uppdaterad, group.mängd, group.enhet,
+               group.apris, group.total_cost)
+    yield ("Summa", "", "", "", "", "", sum(group.total_cost for group in groups))
+
+
+def _detail_values(nr, pipe, costs, materialer):
+    base = materialer.get(pipe.get("material_key") or "") or {}
+    cladding = materialer.get(pipe.get("ytbekladnad_key") or "") or {}
+    return (
+        nr, pipe.get("material", ""), base.get("artikelnr", ""), base.get("isoleringstjocklek", ""),
+        cladding.get("artikelnamn", ""), cladding.get("artikelnr", ""), pipe.get("dimension", ""),
+        pipe.get("length", 0), pipe.get("area", 0), pipe.get("price", 0),
+        pipe.get("work_time_isolering", 0), pipe.get("hojdtillagg", 0),
+        pipe.get("ytbekladnad_cost", 0), pipe.get("ytbekladnad_area", 0), pipe.get("work_time_ytbekladnad", 0),
+        pipe.get("tejp_quantity", 0), costs.tape_key or "", costs.tape_cost,
+        pipe.get("spoltrad_kg", 0), costs.spool_cost,
+        pipe.get("band_length", 0) if pipe.get("band") else 0, costs.band_cost, pipe.get("band_arbetstid", 0),
+        pipe.get("rorstod", 0), costs.rorstod_work,
+        pipe.get("foil_area", 0) if pipe.get("folie") else 0, costs.foil_cost, costs.foil_work,
+        costs.material_cost, costs.total_work,
+    )
+
+
+def _detail_rows(conn, bid_id, materialer, prices):
+    for nr, row in enumerate(iter_rows(conn, bid_id), start=1):
+        (pipe, costs), = costed_rows([row], materialer, prices)
+        yield _detail_values(nr, pipe, costs, materialer)
+
+
+def _summary_rows(conn, bid_id, bid_info, prices, settings):
+    for key, label in BID_INFO_LABELS:
+        yield (label, bid_info.get(key, ""))
+    yield ()
+    totals = RunningTotals(lambda: prices).build(iter_rows(conn, bid_id), prices)
+    figures = bid_summary(totals, prices, settings)
+    for key, label in SUMMARY_LABELS:
+        yield (label, figures[key])
+
+
+def bid_sections(conn, bid_id, bid_info, materialer, prices, settings):
+    """
+    Exportens avsnitt för ett sparat anbud. settings är sammanställningens
+    inställningar (timlön, täckningsgrad m.m.), t.ex. sessionen.
+    """
+    return (
+        Section("Materialspecifikation", MATERIAL_HEADER, _material_rows(conn, bid_id, materialer)),
+        Section("Beräkningar", DETAIL_HEADER, _detail_rows(conn, bid_id, materialer, prices)),
+        Section("Sammanställning", ("Post", "Värde"), _summary_rows(conn, bid_id, bid_info, prices, settings)),
+    )
+
+
+def write_xlsx(sections, out):
+    """Skriver avsnitten som blad i en xlsx-fil (sökväg eller skrivbar fil)."""
+    import openpyxl
+    wb = openpyxl.Workbook(write_only=True)
+    for section in sections:
+        ws = wb.create_sheet(section.title)
+        ws.append(section.header)
+        for row in section.rows:
+            ws.append(row)
+    wb.save(out)
+
+
+def _csv_value(value):
+    # Decimalkomma, så att svenska Excel läser talen rätt (avgränsaren är semikolon)
+    if isinstance(value, float):
+        return f"{value:.6f}".rstrip("0").rstrip(".").replace(".", ",")
+    return value
+
+
+def csv_chunks(sections, chunk_size=64 * 1024):
+    """
+    Avsnitten som en CSV-fil (UTF-8 med BOM, semikolon som avgränsare), i
+    bitar om ungefär chunk_size byte. Avsnitten skiljs av en tom rad och rubrik.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=";")
+    buffer.write("\ufeff")  # BOM, så att Excel läser filen som UTF-8
+    for index, section in enumerate(sections):
+        if index:
+            writer.writerow(())
+        writer.writerow((section.title,))
+        writer.writerow(section.header)
+        for row in section.rows:
+            writer.writerow([_csv_value(value) for value in row])
+            if buffer.tell() >= chunk_size:
+                yield buffer.getvalue().encode("utf-8")
+                buffer.seek(0)
+                buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
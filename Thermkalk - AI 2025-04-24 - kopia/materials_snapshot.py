@@ -0,0 +1,74 @@
+# materials_snapshot.py
+#
+# Förkompilerad ögonblicksbild av materialregistret. materials.py bygger en
+# stor dict och kör sedan flera uppdateringspass (rörskålar, tider, spill)
+# varje gång den importeras. Här sparas det färdiga resultatet i en
+# marshal-fil tillsammans med en hash av källfilen, så att appen bara
+# behöver läsa in filen. Ögonblicksbilden byggs om när materials.py ändras.
+#
+# Byggsteg (körs även automatiskt vid behov):
+#   python materials_snapshot.py
+
+import hashlib
+import marshal
+import os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_FILE = os.path.join(BASE_DIR, "materials.py")
+SNAPSHOT_FILE = os.path.join(BASE_DIR, "materials.snapshot")
+SNAPSHOT_FORMAT = 1
+
+_materialer = None
+
+
+def source_hash():
+    """SHA-256 av materials.py."""
+    with open(SOURCE_FILE, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def build_snapshot(path=SNAPSHOT_FILE):
+    """Kör materials.py och skriver det färdiga registret till ögonblicksbilden."""
+    digest = source_hash()
+    from materials import materialer
+    payload = {"format": SNAPSHOT_FORMAT, "hash": digest, "materialer": materialer}
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        marshal.dump(payload, f)
+    # Byt ut filen atomiskt så att andra arbetsprocesser aldrig läser en halv fil
+    os.replace(tmp_path, path)
+    return materialer
+
+
+def _read_snapshot(path, digest):
+    try:
+        with open(path, "rb") as f:
+            payload = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if not isinstance(payload, dict) or payload.get("format") != SNAPSHOT_FORMAT or payload.get("hash") != digest:
+        return None
+    return payload["materialer"]
+
+
+def get_materialer():
+    """
+    Returnerar materialregistret. Läses från ögonblicksbilden första gången
+    funktionen anropas; saknas den eller är den inaktuell byggs den om.
+    """
+    global _materialer
+    if _materialer is None:
+        materialer = _read_snapshot(SNAPSHOT_FILE, source_hash())
+        if materialer is None:
+            try:
+                materialer = build_snapshot()
+            except OSError:
+                # Skrivskyddad katalog: använd materials.py direkt
+                from materials import materialer
+        _materialer = materialer
+    return _materialer
+
+
+if __name__ == "__main__":
+    materialer = build_snapshot()
+    print(f"Skrev {len(materialer)} material till {SNAPSHOT_FILE}")
@@ -0,0 +1,239 @@
+# recipe_import.py
+#
+# Import av receptrader från en Excel- eller CSV-fil (t.ex. kundens
+# rörförteckning) till kalkylen. Filen läses rad för rad, kolumnerna
+# översätts till samma fält som formuläret på /calculate, varje rad
+# kontrolleras och alla giltiga rader räknas ut på en gång med batch_calc.
+#
+# Resultatet är raderna att lägga till i utkastet och en felrapport med
+# radnummer i filen (rubrikraden är rad 1).
+#
+# openpyxl och batch_calc (numpy) importeras först vid en import, inte när
+# appen startar.
+
+import csv
+import io
+import os
+
+# Rubriker som känns igen per fält (skiftlägesokänsligt). Formulärets
+# fältnamn och kolumnrubrikerna på /calculate fungerar båda.
+COLUMN_NAMES = {
+    "pipe_type": ("pipe_type", "rörtyp", "typ"),
+    "length": ("length", "längd", "längd (m)"),
+    "dimension": ("dimension", "dimension (mm)"),
+    "height": ("height", "höjd", "höjd (mm)"),
+    "width": ("width", "bredd", "bredd (mm)"),
+    "material": ("material", "isolering", "artikelnr", "artikelnr material"),
+    "ytbekladnad": ("ytbekladnad", "ytbeklädnad", "artikelnr ytbeklädnad"),
+    "hojdtillagg": ("hojdtillagg", "höjdtillägg", "höjdtillägg (%)"),
+    "bojar": ("bojar", "böjar", "böjar (antal)"),
+    "avstick": ("avstick", "avstick (antal)"),
+    "ventilkapor": ("ventilkapor", "ventilkåpor", "ventilkåpor (antal)"),
+    "flanskapa": ("flanskapa", "flänskåpor", "flänskåpor (antal)"),
+    "rorstod": ("rorstod", "rörstöd", "rörstöd (antal)"),
+    "folie": ("folie",),
+    "band": ("band",),
+    "distansjarn_material": ("distansjarn_material", "distansjärn"),
+    "distansjarn_procent": ("distansjarn_procent", "distansjärn (%)"),
+    "distansring": ("distansring",),
+    "objekt": ("objekt",),
+    "sektion": ("sektion",),
+}
+REQUIRED_COLUMNS = {"material": "Material", "length": "Längd"}
+
+# Talkolumner och hur de benämns i felrapporten
+NUMBER_COLUMNS = {
+    "length": "längd", "dimension": "dimension", "height": "höjd", "width": "bredd",
+    "hojdtillagg": "höjdtillägg", "bojar": "böjar", "avstick": "avstick",
+    "ventilkapor": "ventilkåpor", "flanskapa": "flänskåpor", "rorstod": "rörstöd",
+}
+PIPE_TYPES = ("Rör", "Fyrkantig")
+FLAG_VALUES = {"yes", "ja", "j", "x", "1", "true", "sant"}
+
+_HEADER_LOOKUP = {name: field for field, names in COLUMN_NAMES.items() for name in names}
+
+
+def _text(value):
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))  # t.ex. artikelnr som Excel har gjort till tal
+    return str(value).strip()
+
+
+def _workbook_rows(source):
+    """(radnummer, värden) för första bladet i en xlsx-fil, läst i read-only-läge."""
+    import openpyxl
+    wb = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    try:
+        for line, values in enumerate(wb.worksheets[0].iter_rows(values_only=True), start=1):
+            yield line, [_text(value) for value in values]
+    finally:
+        wb.close()
+
+
+def _csv_rows(source):
+    """(radnummer, värden) för en CSV-fil i UTF-8; avgränsaren (; , eller tab) gissas från rubrikraden."""
+    text = io.TextIOWrapper(source, encoding="utf-8-sig", newline="")
+    first = text.readline()
+    try:
+        dialect = csv.Sniffer().sniff(first, delimiters=";,\t")
+    except csv.Error:
+        dialect = csv.excel
+    for line, values in enumerate(csv.reader([first], dialect), start=1):
+        yield line, [_text(value) for value in values]
+    for line, values in enumerate(csv.reader(text, dialect), start=2):
+        yield line, [_text(value) for value in values]
+
+
+def read_rows(source, filename):
+    """Filens rader som (radnummer, värden); filtypen avgörs av filnamnet."""
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension in (".xlsx", ".xlsm"):
+        return _workbook_rows(source)
+    if extension in (".csv", ".txt"):
+        return _csv_rows(source)
+    raise ValueError("Filtypen stöds inte. Ladda upp en Excel-fil (.xlsx) eller en CSV-fil.")
+
+
+def _number(value):
+    """Talet som text med decimalpunkt ("1 200,5" -> "1200.5"), eller None om det inte är ett tal."""
+    normalized = value.replace(" ", "").replace("\u00a0", "").replace(",", ".")
+    try:
+        float(normalized)
+    except ValueError:
+        return None
+    return normalized
+
+
+class _Materials:
+    """
+    Slår upp material på nyckel (artikelnr) eller unikt artikelnamn. Artikelnr
+    som Excel har gjort till tal har tappat inledande nollor ("0020250070" ->
+    20250070) och hittas ändå, om bara ett artikelnr matchar.
+    """
+
+    def __init__(self, materialer):
+        self.materialer = materialer
+        by_name, by_number = {}, {}
+        for key, data in materialer.items():
+            name = str(data.get("artikelnamn", "")).casefold()
+            by_name[name] = None if name in by_name else key
+            if key.isdigit():
+                number = key.lstrip("0")
+                by_number[number] = None if number in by_number else key
+        self.by_name = by_name
+        self.by_number = by_number
+
+    def key(self, value):
+        if value in self.materialer:
+            return value
+        if value.isdigit():
+            return self.by_number.get(value.lstrip("0"))
+        return self.by_name.get(value.casefold())
+
+
+def _check(record, materials):
+    """Kontrollerar och normaliserar en rad (dict fält -> text). Returnerar ett felmeddelande eller None."""
+    for field, label in NUMBER_COLUMNS.items():
+        value = record.get(field, "")
+        if value:
+            number = _number(value)
+            if number is None:
+                return f"Ogiltigt värde för {label}: {value}"
+            record[field] = number
+
+    pipe_type = record.get("pipe_type", "")
+    for known in PIPE_TYPES:
+        if pipe_type.casefold() == known.casefold():
+            record["pipe_type"] = known
+            break
+    else:
+        if pipe_type:
+            return f"Okänd rörtyp: {pipe_type}"
+        record["pipe_type"] = "Rör"
+
+    material = record.get("material", "")
+    if material:
+        key = materials.key(material)
+        if key is None:
+            return f"Okänt material: {material}"
+        record["material"] = key
+    cladding = record.get("ytbekladnad", "")
+    if cladding:
+        key = materials.key(cladding)
+        if key is None:
+            return f"Okänd ytbeklädnad: {cladding}"
+        record["ytbekladnad"] = key
+
+    for field in ("folie", "band"):
+        record[field] = "yes" if record.get(field, "").casefold() in FLAG_VALUES else ""
+    return None
+
+
+def import_recipes(source, filename, materialer, max_rows=None):
+    """
+    Läser receptraderna i filen och räknar ut dem. Returnerar (rader, rapport)
+    där rader är färdiga kalkylrader (som från calculate_pipe) och rapport är
+    {"rows": antal rader i filen, "imported": antal giltiga,
+     "errors": [{"line": radnummer, "error": meddelande}], "ignored_columns": [...]}.
+    Tomma rader hoppas över. Oläsbara filer och saknade kolumner ger ValueError.
+    """
+    materials = _Materials(materialer)
+    lines = iter(read_rows(source, filename))
+    try:
+        header = next((values for _, values in lines if any(values)), None)
+    except (UnicodeDecodeError, csv.Error) as exc:
+        raise ValueError("Filen kunde inte läsas.") from exc
+    if header is None:
+        raise ValueError("Filen är tom.")
+
+    columns, ignored = {}, []
+    for position, name in enumerate(header):
+        field = _HEADER_LOOKUP.get(name.casefold())
+        if field and field not in columns:
+            columns[field] = position
+        elif name:
+            ignored.append(name)
+    missing = [label for field, label in REQUIRED_COLUMNS.items() if field not in columns]
+    if missing:
+        raise ValueError(f"Kolumner saknas: {', '.join(missing)}.")
+
+    records, record_lines, errors = [], [], []
+    total = 0
+    try:
+        for line, values in lines:
+            if not any(values):
+                continue
+            total += 1
+            if max_rows is not None and total > max_rows:
+                raise ValueError(f"Filen har fler än {max_rows} rader.")
+            record = {field: values[position] if position < len(values) else ""
+                      for field, position in columns.items()}
+            error = _check(record, materials)
+            if error:
+                errors.append({"line": line, "error": error})
+                continue
+            records.append(record)
+            record_lines.append(line)
+    except (UnicodeDecodeError, csv.Error) as exc:
+        raise ValueError("Filen kunde inte läsas.") from exc
+
+    rows = []
+    if records:
+        from batch_calc import calculate_pipes, to_rows
+        fields = [field for field in COLUMN_NAMES if field in columns]
+        result = calculate_pipes({field: [record.get(field, "") for record in records] for field in fields
+                                  if field not in ("objekt", "sektion")}, materialer)
+        calculated, failed = to_rows(result, materialer)
+        errors.extend({"line": record_lines[i], "error": message} for i, message in failed)
+        failed_indices = {i for i, _ in failed}
+        valid = (i for i in range(len(records)) if i not in failed_indices)
+        for i, row in zip(valid, calculated):
+            for field in ("objekt", "sektion"):
+                if field in columns:
+                    row[field] = records[i][field]
+            rows.append(row)
+
+    errors.sort(key=lambda error: error["line"])
+    return rows, {"rows": total, "imported": len(rows), "errors": errors, "ignored_columns": ignored}
@@ -3,5 +3,8 @@
 # Install dependencies
 pip install -r requirements.txt
 
+# Build the material catalog snapshot
+python materials_snapshot.py
+
 # Start the application
 python app.py
\ No newline at end of file
@@ -0,0 +1,51 @@
+# test_db.py
+#
+# Regressionstester för db.py. Körs med: python -m pytest -q
+
+import threading
+
+import db
+
+
+def _row(i):
+    return {"material": f"Rörskål {i % 7}", "objekt": f"Objekt {i}", "length": i}
+
+
+def test_interleaved_saves_keep_revisions_consistent(tmp_path, monkeypatch):
+    # En andra sparning av samma anbud startar precis när den första har läst
+    # den sparade versionen. Den andra ska vänta på skrivlåset, så att varje
+    # version fortfarande läses tillbaka exakt som den sparades.
+    path = str(tmp_path / "anbud.db")
+    db.init_db(path)
+    first = db.get_db_connection(path)
+    base = [_row(i) for i in range(50)]
+    saved = {"Bas": base, "A": base[:10] + [_row(100)] + base[10:], "B": base[:40] + [_row(200)]}
+    bid_id = db.save_bid_record(first, {"Anbudsnamn": "Bas"}, base, "2025-01-01 00:00:00")
+
+    def save_other():
+        second = db.get_db_connection(path)
+        db.save_bid_record(second, {"Anbudsnamn": "B"}, saved["B"], "2025-01-01 00:00:02", bid_id)
+        second.close()
+
+    current_version = db._current_version
+    other = threading.Thread(target=save_other)
+
+    def interleaved(conn, bid):
+        found = current_version(conn, bid)
+        if conn is first:
+            other.start()
+            other.join(0.5)  # utan skrivlåset hinner den andra sparningen klart här
+        return found
+
+    monkeypatch.setattr(db, "_current_version", interleaved)
+    db.save_bid_record(first, {"Anbudsnamn": "A"}, saved["A"], "2025-01-01 00:00:01", bid_id)
+    other.join()
+
+    revisions = db.list_revisions(first, bid_id)
+    assert len(revisions) == 3
+    for revision in revisions:
+        bid_data = db.load_revision(first, bid_id, revision["revision"])
+        assert bid_data["kalkyl"] == saved[bid_data["bid_info"]["Anbudsnamn"]]
+    _, latest = db.load_bid(first, bid_id)
+    assert db.load_revision(first, bid_id, revisions[0]["revision"]) == latest
+    first.close()
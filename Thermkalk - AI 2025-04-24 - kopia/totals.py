@@ -0,0 +1,160 @@
+# totals.py
+#
+# Löpande summor för ett utkast: materialkostnad per kategori, arbetstid och
+# total längd. Tidigare gick /detailed_calculations och /sammanstallning igenom
+# alla rader vid varje visning. Nu håller utkastlagringen (drafts.py) summorna
+# och justerar dem med en rads bidrag när raden läggs till, ändras eller tas
+# bort, så att en ändring kostar lika mycket oavsett hur många rader kalkylen har.
+#
+# Summan av radvis avrundade materialkostnader beror på tillbehörspriserna.
+# Summorna sparas därför tillsammans med de priser de räknades med och
+# räknas om från raderna om priserna har ändrats. Radens kostnader och tider
+# räknas med aggregate.row_costs, samma som vyerna använder.
+
+from aggregate import TAPE, TAPE_LAMELL, SPOOL, row_costs
+
+TOTAL_FIELDS = (
+    "rows",                   # antal rader
+    "length",                 # total längd (m)
+    "isolering",              # isoleringskostnad (price)
+    "ytbekladnad",            # kostnad för ytbeklädnad
+    "tejp_quantity",          # antal tejprullar, alla rader
+    "tejp_lamell",            # tejprullar på rader med lamellmatta
+    "tejp_fire_mat",          # tejprullar på rader med Conlit Fire Mat
+    "spoltrad_kg",
+    "band_length",            # bandlängd på rader med band
+    "foil_area",
+    "work_time",              # isolering + ytbeklädnad + band + folie (h)
+    "material_cost_rounded",  # summan av radvis avrundad materialkostnad
+)
+
+
+class RunningTotals:
+    """
+    Räknar fram en rads bidrag till summorna och lägger ihop eller drar
+    ifrån bidrag. prices är en funktion som ger tillbehörspriserna
+    ({artikelnr: kostnad}) för aggregate.PRICE_KEYS.
+    """
+
+    def __init__(self, prices):
+        self.prices = prices
+
+    def empty(self):
+        return dict.fromkeys(TOTAL_FIELDS, 0)
+
+    def contribution(self, row, prices):
+        costs = row_costs(row, prices)
+        tejp = row.get("tejp_quantity") or 0
+        return {
+            "rows": 1,
+            "length": row.get("length", 0),
+            "isolering": row.get("price", 0),
+            "ytbekladnad": row.get("ytbekladnad_cost", 0),
+            "tejp_quantity": row.get("tejp_quantity", 0),
+            "tejp_lamell": tejp if costs.tape_key == TAPE_LAMELL else 0,
+            "tejp_fire_mat": tejp if costs.tape_key == TAPE else 0,
+            "spoltrad_kg": row.get("spoltrad_kg", 0),
+            "band_length": row.get("band_length", 0) if row.get("band") else 0,
+            "foil_area": row.get("foil_area", 0),
+            "work_time": costs.work_time,
+            # Samma avrundning per rad som sidan Detaljerade beräkningar visar
+            "material_cost_rounded": round(costs.material_cost, 0),
+        }
+
+    def apply(self, totals, prices, added=(), removed=()):
+        """Ny summa efter att raderna i added lagts till och de i removed tagits bort."""
+        totals = dict(totals)
+        for rows, sign in ((added, 1), (removed, -1)):
+            for row in rows:
+                for field, value in self.contribution(row, prices).items():
+                    totals[field] += sign * value
+        if totals["rows"] == 0:
+            # Ingen ackumulerad avrundning kvar när kalkylen är tom
+            return self.empty()
+        return totals
+
+    def build(self, rows, prices):
+        """Summorna räknade från början (när sparade summor saknas eller är inaktuella)."""
+        return self.apply(self.empty(), prices, added=rows)
+
+
+def bid_summary(totals, prices, settings):
+    """
+    Sammanställningens siffror: material- och arbetskostnader och slutpris
+    från summorna och inställningarna på sidan (multiplikator, timlön,
+    UE-kostnader, täckningsgrad m.m.; settings är t.ex. sessionen).
+    Nycklarna är sammanstallning.html:s variabelnamn.
+    """
+    # Materialkostnader
+    total_isolering = totals["isolering"]
+    total_ytbekladnad = totals["ytbekladnad"]
+    total_tape_cost = totals["tejp_quantity"] * prices[TAPE]
+    total_spool_cost = totals["spoltrad_kg"] * prices[SPOOL]
+    total_tillbehor = total_tape_cost + total_spool_cost
+    total_material_cost = total_isolering + total_ytbekladnad + total_tillbehor
+
+    # Arbetstid (beräknad från receptet)
+    total_work_time_calc = totals["work_time"]
+
+    # Hämta multiplikator, höjdtillägg och timtid – med defaultvärden
+    multiplikator = float(settings.get("multiplikator") or 1)
+    hoejdtillaeg = float(settings.get("hoejdtillaeg") or 0)  # i procent
+    timtid = float(settings.get("timtid") or 0)             # extra timmar att lägga till
+
+    # Beräkna total arbetstid med nya värden
+    total_work_time = total_work_time_calc * multiplikator * (1 + hoejdtillaeg/100) + timtid
+
+    # Timlön
+    hourly_wage = float(settings.get("hourly_wage") or 252)
+    labor_cost_per_hour = hourly_wage * 1.70
+    total_labor_cost = total_work_time * labor_cost_per_hour
+
+    # UE‑kostnader
+    ue_cost = float(settings.get("ue_cost") or 0)
+    ue_hours = float(settings.get("ue_hours") or 0)
+    ue_montage = float(settings.get("ue_montage") or 0)
+    ue_tillverkning = float(settings.get("ue_tillverkning") or 0)
+    total_ue_cost = ue_cost + ue_hours + ue_montage + ue_tillverkning
+
+    diverse_cost = total_material_cost * 0.015
+    servicebil_days = float(settings.get("servicebil_days") or 0)
+    servicebil_cost = servicebil_days * 400
+
+    total_work_cost = total_labor_cost + total_ue_cost + diverse_cost + servicebil_cost
+
+    coverage_percentage = float(settings.get("coverage_percentage") or 0)
+    coverage_rate = coverage_percentage / 100.0
+    final_price = (total_material_cost + total_work_cost) / (1 - coverage_rate) if coverage_rate < 1 else 0
+
+    total_length = totals["length"]
+    labor_cost_per_meter = total_length > 0 and (total_labor_cost / total_length) or 0
+    final_price_per_meter = total_length > 0 and (final_price / total_length) or 0
+
+    return {
+        "total_isolering": total_isolering,
+        "total_ytbekladnad_cost": total_ytbekladnad,
+        "total_accessories": total_tillbehor,
+        "total_material_cost": total_material_cost,
+        "total_work_time_calc": total_work_time_calc,
+        "multiplikator": multiplikator,
+        "hoejdtillaeg": hoejdtillaeg,
+        "timtid": timtid,
+        "total_work_time": total_work_time,
+        "hourly_wage": hourly_wage,
+        "labor_cost_per_hour": labor_cost_per_hour,
+        "total_labor_cost": total_labor_cost,
+        "ue_cost": ue_cost,
+        "ue_hours": ue_hours,
+        "ue_montage": ue_montage,
+        "ue_tillverkning": ue_tillverkning,
+        "total_ue_cost": total_ue_cost,
+        "diverse_cost": diverse_cost,
+        "servicebil_days": servicebil_days,
+        "servicebil_cost": servicebil_cost,
+        "total_work_cost": total_work_cost,
+        "coverage_percentage": coverage_percentage,
+        "final_price": final_price,
+        "total_length": total_length,
+        "labor_cost_per_meter": labor_cost_per_meter,
+        "final_price_per_meter": final_price_per_meter,
+    }